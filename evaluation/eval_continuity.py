@@ -24,34 +24,51 @@ Directory layout (example):
 
 Outputs (example):
   ../out_continuity_eval/
-    batch_input.jsonl
-    batch_output.jsonl
-    batch_error.jsonl (if any)
+    batch_input.0000.jsonl, batch_input.0001.jsonl, ...   (one shard per submitted batch)
+    batch_output.0000.jsonl, ...
+    batch_error.0000.jsonl, ... (if any)
     request_index.json
-    results.jsonl
-    results.xlsx
+    attached_files.json (--attach_min_bytes > 0)
+    results.jsonl     (--output_formats jsonl)
+    results.parquet   (--output_formats parquet)
+    results.xlsx      (--output_formats xlsx)
     readable/
       combined_readable.json
-      per_item/
+      per_item.jsonl         (--per_item_format jsonl, default)
+      per_item/              (--per_item_format files)
         <custom_id>.json
 
 Requires:
-  pip install --upgrade openai pandas openpyxl
+  pip install --upgrade openai pandas pyarrow
+  (optional, faster JSON: pip install orjson)
+  (xlsx output additionally needs: pip install xlsxwriter)
 Env:
   OPENAI_API_KEY=...
 """
 
 import argparse
+import asyncio
+import functools
+import hashlib
+import itertools
 import json
 import os
+import random
 import re
 import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import pandas as pd
-from openai import OpenAI
+try:
+    import orjson
+except ImportError:  # optional speedup, see dumps_line / loads
+    orjson = None
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI
 
 
 # -------------------------
@@ -122,6 +139,10 @@ def as_dict(obj: Any) -> Dict[str, Any]:
     return {}
 
 
+# Large buffer for the .jsonl writers: lines are written as raw UTF-8 bytes
+JSONL_WRITE_BUFFER = 1 << 20
+
+
 def safe_mkdir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
@@ -130,13 +151,52 @@ def read_text(path: Path) -> str:
     return path.read_text(encoding="utf-8")
 
 
-def load_json(path: Path) -> Any:
+# orjson (C, emits UTF-8 bytes) on the hot paths when installed; stdlib json otherwise.
+if orjson is not None:
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
+@functools.lru_cache(maxsize=2048)
+def _load_json_cached(path_str: str, mtime_ns: int, size: int) -> Any:
+    raw = Path(path_str).read_bytes()
     # handle possible UTF-8 BOM on Windows
-    raw = path.read_text(encoding="utf-8-sig")
-    return json.loads(raw)
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    return loads(raw)
+
+
+def load_json(path: Path) -> Any:
+    """
+    Parsed JSON of path, memoized on (path, mtime_ns, size) so an edited file is re-read.
+    The returned object is shared between callers: treat it as read-only.
+    """
+    st = path.stat()
+    return _load_json_cached(str(path), st.st_mtime_ns, st.st_size)
 
 
-def json_canonical_dumps(data: Any) -> str:
+def json_canonical_dumps(data: Any, compact: bool = False) -> str:
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if compact else orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option).decode("utf-8")
+    if compact:
+        # the judge does not need pretty-printing; compact form roughly halves the payload
+        return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
     return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
 
 
@@ -173,7 +233,7 @@ def try_parse_json(text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     Parse JSON robustly; if it fails, return error string.
     """
     try:
-        return json.loads(text), None
+        return loads(text), None
     except Exception as e:
         return None, f"{type(e).__name__}: {e}"
 
@@ -181,7 +241,7 @@ def try_parse_json(text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
 # -------------------------
 # Data discovery
 # -------------------------
-CHAT_FILE_RE = re.compile(r"^chat(\d+)\.json$", re.IGNORECASE)
+CHAT_FILE_RE = re.compile(r"chat(\d+)\.json", re.IGNORECASE)  # used with fullmatch
 
 
 def discover_users(user_data_dir: Path) -> List[Path]:
@@ -193,19 +253,65 @@ def discover_chats_for_user(user_dir: Path) -> List[Tuple[int, Path]]:
     if not chats_dir.exists():
         return []
     pairs: List[Tuple[int, Path]] = []
-    for p in chats_dir.iterdir():
-        if not p.is_file():
-            continue
-        if p.name.lower() == "chat_index.json":
-            continue
-        m = CHAT_FILE_RE.match(p.name)
-        if m:
-            idx = int(m.group(1))
-            pairs.append((idx, p))
+    # scandir's DirEntry.is_file() needs no extra stat on Linux; the cheap prefix/suffix test
+    # skips chat_index.json, coach state, reports etc. before the regex runs.
+    with os.scandir(chats_dir) as it:
+        for entry in it:
+            name = entry.name
+            low = name.lower()
+            if not (low.startswith("chat") and low.endswith(".json")):
+                continue
+            m = CHAT_FILE_RE.fullmatch(name)
+            if m and entry.is_file():
+                pairs.append((int(m.group(1)), Path(entry.path)))
     pairs.sort(key=lambda x: x[0])
     return pairs
 
 
+DISCOVERY_CACHE_NAME = ".discovery_cache.json"
+
+
+def load_discovery_cache(path: Path) -> Dict[str, Any]:
+    """Manifest of previously discovered chat listings: {user_dir: {"sig": [...], "chats": [...]}}."""
+    try:
+        cache = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def save_discovery_cache(path: Path, cache: Dict[str, Any]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(cache, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def discover_chats_cached(user_dir: Path, cache: Dict[str, Any]) -> List[Tuple[int, Path]]:
+    """
+    discover_chats_for_user, reusing the manifest entry while the chats/ directory is unchanged.
+    Adding, removing or renaming a chat file bumps the directory mtime and forces a re-scan;
+    file contents are always loaded fresh, so only the listing is cached.
+    """
+    chats_dir = user_dir / "chats"
+    try:
+        st = chats_dir.stat()
+    except OSError:
+        return []
+    key = str(user_dir)
+    sig = [st.st_mtime_ns, st.st_ino]
+    entry = cache.get(key)
+    if isinstance(entry, dict) and entry.get("sig") == sig:
+        return [(int(c[0]), Path(c[1])) for c in entry.get("chats", [])]
+
+    chats = discover_chats_for_user(user_dir)
+    listing = []
+    for idx, p in chats:
+        pst = p.stat()
+        listing.append([idx, str(p), pst.st_mtime_ns, pst.st_size])
+    cache[key] = {"sig": sig, "chats": listing}
+    return chats
+
+
 def build_consecutive_pairs(chat_list: List[Tuple[int, Path]]) -> List[Tuple[int, Path, int, Path]]:
     """
     Given sorted chats [(1,path1),(2,path2),...], produce consecutive pairs:
@@ -220,19 +326,194 @@ def build_consecutive_pairs(chat_list: List[Tuple[int, Path]]) -> List[Tuple[int
 # -------------------------
 # Batch input builder
 # -------------------------
+def input_text_part(text: str) -> bytes:
+    """JSON-encoded {"type": "input_text", "text": ...} content part."""
+    return b'{"type":"input_text","text":' + dumps_bytes(text) + b"}"
+
+
+def input_file_part(file_id: str) -> bytes:
+    """JSON-encoded {"type": "input_file", "file_id": ...} content part."""
+    return b'{"type":"input_file","file_id":' + dumps_bytes(file_id) + b"}"
+
+
+class SessionFileUploader:
+    """
+    Upload large canonical sessions once (purpose="user_data") so requests can reference them
+    as input_file parts instead of inlining a JSON-escaped copy. Uploads are deduplicated by
+    content hash and safe to call from the prepare_user thread pool.
+    """
+
+    def __init__(self, client: OpenAI) -> None:
+        self._client = client
+        self._lock = threading.Lock()
+        self._key_locks: Dict[bytes, threading.Lock] = {}
+        self.file_ids: Dict[str, str] = {}  # content hash (hex) -> file_id
+
+    def file_id_for(self, canon: str) -> str:
+        data = canon.encode("utf-8")
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            file_id = self.file_ids.get(key.hex())
+            if file_id is None:
+                uploaded = self._client.files.create(
+                    file=(f"session_{key.hex()}.json", data, "application/json"),
+                    purpose="user_data",
+                )
+                file_id = uploaded.id
+                self.file_ids[key.hex()] = file_id
+            return file_id
+
+
+# Fixed scaffolding around the two session transcripts in the user message
+PAIR_PROMPT_PARTS = (
+    input_text_part("Evaluate continuity between two consecutive sessions.\n\n<SESSION_1_JSON>"),
+    input_text_part("</SESSION_1_JSON>\n\n<SESSION_2_JSON>"),
+    input_text_part("</SESSION_2_JSON>"),
+)
+
+
+def make_batch_line_encoder(
+    model: str,
+    system_prompt: str,
+    reasoning_effort: str,
+    store: bool = False,
+) -> Callable[[str, bytes], bytes]:
+    """
+    Return encode_line(custom_id, user_content_json) -> one /v1/responses batch line (UTF-8, no newline).
+    user_content_json is the already JSON-encoded value of the user message "content".
+
+    Everything except custom_id and the user content is constant for the whole batch,
+    so the (multi-KB) system prompt is JSON-escaped once here instead of once per line.
+    """
+    # IMPORTANT: Do NOT include temperature for gpt-5.2-pro with reasoning != none.
+    head = b'{"custom_id":'
+    mid = (
+        b',"method":"POST","url":"/v1/responses","body":{"model":' + dumps_bytes(model)
+        + b',"input":[{"role":"system","content":' + dumps_bytes(system_prompt)
+        + b'},{"role":"user","content":'
+    )
+    tail = b'}],"reasoning":{"effort":' + dumps_bytes(reasoning_effort) + b'},"store":' + dumps_bytes(store) + b"}}"
+
+    def encode_line(custom_id: str, user_content_json: bytes) -> bytes:
+        return b"".join((head, dumps_bytes(custom_id), mid, user_content_json, tail))
+
+    return encode_line
+
+
+def prepare_user(
+    user_dir: Path,
+    encode_line: Callable[[str, bytes], bytes],
+    discovery_cache: Optional[Dict[str, Any]] = None,
+    uploader: Optional[SessionFileUploader] = None,
+    attach_min_bytes: int = 0,
+) -> List[Tuple[Dict[str, Any], bytes, bytes]]:
+    """
+    Discover one user's chats, build consecutive pairs and serialize their batch lines.
+    Returns [(req_meta, pair_key, jsonl_line_utf8), ...] in pair order (empty if fewer than 2 chats);
+    pair_key is a digest of the two canonical sessions, identical pairs share it.
+    With an uploader, sessions whose canonical form is >= attach_min_bytes are sent as input_file parts.
+    """
+    user_id = user_dir.name
+    if discovery_cache is not None:
+        chats = discover_chats_cached(user_dir, discovery_cache)
+    else:
+        chats = discover_chats_for_user(user_dir)
+    if len(chats) < 2:
+        return []
+
+    # Each session file appears in up to two pairs (as prev and as curr);
+    # load + canonicalize + JSON-escape it into an input_text part only once.
+    canon_cache: Dict[Path, bytes] = {}
+
+    def canon(p: Path) -> bytes:
+        part = canon_cache.get(p)
+        if part is None:
+            text = json_canonical_dumps(load_json(p), compact=True)
+            if uploader is not None and len(text.encode("utf-8")) >= attach_min_bytes:
+                part = input_file_part(uploader.file_id_for(text))
+            else:
+                part = input_text_part(text)
+            canon_cache[p] = part
+        return part
+
+    out: List[Tuple[Dict[str, Any], bytes, bytes]] = []
+    for s1_idx, s1_path, s2_idx, s2_path in build_consecutive_pairs(chats):
+        custom_id = f"{user_id}__{s1_idx}-{s2_idx}"
+        # Keep stable mapping for later lookup
+        req_meta = {
+            "custom_id": custom_id,
+            "user_id": user_id,
+            "pair_id": f"{s1_idx}-{s2_idx}",
+            "session_prev": s1_idx,
+            "session_curr": s2_idx,
+            "file_prev": str(s1_path),
+            "file_curr": str(s2_path),
+        }
+
+        s1_part, s2_part = canon(s1_path), canon(s2_path)
+        pair_key = hashlib.blake2b(s1_part + b"\x00" + s2_part, digest_size=16).digest()
+        intro, between, outro = PAIR_PROMPT_PARTS
+        user_content = b"[" + b",".join((intro, s1_part, between, s2_part, outro)) + b"]"
+        out.append((req_meta, pair_key, encode_line(custom_id, user_content)))
+    return out
+
+
+# OpenAI caps a batch input file at 50k requests / 200 MB; stay well under both
+SHARD_MAX_LINES = 40_000
+SHARD_MAX_BYTES = 90 * 1024 * 1024
+
+
+def shard_path(out_dir: Path, kind: str, shard: int) -> Path:
+    """<out_dir>/<kind>.<shard:04d>.jsonl, e.g. batch_input.0003.jsonl"""
+    return out_dir / f"{kind}.{shard:04d}.jsonl"
+
+
+def sibling_shard_path(batch_input_jsonl: Path, kind: str) -> Path:
+    """batch_input.0003.jsonl -> <kind>.0003.jsonl in the same directory"""
+    return batch_input_jsonl.with_name(batch_input_jsonl.name.replace("batch_input", kind, 1))
+
+
 def build_batch_input_jsonl(
     user_data_dir: Path,
-    out_jsonl: Path,
+    out_dir: Path,
     request_index_path: Path,
     model: str,
     system_prompt: str,
     reasoning_effort: str,
     store: bool = False,
     user_filter: Optional[str] = None,
-) -> List[Dict[str, Any]]:
+    discovery_cache_path: Optional[Path] = None,
+    skip_custom_ids: Optional[Set[str]] = None,
+    dedupe: bool = True,
+    shard_max_lines: int = SHARD_MAX_LINES,
+    shard_max_bytes: int = SHARD_MAX_BYTES,
+    attach_min_bytes: int = 0,
+) -> Tuple[List[Dict[str, Any]], List[Path]]:
     """
-    Build batch input jsonl for /v1/responses and write request_index.json
-    Returns request_index list of dicts.
+    Build batch input jsonl shards for /v1/responses and write request_index.json
+    Returns (request_index list of dicts, shard paths).
+
+    Lines go to <out_dir>/batch_input.0000.jsonl, rotating to the next shard whenever adding a
+    line would exceed shard_max_lines or shard_max_bytes; each shard is submitted as its own batch.
+
+    Pairs whose custom_id is in skip_custom_ids (already judged, see --resume) are left out;
+    the result is empty only when every discovered pair was skipped.
+
+    With dedupe=True a pair whose two canonical sessions are identical to an earlier pair is not
+    submitted again: its request_index entry gets "duplicate_of": <first custom_id> (also written
+    to duplicates.json) and expand_duplicates() fans the judged result back out after parsing.
+
+    If attach_min_bytes > 0, sessions whose canonical JSON is at least that large are uploaded once
+    (purpose="user_data", deduplicated by content) and referenced as input_file parts; the uploaded
+    file ids are recorded in attached_files.json next to request_index.json.
+
+    If discovery_cache_path is given, chat listings are reused from (and written back to)
+    that manifest for users whose chats/ directory has not changed since the last run.
+
+    Per-user discovery + loading runs on a thread pool so filesystem waits overlap;
+    lines are written sequentially in user order to keep the output deterministic.
     """
     users = discover_users(user_data_dir)
     if user_filter:
@@ -240,139 +521,407 @@ def build_batch_input_jsonl(
 
     request_index: List[Dict[str, Any]] = []
     lines_written = 0
+    lines_skipped = 0
+    seen_pairs: Dict[bytes, str] = {}
+    duplicates: Dict[str, str] = {}
+
+    discovery_cache = load_discovery_cache(discovery_cache_path) if discovery_cache_path else None
+    encode_line = make_batch_line_encoder(model, system_prompt, reasoning_effort, store)
+    uploader = SessionFileUploader(OpenAI()) if attach_min_bytes > 0 else None
+
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        prepared = list(
+            ex.map(
+                lambda u: prepare_user(u, encode_line, discovery_cache, uploader, attach_min_bytes),
+                users,
+            )
+        )
 
-    with out_jsonl.open("w", encoding="utf-8") as f:
-        for user_dir in users:
-            user_id = user_dir.name
-            chats = discover_chats_for_user(user_dir)
-            if len(chats) < 2:
-                continue
+    if discovery_cache_path and discovery_cache is not None:
+        save_discovery_cache(discovery_cache_path, discovery_cache)
 
-            pairs = build_consecutive_pairs(chats)
-            for s1_idx, s1_path, s2_idx, s2_path in pairs:
-                custom_id = f"{user_id}__{s1_idx}-{s2_idx}"
-                # Keep stable mapping for later lookup
-                req_meta = {
-                    "custom_id": custom_id,
-                    "user_id": user_id,
-                    "pair_id": f"{s1_idx}-{s2_idx}",
-                    "session_prev": s1_idx,
-                    "session_curr": s2_idx,
-                    "file_prev": str(s1_path),
-                    "file_curr": str(s2_path),
-                }
-                request_index.append(req_meta)
+    # Sanity-check the hand-assembled encoding once
+    first = next((lines[0][2] for lines in prepared if lines), None)
+    if first is not None:
+        body = loads(first)["body"]
+        if body["input"][0]["content"] != system_prompt or body["model"] != model:
+            raise RuntimeError("Batch line encoder produced an unexpected request body")
 
-                s1_json = load_json(s1_path)
-                s2_json = load_json(s2_path)
-
-                user_payload = (
-                    "Evaluate continuity between two consecutive sessions.\n\n"
-                    "<SESSION_1_JSON>\n"
-                    f"{json_canonical_dumps(s1_json)}\n"
-                    "</SESSION_1_JSON>\n\n"
-                    "<SESSION_2_JSON>\n"
-                    f"{json_canonical_dumps(s2_json)}\n"
-                    "</SESSION_2_JSON>\n"
-                )
+    # Drop shards left over from an earlier, larger run
+    for stale in out_dir.glob("batch_input.*.jsonl"):
+        stale.unlink()
 
-                # IMPORTANT: Do NOT include temperature for gpt-5.2-pro with reasoning != none.
-                body = {
-                    "model": model,
-                    "input": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_payload},
-                    ],
-                    "reasoning": {"effort": reasoning_effort},
-                    "store": store,
-                }
-
-                line = {
-                    "custom_id": custom_id,
-                    "method": "POST",
-                    "url": "/v1/responses",
-                    "body": body,
-                }
-                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    shard_paths: List[Path] = []
+    f = None
+    shard_lines = shard_bytes = 0
+    try:
+        for user_lines in prepared:
+            for req_meta, pair_key, line in user_lines:
+                custom_id = req_meta["custom_id"]
+                if skip_custom_ids and custom_id in skip_custom_ids:
+                    lines_skipped += 1
+                    continue
+                if dedupe:
+                    first_cid = seen_pairs.setdefault(pair_key, custom_id)
+                    if first_cid != custom_id:
+                        req_meta["duplicate_of"] = first_cid
+                        duplicates[custom_id] = first_cid
+                        request_index.append(req_meta)
+                        continue
+                request_index.append(req_meta)
+                n_bytes = len(line) + 1
+                if f is None or shard_lines >= shard_max_lines or shard_bytes + n_bytes > shard_max_bytes:
+                    if f is not None:
+                        f.close()
+                    shard_paths.append(shard_path(out_dir, "batch_input", len(shard_paths)))
+                    f = shard_paths[-1].open("wb", buffering=JSONL_WRITE_BUFFER)
+                    shard_lines = shard_bytes = 0
+                f.write(line)
+                f.write(b"\n")
+                shard_lines += 1
+                shard_bytes += n_bytes
                 lines_written += 1
+    finally:
+        if f is not None:
+            f.close()
 
     request_index_path.write_text(json.dumps(request_index, ensure_ascii=False, indent=2), encoding="utf-8")
+    (request_index_path.parent / "duplicates.json").write_text(
+        json.dumps(duplicates, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    if uploader is not None:
+        (request_index_path.parent / "attached_files.json").write_text(
+            json.dumps(uploader.file_ids, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        print(f"  Attached {len(uploader.file_ids)} large session(s) as input_file uploads")
 
-    if lines_written == 0:
+    if lines_written == 0 and lines_skipped == 0:
         raise RuntimeError(f"No requests built. Check user_data_dir={user_data_dir} and chat files.")
 
-    return request_index
+    return request_index, shard_paths
+
+
+def expand_duplicates(
+    records: Iterable[Dict[str, Any]], request_index: List[Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    """Yield each judged record, followed by a copy for every custom_id marked "duplicate_of" it."""
+    children: Dict[str, List[str]] = {}
+    for meta in request_index:
+        first_cid = meta.get("duplicate_of")
+        if first_cid:
+            children.setdefault(first_cid, []).append(meta["custom_id"])
+    for rec in records:
+        yield rec
+        for cid in children.get(rec["custom_id"], ()):
+            yield {**rec, "custom_id": cid}
+
+
+DONE_IDS_NAME = "done_custom_ids.txt"
+
+
+def load_done_custom_ids(path: Path) -> Set[str]:
+    """custom_ids recorded as successfully judged by earlier runs (one per line)."""
+    if not path.exists():
+        return set()
+    with path.open("r", encoding="utf-8") as fh:
+        return {line.strip() for line in fh if line.strip()}
 
 
 # -------------------------
 # Batch polling + download
 # -------------------------
-def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: int = 15) -> Any:
-    terminal = {"completed", "failed", "expired", "cancelled"}
+TERMINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def is_transient_api_error(e: Exception) -> bool:
+    """Rate limits, server errors and connection drops are worth retrying."""
+    if isinstance(e, APIConnectionError):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def retrieve_batch_with_retry(client: OpenAI, batch_id: str, attempts: int = 3, base_delay_s: float = 2.0) -> Any:
+    for attempt in range(attempts):
+        try:
+            return client.batches.retrieve(batch_id)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient_api_error(e):
+                raise
+            delay = base_delay_s * (2 ** attempt) * random.uniform(0.8, 1.2)
+            print(f"[batch] retrieve failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+def poll_batch_until_done(
+    client: OpenAI,
+    batch_id: str,
+    poll_s: float = 5,
+    max_poll_s: float = 120,
+    max_wait_s: Optional[float] = None,
+) -> Any:
+    """
+    Poll with capped exponential backoff (x1.5 per round, +/-20% jitter):
+    short batches are noticed quickly, multi-hour batches don't hammer retrieve.
+    """
+    delay = max(2.0, float(poll_s))
+    started = time.monotonic()
     while True:
-        b = client.batches.retrieve(batch_id)
+        b = retrieve_batch_with_retry(client, batch_id)
         status = b.status
         rc = getattr(b, "request_counts", None)
         print(f"[batch] {batch_id} status={status} request_counts={rc}")
-        if status in terminal:
+        if status in TERMINAL_BATCH_STATUSES:
             return b
-        time.sleep(poll_s)
+        if max_wait_s and time.monotonic() - started > max_wait_s:
+            raise TimeoutError(f"Batch {batch_id} still '{status}' after {max_wait_s}s")
+        time.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(delay * 1.5, max_poll_s)
+
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 
 def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
-    resp = client.files.content(file_id)
-    # newer SDK returns a response-like object with .text for text files
-    if hasattr(resp, "text") and resp.text is not None:
-        out_path.write_text(resp.text, encoding="utf-8")
-        return
-    # fallback bytes
-    data = getattr(resp, "content", None)
-    if data is None:
-        data = str(resp).encode("utf-8")
-    out_path.write_bytes(data)
+    # Stream the body to disk in fixed-size chunks; batch outputs can be hundreds of MB.
+    with client.files.with_streaming_response.content(file_id) as resp:
+        with out_path.open("wb") as fh:
+            for chunk in resp.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                fh.write(chunk)
+
+
+async def retrieve_batch_with_retry_async(
+    client: AsyncOpenAI, batch_id: str, attempts: int = 3, base_delay_s: float = 2.0
+) -> Any:
+    for attempt in range(attempts):
+        try:
+            return await client.batches.retrieve(batch_id)
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient_api_error(e):
+                raise
+            delay = base_delay_s * (2 ** attempt) * random.uniform(0.8, 1.2)
+            print(f"[batch] retrieve failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+async def poll_batch_until_done_async(
+    client: AsyncOpenAI,
+    batch_id: str,
+    poll_s: float = 5,
+    max_poll_s: float = 120,
+    max_wait_s: Optional[float] = None,
+) -> Any:
+    """Async twin of poll_batch_until_done (same backoff), sleeping with asyncio.sleep."""
+    delay = max(2.0, float(poll_s))
+    started = time.monotonic()
+    while True:
+        b = await retrieve_batch_with_retry_async(client, batch_id)
+        status = b.status
+        rc = getattr(b, "request_counts", None)
+        print(f"[batch] {batch_id} status={status} request_counts={rc}")
+        if status in TERMINAL_BATCH_STATUSES:
+            return b
+        if max_wait_s and time.monotonic() - started > max_wait_s:
+            raise TimeoutError(f"Batch {batch_id} still '{status}' after {max_wait_s}s")
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(delay * 1.5, max_poll_s)
+
+
+async def download_file_content_async(client: AsyncOpenAI, file_id: str, out_path: Path) -> None:
+    async with client.files.with_streaming_response.content(file_id) as resp:
+        with out_path.open("wb") as fh:
+            async for chunk in resp.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                fh.write(chunk)
 
 
 # -------------------------
-# Parse batch output + write results
+# Submit batch -> poll -> download
 # -------------------------
-def parse_batch_output_jsonl(batch_output_path: Path) -> List[Dict[str, Any]]:
-    records: List[Dict[str, Any]] = []
-    for line in batch_output_path.read_text(encoding="utf-8").splitlines():
-        if not line.strip():
-            continue
-        obj = json.loads(line)
-
-        custom_id = obj.get("custom_id")
-        err = obj.get("error")
-        resp = obj.get("response") or {}
-        status_code = resp.get("status_code")
-        body = resp.get("body") if isinstance(resp, dict) else None
-        body = body if isinstance(body, dict) else {}
-
-        output_text = ""
-        parsed = None
-        parse_error = None
-
-        if err is None and status_code == 200:
-            output_text = extract_output_text_from_responses_body(body)
-            parsed, parse_error = try_parse_json(output_text)
-        else:
-            parse_error = f"request_error: {err or body.get('error', {})}"
-
-        records.append(
-            {
-                "custom_id": custom_id,
-                "status_code": status_code,
-                "error": err,
-                "output_text": output_text,
-                "parsed": parsed,
-                "parse_error": parse_error,
-                "model": body.get("model"),
-                "system_fingerprint": body.get("system_fingerprint"),
-            }
-        )
+BATCH_METADATA_JOB = "cross-session-continuity-eval"
+
+
+def report_missing_output(batch_final: Any) -> None:
+    print("No output_file_id. Likely 0 successful requests.")
+    print("request_counts:", batch_final.request_counts)
+    print("error_file_id:", batch_final.error_file_id)
+
+
+def run_batch(
+    batch_input_jsonl: Path,
+    model: str,
+    poll_s: float,
+    max_poll_s: float,
+    max_wait_s: Optional[float],
+) -> Tuple[str, Optional[Path]]:
+    """
+    Upload, create, poll and download one batch (one input shard) with the synchronous client.
+    Output/error files are written next to the shard (batch_output.NNNN.jsonl / batch_error.NNNN.jsonl).
+    Returns (batch_id, batch_output_path); the path is None if the batch produced no output file.
+    """
+    client = OpenAI()
+
+    print(f"[2/6] Uploading {batch_input_jsonl.name} (purpose='batch') ...")
+    with batch_input_jsonl.open("rb") as fh:
+        batch_input_file = client.files.create(file=fh, purpose="batch")
+    batch_input_file_id = batch_input_file.id
+    print(f"  Uploaded: file_id={batch_input_file_id}")
+
+    print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
+    batch = client.batches.create(
+        input_file_id=batch_input_file_id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+        metadata={"job": BATCH_METADATA_JOB, "model": model},
+    )
+    batch_id = batch.id
+    print(f"  Batch created: batch_id={batch_id}")
+
+    print("[4/6] Polling until batch completes ...")
+    batch_final = poll_batch_until_done(client, batch_id, poll_s=poll_s, max_poll_s=max_poll_s, max_wait_s=max_wait_s)
+    print(f"  Final status: {batch_final.status}")
+
+    output_file_id = batch_final.output_file_id
+    error_file_id = batch_final.error_file_id
+    batch_error_path = sibling_shard_path(batch_input_jsonl, "batch_error")
+
+    if not output_file_id:
+        report_missing_output(batch_final)
+        if error_file_id:
+            download_file_content(client, error_file_id, batch_error_path)
+            print(f"Downloaded errors -> {batch_error_path}")
+        return batch_id, None
+
+    print("[5/6] Downloading output file(s) ...")
+    batch_output_path = sibling_shard_path(batch_input_jsonl, "batch_output")
+    download_file_content(client, output_file_id, batch_output_path)
+    print(f"  Saved: {batch_output_path}")
+
+    if error_file_id:
+        download_file_content(client, error_file_id, batch_error_path)
+        print(f"  Saved: {batch_error_path}")
+
+    return batch_id, batch_output_path
+
+
+async def run_batch_async(
+    batch_input_jsonl: Path,
+    model: str,
+    poll_s: float,
+    max_poll_s: float,
+    max_wait_s: Optional[float],
+    client: Optional[AsyncOpenAI] = None,
+) -> Tuple[str, Optional[Path]]:
+    """run_batch on AsyncOpenAI: polls release the loop and output/error files download concurrently."""
+    client = client or AsyncOpenAI()
+
+    print(f"[2/6] Uploading {batch_input_jsonl.name} (purpose='batch') ...")
+    with batch_input_jsonl.open("rb") as fh:
+        batch_input_file = await client.files.create(file=fh, purpose="batch")
+    batch_input_file_id = batch_input_file.id
+    print(f"  Uploaded: file_id={batch_input_file_id}")
+
+    print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
+    batch = await client.batches.create(
+        input_file_id=batch_input_file_id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+        metadata={"job": BATCH_METADATA_JOB, "model": model},
+    )
+    batch_id = batch.id
+    print(f"  Batch created: batch_id={batch_id}")
+
+    print("[4/6] Polling until batch completes ...")
+    batch_final = await poll_batch_until_done_async(
+        client, batch_id, poll_s=poll_s, max_poll_s=max_poll_s, max_wait_s=max_wait_s
+    )
+    print(f"  Final status: {batch_final.status}")
+
+    output_file_id = batch_final.output_file_id
+    error_file_id = batch_final.error_file_id
+    batch_error_path = sibling_shard_path(batch_input_jsonl, "batch_error")
+
+    if not output_file_id:
+        report_missing_output(batch_final)
+        if error_file_id:
+            await download_file_content_async(client, error_file_id, batch_error_path)
+            print(f"Downloaded errors -> {batch_error_path}")
+        return batch_id, None
+
+    print("[5/6] Downloading output file(s) ...")
+    batch_output_path = sibling_shard_path(batch_input_jsonl, "batch_output")
+    downloads = [download_file_content_async(client, output_file_id, batch_output_path)]
+    if error_file_id:
+        downloads.append(download_file_content_async(client, error_file_id, batch_error_path))
+    await asyncio.gather(*downloads)
+    print(f"  Saved: {batch_output_path}")
+    if error_file_id:
+        print(f"  Saved: {batch_error_path}")
 
-    return records
+    return batch_id, batch_output_path
+
+
+async def run_batches_async(
+    shard_paths: List[Path],
+    max_concurrent_batches: int,
+    **run_kwargs: Any,
+) -> List[Tuple[str, Optional[Path]]]:
+    """
+    Run one batch per input shard, at most max_concurrent_batches in flight at once, sharing one client.
+    Results are returned in shard order.
+    """
+    client = AsyncOpenAI()
+    sem = asyncio.Semaphore(max(1, max_concurrent_batches))
+
+    async def run_one(path: Path) -> Tuple[str, Optional[Path]]:
+        async with sem:
+            return await run_batch_async(path, client=client, **run_kwargs)
+
+    return list(await asyncio.gather(*(run_one(p) for p in shard_paths)))
+
+
+# -------------------------
+# Parse batch output + write results
+# -------------------------
+def parse_batch_output_jsonl(batch_output_path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield one parsed record per output line; the file is read line by line, never held whole."""
+    with batch_output_path.open("rb") as fh:
+        for line in fh:
+            if line.strip():
+                yield parse_batch_output_line(loads(line))
+
+
+def parse_batch_output_line(obj: Dict[str, Any]) -> Dict[str, Any]:
+    custom_id = obj.get("custom_id")
+    err = obj.get("error")
+    resp = obj.get("response") or {}
+    status_code = resp.get("status_code")
+    body = resp.get("body") if isinstance(resp, dict) else None
+    body = body if isinstance(body, dict) else {}
+
+    output_text = ""
+    parsed = None
+    parse_error = None
+
+    if err is None and status_code == 200:
+        output_text = extract_output_text_from_responses_body(body)
+        parsed, parse_error = try_parse_json(output_text)
+    else:
+        parse_error = f"request_error: {err or body.get('error', {})}"
+
+    return {
+        "custom_id": custom_id,
+        "status_code": status_code,
+        "error": err,
+        "output_text": output_text,
+        "parsed": parsed,
+        "parse_error": parse_error,
+        "model": body.get("model"),
+        "system_fingerprint": body.get("system_fingerprint"),
+    }
 
 
 def flatten_scores(parsed: Optional[Dict[str, Any]]) -> Dict[str, Any]:
@@ -409,21 +958,82 @@ def flatten_scores(parsed: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     return out
 
 
-def write_readable_outputs(
-    out_dir: Path,
-    request_index: List[Dict[str, Any]],
-    records: List[Dict[str, Any]],
-) -> None:
-    readable_dir = out_dir / "readable"
-    per_item_dir = readable_dir / "per_item"
-    safe_mkdir(per_item_dir)
+class CombinedReadableWriter:
+    """
+    Stream {user_id: {pair_id: item}} to combined_readable.json without building the dict.
+    Items may arrive in any order: each serialized item is spooled to a temp file and the
+    final file is assembled on close() in user_order, then sort_key order within a user.
+    Output is identical to json.dumps(combined, ensure_ascii=False, indent=2).
+    """
 
-    idx_map = {r["custom_id"]: r for r in request_index}
-    combined: Dict[str, Any] = {}
+    def __init__(self, path: Path, user_order: Dict[str, int]) -> None:
+        self._path = path
+        self._user_order = user_order
+        self._spool = tempfile.TemporaryFile(dir=path.parent)
+        # user_id -> [(sort_key, offset, length), ...] into the spool
+        self._parts: Dict[str, List[Tuple[Any, int, int]]] = {}
+
+    def add(self, user_id: str, pair_id: str, item: Dict[str, Any], sort_key: Any = 0) -> None:
+        item_json = json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+        frag = f"\n    {json.dumps(pair_id, ensure_ascii=False)}: {item_json}".encode("utf-8")
+        offset = self._spool.tell()
+        self._spool.write(frag)
+        self._parts.setdefault(user_id, []).append((sort_key, offset, len(frag)))
+
+    def close(self) -> None:
+        users = sorted(self._parts, key=lambda u: self._user_order.get(u, len(self._user_order)))
+        with self._path.open("wb", buffering=JSONL_WRITE_BUFFER) as f:
+            f.write(b"{")
+            for i, user_id in enumerate(users):
+                f.write((b"," if i else b"") + b"\n  " + json.dumps(user_id, ensure_ascii=False).encode("utf-8") + b": {")
+                for j, (_, offset, length) in enumerate(sorted(self._parts[user_id], key=lambda t: t[0])):
+                    self._spool.seek(offset)
+                    f.write((b"," if j else b"") + self._spool.read(length))
+                f.write(b"\n  }")
+            f.write(b"\n}" if users else b"}")
+        self._spool.close()
+
+
+class ReadableOutputWriter:
+    """
+    Incremental writer for <out_dir>/readable, fed one record at a time from the parse pass.
+    per_item_format="jsonl": one line per custom_id in readable/per_item.jsonl (single sequential file)
+    per_item_format="files": one readable/per_item/<custom_id>.json per request (legacy layout)
+    With resume=True per_item.jsonl is appended to, and existing per-item files are kept only for
+    custom_ids in done_custom_ids (completed by an earlier run); any other file, e.g. a failure now
+    being retried, is overwritten.
+    """
 
-    for rec in records:
+    def __init__(
+        self,
+        out_dir: Path,
+        idx_map: Dict[str, Dict[str, Any]],
+        per_item_format: str = "jsonl",
+        resume: bool = False,
+        done_custom_ids: Optional[Set[str]] = None,
+    ) -> None:
+        readable_dir = out_dir / "readable"
+        safe_mkdir(readable_dir)
+        self.readable_dir = readable_dir
+        self._keep_ids: Set[str] = (done_custom_ids or set()) if resume else set()
+
+        self._per_item_jsonl = None
+        self._per_item_dir = readable_dir / "per_item"
+        if per_item_format == "jsonl":
+            self._per_item_jsonl = (readable_dir / "per_item.jsonl").open(
+                "ab" if resume else "wb", buffering=JSONL_WRITE_BUFFER
+            )
+        else:
+            safe_mkdir(self._per_item_dir)
+
+        # combined_readable.json keeps request_index order: users by first appearance, pairs by session
+        user_order: Dict[str, int] = {}
+        for meta in idx_map.values():
+            user_order.setdefault(meta["user_id"], len(user_order))
+        self._combined = CombinedReadableWriter(readable_dir / "combined_readable.json", user_order)
+
+    def add(self, rec: Dict[str, Any], meta: Dict[str, Any]) -> None:
         cid = rec["custom_id"]
-        meta = idx_map.get(cid, {})
         item = {
             "meta": meta,
             "status_code": rec["status_code"],
@@ -434,21 +1044,114 @@ def write_readable_outputs(
             "system_fingerprint": rec["system_fingerprint"],
         }
 
-        # per-item file
-        (per_item_dir / f"{cid}.json").write_text(
-            json.dumps(item, ensure_ascii=False, indent=2),
-            encoding="utf-8",
+        if self._per_item_jsonl is not None:
+            self._per_item_jsonl.write(dumps_line({"custom_id": cid, **item}))
+        else:
+            item_path = self._per_item_dir / f"{cid}.json"
+            if not (cid in self._keep_ids and item_path.exists() and item_path.stat().st_size > 0):
+                item_path.write_text(
+                    json.dumps(item, ensure_ascii=False, indent=2),
+                    encoding="utf-8",
+                )
+
+        self._combined.add(
+            meta.get("user_id", "UNKNOWN_USER"),
+            meta.get("pair_id", "UNKNOWN_PAIR"),
+            item,
+            sort_key=(meta.get("session_prev", 0), meta.get("session_curr", 0)),
         )
 
-        user_id = meta.get("user_id", "UNKNOWN_USER")
-        pair_id = meta.get("pair_id", "UNKNOWN_PAIR")
-        combined.setdefault(user_id, {})
-        combined[user_id][pair_id] = item
+    def close(self) -> None:
+        try:
+            self._combined.close()
+        finally:
+            if self._per_item_jsonl is not None:
+                self._per_item_jsonl.close()
+
+
+RESULT_OUTPUT_FORMATS = ("jsonl", "parquet", "xlsx")
+
+# Column order of results.parquet / results.xlsx (one row per pair)
+RESULT_COLUMNS = [
+    "user_id",
+    "pair_id",
+    "session_prev",
+    "session_curr",
+    "custom_id",
+    "status_code",
+    "parse_error",
+    "reuse_of_prior",
+    "followup_on_commitments_barriers",
+    "context_alignment_opening",
+    "agenda_progression",
+    "smooth_handoff_no_reset",
+    "overall_0_to_10",
+    "uncertainty_flag",
+    "file_prev",
+    "file_curr",
+    "model",
+    "system_fingerprint",
+]
+
+# Small ordinal scores / flags, stored as nullable Int8 when the judge returned plain ints
+SCORE_COLUMNS = {
+    "reuse_of_prior",
+    "followup_on_commitments_barriers",
+    "context_alignment_opening",
+    "agenda_progression",
+    "smooth_handoff_no_reset",
+    "overall_0_to_10",
+    "uncertainty_flag",
+}
 
-    (readable_dir / "combined_readable.json").write_text(
-        json.dumps(combined, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+
+def as_nullable_int8(values: List[Any]) -> Any:
+    """pd.array(..., dtype="Int8") if every value fits, else the list unchanged (pandas infers)."""
+    if all(v is None or (type(v) is int and -128 <= v <= 127) for v in values):
+        return pd.array(values, dtype="Int8")
+    return values
+
+
+def coerce_scores_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    """Score columns that fell back to raw values -> numeric (non-numbers become NaN); pyarrow rejects mixed types."""
+    bad = [c for c in df.columns if c in SCORE_COLUMNS and not pd.api.types.is_numeric_dtype(df[c])]
+    if not bad:
+        return df
+    return df.assign(**{c: pd.to_numeric(df[c], errors="coerce") for c in bad})
+
+
+def parse_output_formats(value: str) -> List[str]:
+    formats = [f.strip().lower() for f in value.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in RESULT_OUTPUT_FORMATS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown output format(s) {unknown}; choose from {','.join(RESULT_OUTPUT_FORMATS)}"
+        )
+    return formats
+
+
+def _xlsx_cell(v: Any) -> Any:
+    if v is None or v is pd.NA or (isinstance(v, float) and v != v):
+        return None
+    if isinstance(v, (dict, list)):
+        return dumps_bytes(v).decode("utf-8")
+    return v
+
+
+def write_results_xlsx(df: pd.DataFrame, xlsx_path: Path) -> None:
+    """
+    Row-by-row xlsxwriter workbook in constant_memory mode (each row is flushed to disk once written,
+    instead of holding the whole workbook as cell objects). Rows are written directly: pandas' to_excel
+    emits cells column by column, which constant_memory mode silently drops.
+    """
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(str(xlsx_path), {"constant_memory": True, "strings_to_urls": False})
+    ws = wb.add_worksheet("Sheet1")
+    ws.write_row(0, 0, list(df.columns))
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, [_xlsx_cell(v) for v in row])
+    wb.close()
 
 
 def main() -> int:
@@ -459,9 +1162,39 @@ def main() -> int:
     ap.add_argument("--prompt_file", default="", help="Optional: system prompt file override")
     ap.add_argument("--reasoning_effort", default="high", choices=["none", "low", "medium", "high", "xhigh"],
                     help="Reasoning effort (use high/xhigh for reliability). Note: temperature is NOT used.")
-    ap.add_argument("--poll_s", type=int, default=15, help="Batch status polling interval (seconds)")
+    ap.add_argument("--poll_s", type=float, default=5, help="Initial batch status polling interval (seconds); backs off x1.5 per poll")
+    ap.add_argument("--max_poll_s", type=float, default=120, help="Cap for the backed-off polling interval (seconds)")
+    ap.add_argument("--max_wait_s", type=float, default=0, help="Give up polling after this many seconds (0 = wait indefinitely)")
     ap.add_argument("--user_filter", default="", help="Optional: only evaluate users whose folder name contains this substring")
+    ap.add_argument("--output_formats", type=parse_output_formats, default="jsonl,parquet",
+                    help="Comma-separated result formats: jsonl,parquet,xlsx (default: jsonl,parquet)")
+    ap.add_argument("--per_item_format", default="jsonl", choices=["jsonl", "files"],
+                    help="Readable per-item output: one readable/per_item.jsonl (default) or one file per custom_id")
+    ap.add_argument("--discovery_cache", dest="discovery_cache", action="store_true", default=True,
+                    help="Reuse chat listings from <out_dir>/.discovery_cache.json for unchanged users (default)")
+    ap.add_argument("--no_discovery_cache", dest="discovery_cache", action="store_false",
+                    help="Always re-scan every user's chats/ directory")
+    ap.add_argument("--async", dest="use_async", action="store_true", default=True,
+                    help="Drive upload/create/poll/download with AsyncOpenAI (default)")
+    ap.add_argument("--no_async", dest="use_async", action="store_false",
+                    help="Use the synchronous OpenAI client instead")
+    ap.add_argument("--resume", dest="resume", action="store_true", default=False,
+                    help="Skip pairs listed in <out_dir>/done_custom_ids.txt and append to results.jsonl / "
+                         "readable/per_item.jsonl (tables and combined_readable.json cover this run only)")
+    ap.add_argument("--no_resume", dest="resume", action="store_false", help="Rebuild and resubmit every pair (default)")
+    ap.add_argument("--shard_max_lines", type=int, default=SHARD_MAX_LINES,
+                    help=f"Max requests per submitted batch (default: {SHARD_MAX_LINES})")
+    ap.add_argument("--shard_max_bytes", type=int, default=SHARD_MAX_BYTES,
+                    help=f"Max bytes per batch input shard (default: {SHARD_MAX_BYTES}, 90 MiB)")
+    ap.add_argument("--max_concurrent_batches", type=int, default=4,
+                    help="Shards in flight at once with --async (default: 4); --no_async runs them one after another")
+    ap.add_argument("--attach_min_bytes", type=int, default=0,
+                    help="Upload sessions whose canonical JSON is at least this many bytes (e.g. 50000) and "
+                         "reference them as input_file parts instead of inlining them (default: 0 = always inline)")
+    ap.add_argument("--no_dedup", dest="dedupe", action="store_false", default=True,
+                    help="Submit every pair even if its two sessions are identical to another pair's")
     args = ap.parse_args()
+    output_formats = args.output_formats
 
     user_data_dir = Path(args.user_data_dir).expanduser().resolve()
     out_dir = Path(args.out_dir).expanduser().resolve()
@@ -471,123 +1204,116 @@ def main() -> int:
     if args.prompt_file:
         system_prompt = read_text(Path(args.prompt_file).expanduser().resolve()).strip()
 
-    batch_input_jsonl = out_dir / "batch_input.jsonl"
     request_index_path = out_dir / "request_index.json"
 
-    print(f"[1/6] Building batch input jsonl -> {batch_input_jsonl}")
-    request_index = build_batch_input_jsonl(
+    done_ids_path = out_dir / DONE_IDS_NAME
+    done_custom_ids = load_done_custom_ids(done_ids_path) if args.resume else set()
+
+    print(f"[1/6] Building batch input jsonl shards -> {out_dir / 'batch_input.*.jsonl'}")
+    request_index, shard_paths = build_batch_input_jsonl(
         user_data_dir=user_data_dir,
-        out_jsonl=batch_input_jsonl,
+        out_dir=out_dir,
         request_index_path=request_index_path,
         model=args.model,
         system_prompt=system_prompt,
         reasoning_effort=args.reasoning_effort,
         store=False,
         user_filter=(args.user_filter or None),
+        discovery_cache_path=(out_dir / DISCOVERY_CACHE_NAME if args.discovery_cache else None),
+        skip_custom_ids=(done_custom_ids if args.resume else None),
+        dedupe=args.dedupe,
+        shard_max_lines=args.shard_max_lines,
+        shard_max_bytes=args.shard_max_bytes,
+        attach_min_bytes=args.attach_min_bytes,
     )
-    print(f"  Prepared {len(request_index)} requests. Saved index -> {request_index_path}")
-
-    client = OpenAI()
-
-    print("[2/6] Uploading batch input file (purpose='batch') ...")
-    batch_input_file = client.files.create(file=batch_input_jsonl.open("rb"), purpose="batch")
-    batch_input_file_id = batch_input_file.id
-    print(f"  Uploaded: file_id={batch_input_file_id}")
-
-    print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
-    batch = client.batches.create(
-        input_file_id=batch_input_file_id,
-        endpoint="/v1/responses",
-        completion_window="24h",
-        metadata={"job": "cross-session-continuity-eval", "model": args.model},
+    n_dupes = sum(1 for r in request_index if r.get("duplicate_of"))
+    print(f"  Prepared {len(request_index)} requests ({n_dupes} identical pairs deduplicated) "
+          f"in {len(shard_paths)} shard(s). Saved index -> {request_index_path}")
+    if not request_index:
+        print(f"  All pairs already judged (see {done_ids_path}); nothing to submit.")
+        return 0
+
+    run_kwargs = dict(
+        model=args.model,
+        poll_s=args.poll_s,
+        max_poll_s=args.max_poll_s,
+        max_wait_s=(args.max_wait_s or None),
     )
-    batch_id = batch.id
-    print(f"  Batch created: batch_id={batch_id}")
-
-    print("[4/6] Polling until batch completes ...")
-    batch_final = poll_batch_until_done(client, batch_id, poll_s=args.poll_s)
-    status = batch_final.status
-    print(f"  Final status: {status}")
-
-    output_file_id = batch_final.output_file_id
-    error_file_id = batch_final.error_file_id
-
-    if not output_file_id:
-        print("No output_file_id. Likely 0 successful requests.")
-        print("request_counts:", batch_final.request_counts)
-        print("error_file_id:", error_file_id)
-        if error_file_id:
-            err_path = out_dir / "batch_error.jsonl"
-            download_file_content(client, error_file_id, err_path)
-            print(f"Downloaded errors -> {err_path}")
+    if args.use_async:
+        batches = asyncio.run(run_batches_async(shard_paths, args.max_concurrent_batches, **run_kwargs))
+    else:
+        batches = [run_batch(path, **run_kwargs) for path in shard_paths]
+    batch_ids = [batch_id for batch_id, _ in batches]
+    batch_output_paths = [path for _, path in batches if path is not None]
+    if not batch_output_paths:
         return 2
-
-    print("[5/6] Downloading output file(s) ...")
-    batch_output_path = out_dir / "batch_output.jsonl"
-    download_file_content(client, output_file_id, batch_output_path)
-    print(f"  Saved: {batch_output_path}")
-
-    if error_file_id:
-        batch_error_path = out_dir / "batch_error.jsonl"
-        download_file_content(client, error_file_id, batch_error_path)
-        print(f"  Saved: {batch_error_path}")
+    if len(batch_output_paths) < len(batches):
+        print(f"  WARNING: {len(batches) - len(batch_output_paths)} of {len(batches)} batches produced no output; "
+              "their pairs are missing from the results (rerun with --resume to retry them).")
 
     print("[6/6] Parsing outputs and writing results ...")
-    records = parse_batch_output_jsonl(batch_output_path)
-
-    # Load request index mapping
     idx_map = {r["custom_id"]: r for r in request_index}
+    records = expand_duplicates(
+        itertools.chain.from_iterable(parse_batch_output_jsonl(p) for p in batch_output_paths),
+        request_index,
+    )
 
-    # Write results.jsonl (enriched with user/pair info + flattened scores)
+    # Single streaming pass: table columns, results.jsonl, done ids and readable outputs per record
+    cols: Dict[str, List[Any]] = {name: [] for name in RESULT_COLUMNS}
     results_jsonl = out_dir / "results.jsonl"
-    enriched: List[Dict[str, Any]] = []
-    with results_jsonl.open("w", encoding="utf-8") as f:
-        for rec in records:
-            meta = idx_map.get(rec["custom_id"], {})
-            flat = flatten_scores(rec["parsed"])
-            out = {**meta, **rec, **flat}
-            enriched.append(out)
-            f.write(json.dumps(out, ensure_ascii=False) + "\n")
-    print(f"  Saved: {results_jsonl}")
-
-    # Write results.xlsx (one row per pair)
+    results_fh = (
+        results_jsonl.open("ab" if args.resume else "wb", buffering=JSONL_WRITE_BUFFER)
+        if "jsonl" in output_formats
+        else None
+    )
+    readable = ReadableOutputWriter(
+        out_dir,
+        idx_map,
+        per_item_format=args.per_item_format,
+        resume=args.resume,
+        done_custom_ids=done_custom_ids,
+    )
+    try:
+        with done_ids_path.open("a", encoding="utf-8", buffering=1) as done_fh:
+            for rec in records:
+                meta = idx_map.get(rec["custom_id"], {})
+                out = {**meta, **rec, **flatten_scores(rec["parsed"])}
+                for name, values in cols.items():
+                    values.append(out.get(name))
+                if results_fh is not None:
+                    results_fh.write(dumps_line(out))
+                readable.add(rec, meta)
+                if rec["status_code"] == 200 and rec["parse_error"] is None:
+                    done_fh.write(rec["custom_id"] + "\n")
+    finally:
+        readable.close()
+        if results_fh is not None:
+            results_fh.close()
+    if results_fh is not None:
+        print(f"  Saved: {results_jsonl}")
+    print(f"  Saved readable JSON -> {readable.readable_dir}")
+
+    # Tabular results (one row per pair)
     df = pd.DataFrame(
-        [
-            {
-                "user_id": r.get("user_id"),
-                "pair_id": r.get("pair_id"),
-                "session_prev": r.get("session_prev"),
-                "session_curr": r.get("session_curr"),
-                "custom_id": r.get("custom_id"),
-                "status_code": r.get("status_code"),
-                "parse_error": r.get("parse_error"),
-                "reuse_of_prior": r.get("reuse_of_prior"),
-                "followup_on_commitments_barriers": r.get("followup_on_commitments_barriers"),
-                "context_alignment_opening": r.get("context_alignment_opening"),
-                "agenda_progression": r.get("agenda_progression"),
-                "smooth_handoff_no_reset": r.get("smooth_handoff_no_reset"),
-                "overall_0_to_10": r.get("overall_0_to_10"),
-                "uncertainty_flag": r.get("uncertainty_flag"),
-                "file_prev": r.get("file_prev"),
-                "file_curr": r.get("file_curr"),
-                "model": r.get("model"),
-                "system_fingerprint": r.get("system_fingerprint"),
-            }
-            for r in enriched
-        ]
+        {name: (as_nullable_int8(values) if name in SCORE_COLUMNS else values) for name, values in cols.items()}
     ).sort_values(by=["user_id", "session_prev", "session_curr"])
 
-    xlsx_path = out_dir / "results.xlsx"
-    df.to_excel(xlsx_path, index=False)
-    print(f"  Saved: {xlsx_path}")
+    if "parquet" in output_formats:
+        parquet_path = out_dir / "results.parquet"
+        try:
+            coerce_scores_for_parquet(df).to_parquet(parquet_path, index=False, compression="zstd")
+            print(f"  Saved: {parquet_path}")
+        except (ImportError, TypeError, ValueError) as e:  # pyarrow missing, or a column it cannot type
+            print(f"  [WARN] results.parquet not written: {type(e).__name__}: {e}")
 
-    # Write readable JSON outputs
-    write_readable_outputs(out_dir, request_index, records)
-    print(f"  Saved readable JSON -> {out_dir / 'readable'}")
+    if "xlsx" in output_formats:
+        xlsx_path = out_dir / "results.xlsx"
+        write_results_xlsx(df, xlsx_path)
+        print(f"  Saved: {xlsx_path}")
 
     print("\nDone.")
-    print(f"Batch id: {batch_id}")
-    return 0
+    print(f"Batch id(s): {', '.join(batch_ids)}")
+    return 0 if len(batch_output_paths) == len(batches) else 2
 
 
 if __name__ == "__main__":
@@ -25,9 +25,10 @@ Directory layout (example):
 Outputs (example):
   ../out_continuity_eval/
     batch_input.jsonl
-    batch_output.jsonl
+    batch_output.jsonl   (--mode async writes the same line format from direct calls)
     batch_error.jsonl (if any)
     request_index.json
+    cache/<key>.json    (successful judge responses, reused by later runs; --no_cache to bypass)
     results.jsonl
     results.xlsx
     readable/
@@ -36,22 +37,45 @@ Outputs (example):
         <custom_id>.json
 
 Requires:
-  pip install --upgrade openai pandas openpyxl
+  pip install --upgrade openai openpyxl
+  (optional, faster JSON: pip install orjson)
+  (optional, exact preflight token counts: pip install tiktoken)
+  (optional, repair malformed judge JSON: pip install json-repair regex)
 Env:
   OPENAI_API_KEY=...
 """
 
 import argparse
+import asyncio
+import hashlib
 import json
 import os
+import random
 import re
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
-
-import pandas as pd
-from openai import OpenAI
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup, see dumps_line / loads
+    orjson = None
+try:
+    import tiktoken
+except ImportError:  # optional, see estimate_tokens
+    tiktoken = None
+try:
+    import json_repair
+except ImportError:  # optional last resort in try_parse_json
+    json_repair = None
+try:
+    import regex as _regex  # supports the recursive (?R) pattern below
+except ImportError:
+    _regex = None
+if TYPE_CHECKING:  # openai/openpyxl are imported where used, keeping --help and prompt builds cheap
+    from openai import OpenAI
 
 
 # -------------------------
@@ -193,18 +217,39 @@ Output quality constraints
 """.strip()
 
 
+# Static task instruction, appended to the system prompt so the whole cacheable prefix is shared
+CONTINUITY_TASK_INSTRUCTION = "Evaluate cross-session continuity on the full five-session trajectory."
+
+# Bump the version when the request layout changes; the prompt hash is appended automatically
+PROMPT_CACHE_KEY_PREFIX = "continuity_judge_v1"
+
+
+def prompt_cache_key(system_content: str) -> str:
+    return f"{PROMPT_CACHE_KEY_PREFIX}_{hashlib.sha256(system_content.encode('utf-8')).hexdigest()[:12]}"
+
+
 # -------------------------
 # Utilities (Pydantic-safe, JSON helpers)
 # -------------------------
+# type -> converter, resolved once per type by as_dict
+_AS_DICT_CONVERTERS: Dict[type, Callable[[Any], Dict[str, Any]]] = {dict: lambda obj: obj}
+
+
+def _resolve_as_dict(tp: type) -> Callable[[Any], Dict[str, Any]]:
+    if issubclass(tp, dict):
+        return lambda obj: obj
+    if hasattr(tp, "model_dump"):  # openai>=1 models (pydantic v2 API)
+        return lambda obj: obj.model_dump()
+    return lambda obj: {}
+
+
 def as_dict(obj: Any) -> Dict[str, Any]:
     """Convert SDK Pydantic objects to dict safely."""
-    if isinstance(obj, dict):
-        return obj
-    if hasattr(obj, "model_dump"):  # pydantic v2
-        return obj.model_dump()
-    if hasattr(obj, "dict"):        # pydantic v1
-        return obj.dict()
-    return {}
+    tp = type(obj)
+    conv = _AS_DICT_CONVERTERS.get(tp)
+    if conv is None:
+        conv = _AS_DICT_CONVERTERS[tp] = _resolve_as_dict(tp)
+    return conv(obj)
 
 
 def safe_mkdir(p: Path) -> None:
@@ -215,13 +260,47 @@ def read_text(path: Path) -> str:
     return path.read_text(encoding="utf-8")
 
 
+# orjson (C, emits UTF-8 bytes) on the hot paths when installed; stdlib json otherwise.
+if orjson is not None:
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
 def load_json(path: Path) -> Any:
+    raw = path.read_bytes()
     # handle possible UTF-8 BOM on Windows
-    raw = path.read_text(encoding="utf-8-sig")
-    return json.loads(raw)
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    return loads(raw)
 
 
-def json_canonical_dumps(data: Any) -> str:
+def json_canonical_dumps(data: Any, compact: bool = False) -> str:
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if compact else orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option).decode("utf-8")
+    if compact:
+        return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
     return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
 
 
@@ -253,14 +332,81 @@ def extract_output_text_from_responses_body(body: Dict[str, Any]) -> str:
     return json.dumps(body, ensure_ascii=False)
 
 
+# Compiled once at import; try_parse_json runs per output line.
+# ```json ... ``` fences the judge sometimes wraps its answer in
+_CODE_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+# Outermost balanced {...} block (regex module only; extract_first_json_object is the fallback)
+_JSON_OBJ_RE = _regex.compile(r"\{(?:[^{}]|(?R))*\}", _regex.DOTALL) if _regex is not None else None
+
+
+def extract_first_json_object(text: str) -> Optional[str]:
+    """First balanced {...} span in text (braces inside JSON strings are ignored), or None."""
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_str = False
+        escaped = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_str:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_str = False
+            elif ch == '"':
+                in_str = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+        start = text.find("{", start + 1)
+    return None
+
+
 def try_parse_json(text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     """
     Parse JSON robustly; if it fails, return error string.
+    Ladder: plain parse -> content of a ```json fence -> first balanced {...} block
+    -> json_repair (if installed). The error reported is the one from the plain parse.
     """
     try:
-        return json.loads(text), None
+        return loads(text), None
     except Exception as e:
-        return None, f"{type(e).__name__}: {e}"
+        first_error = f"{type(e).__name__}: {e}"
+
+    candidates: List[str] = []
+    fence = _CODE_FENCE_RE.search(text)
+    if fence:
+        candidates.append(fence.group(1))
+    if _JSON_OBJ_RE is not None:
+        match = _JSON_OBJ_RE.search(text)
+        if match:
+            candidates.append(match.group(0))
+    # string-aware scan; also covers braces inside JSON strings that the pattern miscounts
+    block = extract_first_json_object(text)
+    if block and block not in candidates:
+        candidates.append(block)
+    for candidate in candidates:
+        try:
+            parsed = loads(candidate)
+        except Exception:
+            continue
+        if isinstance(parsed, dict):
+            return parsed, None
+
+    if json_repair is not None:
+        try:
+            parsed = json_repair.loads(text)
+        except Exception:
+            parsed = None
+        if isinstance(parsed, dict) and parsed:
+            return parsed, None
+
+    return None, first_error
 
 
 # -------------------------
@@ -283,9 +429,104 @@ def discover_chat_all_for_user(user_dir: Path) -> Optional[Path]:
     return p if p.exists() and p.is_file() else None
 
 
+# -------------------------
+# Preflight: token estimate + sharding of oversized users
+# -------------------------
+# Per-request input budget; users above it are slimmed, then split into overlapping session windows
+MAX_INPUT_TOKENS = 180_000
+
+_TOKEN_ENCODER: Any = None
+
+
+def estimate_tokens(text: str) -> int:
+    """tiktoken o200k_base count when available (approximation for gpt-5.x), else a conservative chars/3."""
+    global _TOKEN_ENCODER
+    if tiktoken is not None:
+        if _TOKEN_ENCODER is None:
+            _TOKEN_ENCODER = tiktoken.get_encoding("o200k_base")
+        return len(_TOKEN_ENCODER.encode(text, disallowed_special=()))
+    return len(text) // 3 + 1
+
+
+def slim_chat_all(chat_all: Any) -> Any:
+    """Keep only session_id + messages per session (drops date/index/finished/file bookkeeping)."""
+    if not isinstance(chat_all, dict) or not isinstance(chat_all.get("sessions"), list):
+        return chat_all
+    sessions = []
+    for sess in chat_all["sessions"]:
+        if isinstance(sess, dict) and isinstance(sess.get("payload"), dict) and "messages" in sess["payload"]:
+            sess = {"session_id": sess.get("session_id"), "payload": {"messages": sess["payload"]["messages"]}}
+        sessions.append(sess)
+    return {**chat_all, "sessions": sessions}
+
+
+def session_windows(n_sessions: int, n_windows: int) -> List[Tuple[int, int]]:
+    """n_windows [start, end) slices covering 0..n_sessions, consecutive windows sharing one session."""
+    bounds = [round(i * (n_sessions - 1) / n_windows) for i in range(n_windows + 1)]
+    return [(bounds[i], bounds[i + 1] + 1) for i in range(n_windows)]
+
+
+def preflight_split(
+    chat_all: Any, canon: str, system_tokens: int, max_input_tokens: int
+) -> List[str]:
+    """
+    Canonical transcript text(s) to send for one user: [canon] when it fits max_input_tokens,
+    else the slimmed form, else the fewest overlapping session windows that each fit
+    (falls back to 2-session windows, which are sent even if still over budget).
+    """
+    if not max_input_tokens or system_tokens + estimate_tokens(canon) <= max_input_tokens:
+        return [canon]
+    slim = slim_chat_all(chat_all)
+    slim_canon = json_canonical_dumps(slim, compact=True)
+    if system_tokens + estimate_tokens(slim_canon) <= max_input_tokens:
+        return [slim_canon]
+    sessions = slim.get("sessions") if isinstance(slim, dict) else None
+    if not isinstance(sessions, list) or len(sessions) < 3:
+        return [slim_canon]
+    for n_windows in range(2, len(sessions)):
+        parts = [
+            json_canonical_dumps({**slim, "sessions": sessions[a:b]}, compact=True)
+            for a, b in session_windows(len(sessions), n_windows)
+        ]
+        if all(system_tokens + estimate_tokens(t) <= max_input_tokens for t in parts):
+            return parts
+    return parts
+
+
 # -------------------------
 # Batch input builder
 # -------------------------
+def make_batch_line_encoder(
+    model: str, system_content: str, reasoning_effort: str, prompt_cache_key_value: str, store: bool
+) -> Callable[[str, str], bytes]:
+    """
+    Returns encode_line(custom_id, chat_all_canon) -> one compact JSONL line (with trailing newline).
+    Everything except the custom_id and the transcript (notably the multi-KB system prompt) is
+    JSON-encoded once here; the result is byte-identical to dumps_line() of the full request dict.
+    """
+    # IMPORTANT: Do NOT include temperature for gpt-5.2-pro with reasoning != none.
+    head = b'{"custom_id":'
+    mid = (
+        b',"method":"POST","url":"/v1/responses","body":{"model":' + dumps_bytes(model)
+        + b',"input":[' + dumps_bytes({"role": "system", "content": system_content})
+        + b',{"role":"user","content":['
+        # Separate content parts: the transcript is its own input_text, not spliced into a larger string
+        + dumps_bytes({"type": "input_text", "text": "<CHAT_ALL_JSON>"})
+        + b',{"type":"input_text","text":'
+    )
+    tail = (
+        b"}," + dumps_bytes({"type": "input_text", "text": "</CHAT_ALL_JSON>"})
+        + b']}],"reasoning":' + dumps_bytes({"effort": reasoning_effort})
+        + b',"prompt_cache_key":' + dumps_bytes(prompt_cache_key_value)
+        + b',"store":' + dumps_bytes(store) + b"}}\n"
+    )
+
+    def encode_line(custom_id: str, chat_all_canon: str) -> bytes:
+        return b"".join((head, dumps_bytes(custom_id), mid, dumps_bytes(chat_all_canon), tail))
+
+    return encode_line
+
+
 # -------------------------
 def build_batch_input_jsonl(
     user_data_dir: Path,
@@ -296,10 +537,23 @@ def build_batch_input_jsonl(
     reasoning_effort: str,
     store: bool = False,
     user_filter: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+    max_input_tokens: int = MAX_INPUT_TOKENS,
 ) -> List[Dict[str, Any]]:
     """
     Build batch input jsonl for /v1/responses and write request_index.json
     Returns request_index list of dicts.
+
+    With cache_dir, each request gets a "cache_key" (see response_cache_key); users whose key already
+    has a cached response in cache_dir are marked "cached": True and not written to the jsonl.
+
+    Users whose estimated input exceeds max_input_tokens (0 = no check) are slimmed or split into
+    overlapping session windows (see preflight_split); each window is its own request with
+    custom_id "<user_id>__s<k>" and "shard_index"/"shard_count" in its index entry, and
+    merge_shard_records() recombines them after parsing.
+
+    chat_all files are read and canonicalized on a thread pool so file reads overlap;
+    lines are then written sequentially in user order, keeping request_index aligned.
     """
     users = discover_users(user_data_dir)
     if user_filter:
@@ -308,63 +562,101 @@ def build_batch_input_jsonl(
     request_index: List[Dict[str, Any]] = []
     lines_written = 0
 
-    with out_jsonl.open("w", encoding="utf-8") as f:
-        for user_dir in users:
-            user_id = user_dir.name
-            chat_all_path = discover_chat_all_for_user(user_dir)
-            if not chat_all_path:
-                continue
-
-            custom_id = user_id  # one request per user trajectory
+    # Everything static lives in the system message (identical prefix across users for prompt caching);
+    # the user message carries only the per-user transcript.
+    system_content = f"{system_prompt}\n\n{CONTINUITY_TASK_INSTRUCTION}"
+    encode_line = make_batch_line_encoder(
+        model, system_content, reasoning_effort, prompt_cache_key(system_content), store
+    )
 
-            req_meta = {
-                "custom_id": custom_id,
+    user_files: List[Tuple[str, Path]] = []
+    for user_dir in users:
+        chat_all_path = discover_chat_all_for_user(user_dir)
+        if chat_all_path:
+            user_files.append((user_dir.name, chat_all_path))
+
+    system_tokens = estimate_tokens(system_content) if max_input_tokens else 0
+
+    def load_canon(path: Path) -> List[str]:
+        chat_all_json = load_json(path)
+        # compact: the judge does not need indentation, and it roughly halves the transcript tokens
+        canon = json_canonical_dumps(chat_all_json, compact=True)
+        return preflight_split(chat_all_json, canon, system_tokens, max_input_tokens)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(user_files)))) as ex:
+        canons = list(ex.map(load_canon, [path for _, path in user_files]))
+
+    requests: List[Tuple[Dict[str, Any], str]] = []
+    for (user_id, chat_all_path), parts in zip(user_files, canons):
+        for k, part in enumerate(parts):
+            req_meta: Dict[str, Any] = {
+                # one request per user trajectory (per session window for oversized users)
+                "custom_id": user_id if len(parts) == 1 else f"{user_id}__s{k}",
                 "user_id": user_id,
                 "chat_all_file": str(chat_all_path),
             }
+            if len(parts) > 1:
+                req_meta["shard_index"] = k
+                req_meta["shard_count"] = len(parts)
+            requests.append((req_meta, part))
+    n_sharded = sum(1 for m, _ in requests if m.get("shard_index") == 0)
+    if n_sharded:
+        print(f"  {n_sharded} user(s) over {max_input_tokens} input tokens were split into session windows")
+
+    with out_jsonl.open("wb") as f:
+        for req_meta, chat_all_canon in requests:
+            custom_id = req_meta["custom_id"]
             request_index.append(req_meta)
 
-            chat_all_json = load_json(chat_all_path)
-
-            user_payload = (
-                "Evaluate cross-session continuity on the full five-session trajectory.\\n\\n"
-                "<CHAT_ALL_JSON>\\n"
-                f"{json_canonical_dumps(chat_all_json)}\\n"
-                "</CHAT_ALL_JSON>\\n"
-            )
-
-            # IMPORTANT: Do NOT include temperature for gpt-5.2-pro with reasoning != none.
-            body = {
-                "model": model,
-                "input": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_payload},
-                ],
-                "reasoning": {"effort": reasoning_effort},
-                "store": store,
-            }
+            if cache_dir is not None:
+                key = response_cache_key(system_content, chat_all_canon, model, reasoning_effort)
+                req_meta["cache_key"] = key
+                if (cache_dir / f"{key}.json").exists():
+                    req_meta["cached"] = True
+                    continue
 
-            line = {
-                "custom_id": custom_id,
-                "method": "POST",
-                "url": "/v1/responses",
-                "body": body,
-            }
-            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            f.write(encode_line(custom_id, chat_all_canon))
             lines_written += 1
 
     request_index_path.write_text(json.dumps(request_index, ensure_ascii=False, indent=2), encoding="utf-8")
 
-    if lines_written == 0:
+    if not request_index:
         raise RuntimeError(f"No requests built. Check user_data_dir={user_data_dir} and chat files.")
 
     return request_index
 
 
+# -------------------------
+# Local response cache
+# -------------------------
+def response_cache_key(system_content: str, chat_all_canon: str, model: str, reasoning_effort: str) -> str:
+    """Exact-match key: identical prompt, transcript, model and effort reuse the earlier judge response."""
+    h = hashlib.sha256()
+    for part in (system_content, chat_all_canon, model, reasoning_effort):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def load_cached_response(cache_dir: Path, key: str) -> Optional[Dict[str, Any]]:
+    """Cached batch-output line for key, or None if missing/unreadable."""
+    try:
+        return load_json(cache_dir / f"{key}.json")
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_response(cache_dir: Path, key: str, obj: Dict[str, Any]) -> None:
+    path = cache_dir / f"{key}.json"
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_bytes(dumps_line(obj))
+    os.replace(tmp, path)
+
+
 # -------------------------
 # Batch polling + download
 # -------------------------
-def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: int = 15) -> Any:
+def poll_batch_until_done(client: "OpenAI", batch_id: str, poll_s: int = 15) -> Any:
     terminal = {"completed", "failed", "expired", "cancelled"}
     while True:
         b = client.batches.retrieve(batch_id)
@@ -376,7 +668,19 @@ def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: int = 15) -> An
         time.sleep(poll_s)
 
 
-def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+def download_file_content(client: "OpenAI", file_id: str, out_path: Path) -> None:
+    if hasattr(client.files, "with_streaming_response"):
+        # Stream the body to disk in fixed-size chunks instead of holding the whole file in memory
+        with client.files.with_streaming_response.content(file_id) as resp:
+            with out_path.open("wb") as fh:
+                for chunk in resp.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    fh.write(chunk)
+        return
+
+    # older SDKs: buffered download
     resp = client.files.content(file_id)
     # newer SDK returns a response-like object with .text for text files
     if hasattr(resp, "text") and resp.text is not None:
@@ -389,118 +693,396 @@ def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
     out_path.write_bytes(data)
 
 
+# -------------------------
+# Direct (non-batch) mode
+# -------------------------
+def load_batch_requests(batch_input_jsonl: Path) -> List[Dict[str, Any]]:
+    requests: List[Dict[str, Any]] = []
+    with batch_input_jsonl.open("rb") as f:
+        for line in f:
+            if line.strip():
+                requests.append(loads(line))
+    return requests
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_min/60 per second up to burst (default: one minute's worth).
+    acquire(n) waits until n units are available; waiters queue on a lock, so they are served in order.
+    """
+
+    def __init__(self, rate_per_min: float, burst: Optional[float] = None) -> None:
+        self.rate_per_s = rate_per_min / 60.0
+        self.capacity = burst or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: float = 1) -> None:
+        n = min(n, self.capacity)  # a single oversized request must not wait forever
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_s)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate_per_s)
+
+
+# Rough output + reasoning allowance added to the input estimate when charging the TPM bucket
+OUTPUT_TOKEN_ESTIMATE = 8_000
+
+
+def estimate_request_tokens(body: Dict[str, Any]) -> int:
+    texts: List[str] = []
+    for msg in body.get("input", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(c.get("text", "") for c in content if isinstance(c, dict))
+    return sum(estimate_tokens(t) for t in texts) + OUTPUT_TOKEN_ESTIMATE
+
+
+def is_retryable_api_error(e: Exception) -> bool:
+    """429s, connection problems/timeouts and 5xx; other 4xx will not succeed on retry."""
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+
+    if isinstance(e, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+async def run_async(
+    requests: List[Dict[str, Any]],
+    concurrency: int = 16,
+    rpm: int = 0,
+    tpm: int = 0,
+    max_attempts: int = 6,
+) -> List[Dict[str, Any]]:
+    """
+    Send each batch request line directly to /v1/responses, at most `concurrency` in flight.
+    With rpm/tpm > 0, requests are paced up front by token buckets instead of running into 429s;
+    remaining transient errors are retried with random exponential backoff (max_attempts total).
+    Returns one batch-output-shaped line per request (same order), so parse_batch_output_jsonl applies.
+    """
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI()
+    sem = asyncio.Semaphore(max(1, concurrency))
+    rpm_bucket = TokenBucket(rpm) if rpm > 0 else None
+    tpm_bucket = TokenBucket(tpm) if tpm > 0 else None
+
+    async def call(req: Dict[str, Any]) -> Any:
+        est_tokens = estimate_request_tokens(req["body"]) if tpm_bucket else 0
+        async with sem:
+            for attempt in range(max_attempts):
+                if rpm_bucket:
+                    await rpm_bucket.acquire(1)
+                if tpm_bucket:
+                    await tpm_bucket.acquire(est_tokens)
+                try:
+                    return await client.responses.create(**req["body"])
+                except Exception as e:
+                    if attempt == max_attempts - 1 or not is_retryable_api_error(e):
+                        raise
+                    delay = random.uniform(0, min(60.0, 2.0 ** (attempt + 1)))
+                    print(f"  [async] {req['custom_id']} {type(e).__name__}; retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    results = await asyncio.gather(*(call(r) for r in requests), return_exceptions=True)
+
+    lines: List[Dict[str, Any]] = []
+    for req, res in zip(requests, results):
+        if isinstance(res, BaseException):
+            print(f"  [async] {req['custom_id']} failed: {type(res).__name__}: {res}")
+            lines.append(
+                {
+                    "custom_id": req["custom_id"],
+                    "response": {"status_code": getattr(res, "status_code", None), "body": {}},
+                    "error": {"type": type(res).__name__, "message": str(res)},
+                }
+            )
+        else:
+            lines.append(
+                {
+                    "custom_id": req["custom_id"],
+                    "response": {"status_code": 200, "body": as_dict(res)},
+                    "error": None,
+                }
+            )
+    return lines
+
+
 # -------------------------
 # Parse batch output + write results
 # -------------------------
-def parse_batch_output_jsonl(batch_output_path: Path) -> List[Dict[str, Any]]:
+def parse_batch_output_jsonl(
+    batch_output_path: Path,
+    cache_dir: Optional[Path] = None,
+    cache_keys: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Parse batch output lines into records. With cache_dir + cache_keys (custom_id -> cache key),
+    every successfully parsed line is also stored in the response cache.
+    """
     records: List[Dict[str, Any]] = []
-    for line in batch_output_path.read_text(encoding="utf-8").splitlines():
-        if not line.strip():
-            continue
-        obj = json.loads(line)
-
-        custom_id = obj.get("custom_id")
-        err = obj.get("error")
-        resp = obj.get("response") or {}
-        status_code = resp.get("status_code")
-        body = resp.get("body") if isinstance(resp, dict) else None
-        body = body if isinstance(body, dict) else {}
-
-        output_text = ""
-        parsed = None
-        parse_error = None
-
-        if err is None and status_code == 200:
-            output_text = extract_output_text_from_responses_body(body)
-            parsed, parse_error = try_parse_json(output_text)
-        else:
-            parse_error = f"request_error: {err or body.get('error', {})}"
+    # Read line by line: the output file can be large and never needs to be held whole
+    with batch_output_path.open("rb") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            obj = loads(line)
+            rec = parse_batch_output_line(obj)
+            records.append(rec)
 
-        records.append(
-            {
-                "custom_id": custom_id,
-                "status_code": status_code,
-                "error": err,
-                "output_text": output_text,
-                "parsed": parsed,
-                "parse_error": parse_error,
-                "model": body.get("model"),
-                "system_fingerprint": body.get("system_fingerprint"),
-            }
-        )
+            key = (cache_keys or {}).get(rec["custom_id"])
+            if cache_dir is not None and key and rec["status_code"] == 200 and rec["parse_error"] is None:
+                save_cached_response(cache_dir, key, obj)
 
     return records
 
 
+def parse_batch_output_line(obj: Dict[str, Any]) -> Dict[str, Any]:
+
+    custom_id = obj.get("custom_id")
+    err = obj.get("error")
+    resp = obj.get("response") or {}
+    status_code = resp.get("status_code")
+    body = resp.get("body") if isinstance(resp, dict) else None
+    body = body if isinstance(body, dict) else {}
+
+    output_text = ""
+    parsed = None
+    parse_error = None
+
+    if err is None and status_code == 200:
+        output_text = extract_output_text_from_responses_body(body)
+        parsed, parse_error = try_parse_json(output_text)
+    else:
+        parse_error = f"request_error: {err or body.get('error', {})}"
+
+    return {
+        "custom_id": custom_id,
+        "status_code": status_code,
+        "error": err,
+        "output_text": output_text,
+        "parsed": parsed,
+        "parse_error": parse_error,
+        "model": body.get("model"),
+        "system_fingerprint": body.get("system_fingerprint"),
+    }
+
+
+FLAT_CONTINUITY_FIELDS = (
+    "total_sessions",
+    "total_turns_all_roles",
+    "total_assistant_turns",
+    "count_RQ",
+    "count_RB",
+    "count_CD",
+    "count_UC",
+    "r_RQ",
+    "r_RB",
+    "r_CD",
+    "r_UC",
+    "weighted_penalty",
+    "contrib_RQ",
+    "contrib_RB",
+    "contrib_CD",
+    "contrib_UC",
+    "score",
+)
+
+
+def _sub(parsed: Dict[str, Any], key: str) -> Dict[str, Any]:
+    v = parsed.get(key)
+    return v if isinstance(v, dict) else {}
+
+
 def flatten_continuity(parsed: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Flatten the continuity judge JSON to simple scalar fields for xlsx.
     """
-    out: Dict[str, Any] = {
-        "total_sessions": None,
-        "total_turns_all_roles": None,
-        "total_assistant_turns": None,
-        "count_RQ": None,
-        "count_RB": None,
-        "count_CD": None,
-        "count_UC": None,
-        "r_RQ": None,
-        "r_RB": None,
-        "r_CD": None,
-        "r_UC": None,
-        "weighted_penalty": None,
-        "contrib_RQ": None,
-        "contrib_RB": None,
-        "contrib_CD": None,
-        "contrib_UC": None,
-        "score": None,
-    }
     if not isinstance(parsed, dict):
-        return out
-
-    meta = parsed.get("meta", {})
-    if isinstance(meta, dict):
-        out["total_sessions"] = meta.get("total_sessions")
-        out["total_turns_all_roles"] = meta.get("total_turns_all_roles")
-        out["total_assistant_turns"] = meta.get("total_assistant_turns")
-
-    counts = parsed.get("counts", {})
-    if isinstance(counts, dict):
-        out["count_RQ"] = counts.get("RQ")
-        out["count_RB"] = counts.get("RB")
-        out["count_CD"] = counts.get("CD")
-        out["count_UC"] = counts.get("UC")
-
-    rates = parsed.get("rates", {})
-    if isinstance(rates, dict):
-        out["r_RQ"] = rates.get("r_RQ")
-        out["r_RB"] = rates.get("r_RB")
-        out["r_CD"] = rates.get("r_CD")
-        out["r_UC"] = rates.get("r_UC")
-
-    penalty = parsed.get("penalty", {})
-    if isinstance(penalty, dict):
-        out["weighted_penalty"] = penalty.get("weighted_penalty")
-        out["contrib_RQ"] = penalty.get("contrib_RQ")
-        out["contrib_RB"] = penalty.get("contrib_RB")
-        out["contrib_CD"] = penalty.get("contrib_CD")
-        out["contrib_UC"] = penalty.get("contrib_UC")
-
-    out["score"] = parsed.get("score")
-    return out
+        return dict.fromkeys(FLAT_CONTINUITY_FIELDS)
+
+    meta = _sub(parsed, "meta")
+    counts = _sub(parsed, "counts")
+    rates = _sub(parsed, "rates")
+    penalty = _sub(parsed, "penalty")
+    return {
+        "total_sessions": meta.get("total_sessions"),
+        "total_turns_all_roles": meta.get("total_turns_all_roles"),
+        "total_assistant_turns": meta.get("total_assistant_turns"),
+        "count_RQ": counts.get("RQ"),
+        "count_RB": counts.get("RB"),
+        "count_CD": counts.get("CD"),
+        "count_UC": counts.get("UC"),
+        "r_RQ": rates.get("r_RQ"),
+        "r_RB": rates.get("r_RB"),
+        "r_CD": rates.get("r_CD"),
+        "r_UC": rates.get("r_UC"),
+        "weighted_penalty": penalty.get("weighted_penalty"),
+        "contrib_RQ": penalty.get("contrib_RQ"),
+        "contrib_RB": penalty.get("contrib_RB"),
+        "contrib_CD": penalty.get("contrib_CD"),
+        "contrib_UC": penalty.get("contrib_UC"),
+        "score": parsed.get("score"),
+    }
+
+
+# UC weighs 3x in the continuity penalty (see CONTINUITY_JUDGE_SYSTEM_PROMPT)
+PENALTY_WEIGHTS = {"RQ": 1.0, "RB": 1.0, "CD": 1.0, "UC": 3.0}
+
+
+def merge_continuity_judgements(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine judge outputs of one user's session windows: sum counts and turns, then recompute
+    rates, penalty and score with the prompt's formula. The session shared by neighbouring windows
+    is judged in both, so merged totals are an approximation.
+    """
+    def num(d: Any, key: str) -> float:
+        v = d.get(key) if isinstance(d, dict) else None
+        return v if isinstance(v, (int, float)) else 0
+
+    turns_all = sum(num(p.get("meta"), "total_turns_all_roles") for p in parts)
+    turns_asst = sum(num(p.get("meta"), "total_assistant_turns") for p in parts)
+    counts = {x: sum(num(p.get("counts"), x) for p in parts) for x in PENALTY_WEIGHTS}
+    rates = {f"r_{x}": (counts[x] / turns_asst if turns_asst else 0.0) for x in PENALTY_WEIGHTS}
+    contribs = {f"contrib_{x}": w * rates[f"r_{x}"] for x, w in PENALTY_WEIGHTS.items()}
+    weighted_penalty = sum(contribs.values())
+    events: List[Any] = []
+    for k, p in enumerate(parts):
+        for ev in p.get("events") or []:
+            events.append({**ev, "shard_index": k} if isinstance(ev, dict) else ev)
+    return {
+        "meta": {
+            "total_sessions": max((num(p.get("meta"), "total_sessions") for p in parts), default=0),
+            "total_turns_all_roles": turns_all,
+            "total_assistant_turns": turns_asst,
+            "merged_from_shards": len(parts),
+        },
+        "events": events,
+        "counts": counts,
+        "rates": rates,
+        "penalty": {"weighted_penalty": weighted_penalty, **contribs},
+        "score": max(0.0, 100 - 100 * weighted_penalty),
+    }
+
+
+def merge_shard_records(
+    records: List[Dict[str, Any]], request_index: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Replace the per-window records of split users with one record per user (custom_id = user_id).
+    Returns (records, request_index) where the index has one user-level entry per split user.
+    A user whose windows did not all parse keeps a record with parse_error set and no judge JSON.
+    """
+    shard_metas = [m for m in request_index if m.get("shard_count")]
+    if not shard_metas:
+        return records, request_index
+
+    by_cid = {r["custom_id"]: r for r in records}
+    merged_records = [r for r in records if r["custom_id"] not in {m["custom_id"] for m in shard_metas}]
+    merged_index = [m for m in request_index if not m.get("shard_count")]
+
+    users: Dict[str, List[Dict[str, Any]]] = {}
+    for m in shard_metas:
+        users.setdefault(m["user_id"], []).append(m)
+    for user_id, metas in users.items():
+        metas.sort(key=lambda m: m["shard_index"])
+        shard_ids = [m["custom_id"] for m in metas]
+        merged_index.append(
+            {
+                "custom_id": user_id,
+                "user_id": user_id,
+                "chat_all_file": metas[0]["chat_all_file"],
+                "shard_ids": shard_ids,
+            }
+        )
+        shard_recs = [by_cid.get(cid) for cid in shard_ids]
+        ok = all(r is not None and r["parse_error"] is None and isinstance(r["parsed"], dict) for r in shard_recs)
+        first = next((r for r in shard_recs if r is not None), {})
+        merged_records.append(
+            {
+                "custom_id": user_id,
+                "status_code": 200 if ok else first.get("status_code"),
+                "error": None if ok else [r.get("error") if r else "missing" for r in shard_recs],
+                "output_text": "\n".join(r["output_text"] for r in shard_recs if r),
+                "parsed": merge_continuity_judgements([r["parsed"] for r in shard_recs]) if ok else None,
+                "parse_error": None if ok else "shard_error: " + "; ".join(
+                    f"{cid}: {r['parse_error'] if r else 'missing output'}"
+                    for cid, r in zip(shard_ids, shard_recs)
+                    if r is None or r["parse_error"] is not None or not isinstance(r["parsed"], dict)
+                ),
+                "model": first.get("model"),
+                "system_fingerprint": first.get("system_fingerprint"),
+            }
+        )
+    return merged_records, merged_index
+
+
+# Column order of results.xlsx
+RESULT_COLUMNS = [
+    "user_id",
+    "custom_id",
+    "chat_all_file",
+    "status_code",
+    "parse_error",
+    "total_sessions",
+    "total_turns_all_roles",
+    "total_assistant_turns",
+    "count_RQ",
+    "count_RB",
+    "count_CD",
+    "count_UC",
+    "r_RQ",
+    "r_RB",
+    "r_CD",
+    "r_UC",
+    "contrib_RQ",
+    "contrib_RB",
+    "contrib_CD",
+    "contrib_UC",
+    "weighted_penalty",
+    "score",
+    "model",
+    "system_fingerprint",
+]
+
+
+def write_results_xlsx(rows: List[Dict[str, Any]], xlsx_path: Path) -> None:
+    """Stream rows straight into a write-only openpyxl workbook (no DataFrame in between)."""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(RESULT_COLUMNS)
+    for r in rows:
+        ws.append([r.get(col) for col in RESULT_COLUMNS])
+    wb.save(xlsx_path)
 
 
 def write_readable_outputs(
     out_dir: Path,
     request_index: List[Dict[str, Any]],
     records: List[Dict[str, Any]],
+    max_workers: int = 16,
 ) -> None:
+    """
+    Per-item files are serialized and written on a thread pool (many small files on slow storage);
+    combined_readable.json is assembled in the main thread.
+    """
     readable_dir = out_dir / "readable"
     per_item_dir = readable_dir / "per_item"
     safe_mkdir(per_item_dir)
 
     idx_map = {r["custom_id"]: r for r in request_index}
     combined: Dict[str, Any] = {}
+    per_item: List[Tuple[Path, Dict[str, Any]]] = []
 
     for rec in records:
         cid = rec["custom_id"]
@@ -510,24 +1092,24 @@ def write_readable_outputs(
             "status_code": rec["status_code"],
             "parse_error": rec["parse_error"],
             "judge": rec["parsed"],
-            "output_text": rec["output_text"],  # keep for audit/debug
+            # raw text only when it could not be parsed (audit/debug); otherwise it duplicates "judge"
+            "output_text": rec["output_text"] if rec["parsed"] is None else None,
             "model": rec["model"],
             "system_fingerprint": rec["system_fingerprint"],
         }
-
-        # per-item file
-        (per_item_dir / f"{cid}.json").write_text(
-            json.dumps(item, ensure_ascii=False, indent=2),
-            encoding="utf-8",
-        )
+        per_item.append((per_item_dir / f"{cid}.json", item))
 
         user_id = meta.get("user_id", "UNKNOWN_USER")
         combined[user_id] = item
 
-    (readable_dir / "combined_readable.json").write_text(
-        json.dumps(combined, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    def write_item(path_item: Tuple[Path, Dict[str, Any]]) -> None:
+        path, item = path_item
+        path.write_bytes(dumps_pretty(item))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+        list(ex.map(write_item, per_item))
+
+    (readable_dir / "combined_readable.json").write_bytes(dumps_pretty(combined))
 
 
 def main() -> int:
@@ -540,6 +1122,17 @@ def main() -> int:
                     help="Reasoning effort (use high/xhigh for reliability). Note: temperature is NOT used.")
     ap.add_argument("--poll_s", type=int, default=15, help="Batch status polling interval (seconds)")
     ap.add_argument("--user_filter", default="", help="Optional: only evaluate users whose folder name contains this substring")
+    ap.add_argument("--mode", default="batch", choices=["batch", "async"],
+                    help="batch: 24h Batch API (default, cheaper); async: direct concurrent /v1/responses calls (fast for small jobs)")
+    ap.add_argument("--cache", dest="cache", action="store_true", default=True,
+                    help="Reuse judge responses for unchanged (prompt, chat_all, model, effort) inputs (default)")
+    ap.add_argument("--no_cache", dest="cache", action="store_false", help="Always submit every user")
+    ap.add_argument("--cache_dir", default="", help="Response cache directory (default: <out_dir>/cache)")
+    ap.add_argument("--max_input_tokens", type=int, default=MAX_INPUT_TOKENS,
+                    help=f"Preflight input budget per request; larger users are slimmed/split (default: {MAX_INPUT_TOKENS}, 0 = off)")
+    ap.add_argument("--concurrency", type=int, default=16, help="Max in-flight requests with --mode async")
+    ap.add_argument("--rpm", type=int, default=0, help="Requests-per-minute limit to pace --mode async (0 = unpaced)")
+    ap.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute limit to pace --mode async (0 = unpaced)")
     args = ap.parse_args()
 
     user_data_dir = Path(args.user_data_dir).expanduser().resolve()
@@ -552,6 +1145,10 @@ def main() -> int:
 
     batch_input_jsonl = out_dir / "batch_input.jsonl"
     request_index_path = out_dir / "request_index.json"
+    cache_dir = None
+    if args.cache:
+        cache_dir = Path(args.cache_dir).expanduser().resolve() if args.cache_dir else out_dir / "cache"
+        safe_mkdir(cache_dir)
 
     print(f"[1/6] Building batch input jsonl -> {batch_input_jsonl}")
     request_index = build_batch_input_jsonl(
@@ -563,56 +1160,92 @@ def main() -> int:
         reasoning_effort=args.reasoning_effort,
         store=False,
         user_filter=(args.user_filter or None),
+        cache_dir=cache_dir,
+        max_input_tokens=args.max_input_tokens,
     )
-    print(f"  Prepared {len(request_index)} requests. Saved index -> {request_index_path}")
+    cached_ids = [r["custom_id"] for r in request_index if r.get("cached")]
+    print(f"  Prepared {len(request_index)} requests ({len(cached_ids)} served from cache). "
+          f"Saved index -> {request_index_path}")
 
-    client = OpenAI()
-
-    print("[2/6] Uploading batch input file (purpose='batch') ...")
-    batch_input_file = client.files.create(file=batch_input_jsonl.open("rb"), purpose="batch")
-    batch_input_file_id = batch_input_file.id
-    print(f"  Uploaded: file_id={batch_input_file_id}")
-
-    print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
-    batch = client.batches.create(
-        input_file_id=batch_input_file_id,
-        endpoint="/v1/responses",
-        completion_window="24h",
-        metadata={"job": "cross-session-continuity-eval", "model": args.model},
-    )
-    batch_id = batch.id
-    print(f"  Batch created: batch_id={batch_id}")
-
-    print("[4/6] Polling until batch completes ...")
-    batch_final = poll_batch_until_done(client, batch_id, poll_s=args.poll_s)
-    status = batch_final.status
-    print(f"  Final status: {status}")
-
-    output_file_id = batch_final.output_file_id
-    error_file_id = batch_final.error_file_id
-
-    if not output_file_id:
-        print("No output_file_id. Likely 0 successful requests.")
-        print("request_counts:", batch_final.request_counts)
-        print("error_file_id:", error_file_id)
-        if error_file_id:
-            err_path = out_dir / "batch_error.jsonl"
-            download_file_content(client, error_file_id, err_path)
-            print(f"Downloaded errors -> {err_path}")
-        return 2
-
-    print("[5/6] Downloading output file(s) ...")
     batch_output_path = out_dir / "batch_output.jsonl"
-    download_file_content(client, output_file_id, batch_output_path)
-    print(f"  Saved: {batch_output_path}")
+    batch_id = None
+    submitted = len(cached_ids) < len(request_index)
+    if not submitted:
+        print("[2/6] Every request has a cached response; nothing to submit.")
+    elif args.mode == "async":
+        print(f"[2/6] Calling /v1/responses directly (concurrency={args.concurrency}) ...")
+        output_lines = asyncio.run(
+            run_async(load_batch_requests(batch_input_jsonl), concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm)
+        )
+        with batch_output_path.open("wb") as f:
+            for line in output_lines:
+                f.write(dumps_line(line))
+        print(f"  Saved: {batch_output_path}")
+    else:
+        from openai import OpenAI
+
+        client = OpenAI()
+
+        # Lines are already compact (no indentation anywhere); the Batch API takes plain .jsonl, not gzip
+        size_mb = batch_input_jsonl.stat().st_size / (1024 * 1024)
+        print(f"[2/6] Uploading batch input file ({size_mb:.1f} MiB, purpose='batch') ...")
+        with batch_input_jsonl.open("rb") as fh:
+            batch_input_file = client.files.create(file=fh, purpose="batch")
+        batch_input_file_id = batch_input_file.id
+        print(f"  Uploaded: file_id={batch_input_file_id}")
+
+        print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
+        batch = client.batches.create(
+            input_file_id=batch_input_file_id,
+            endpoint="/v1/responses",
+            completion_window="24h",
+            metadata={"job": "cross-session-continuity-eval", "model": args.model},
+        )
+        batch_id = batch.id
+        print(f"  Batch created: batch_id={batch_id}")
+
+        print("[4/6] Polling until batch completes ...")
+        batch_final = poll_batch_until_done(client, batch_id, poll_s=args.poll_s)
+        status = batch_final.status
+        print(f"  Final status: {status}")
+
+        output_file_id = batch_final.output_file_id
+        error_file_id = batch_final.error_file_id
+
+        if not output_file_id:
+            print("No output_file_id. Likely 0 successful requests.")
+            print("request_counts:", batch_final.request_counts)
+            print("error_file_id:", error_file_id)
+            if error_file_id:
+                err_path = out_dir / "batch_error.jsonl"
+                download_file_content(client, error_file_id, err_path)
+                print(f"Downloaded errors -> {err_path}")
+            return 2
+
+        print("[5/6] Downloading output file(s) ...")
+        download_file_content(client, output_file_id, batch_output_path)
+        print(f"  Saved: {batch_output_path}")
 
-    if error_file_id:
-        batch_error_path = out_dir / "batch_error.jsonl"
-        download_file_content(client, error_file_id, batch_error_path)
-        print(f"  Saved: {batch_error_path}")
+        if error_file_id:
+            batch_error_path = out_dir / "batch_error.jsonl"
+            download_file_content(client, error_file_id, batch_error_path)
+            print(f"  Saved: {batch_error_path}")
 
     print("[6/6] Parsing outputs and writing results ...")
-    records = parse_batch_output_jsonl(batch_output_path)
+    records: List[Dict[str, Any]] = []
+    if submitted:
+        cache_keys = {r["custom_id"]: r["cache_key"] for r in request_index if r.get("cache_key")}
+        records = parse_batch_output_jsonl(batch_output_path, cache_dir=cache_dir, cache_keys=cache_keys)
+    for r in request_index:
+        if r.get("cached"):
+            obj = load_cached_response(cache_dir, r["cache_key"])
+            if obj is None:
+                print(f"  WARNING: cached response for {r['custom_id']} is unreadable; rerun with --no_cache")
+                continue
+            records.append(parse_batch_output_line({**obj, "custom_id": r["custom_id"]}))
+
+    # Users split into session windows get one merged record each from here on
+    records, request_index = merge_shard_records(records, request_index)
 
     # Load request index mapping
     idx_map = {r["custom_id"]: r for r in request_index}
@@ -620,50 +1253,18 @@ def main() -> int:
     # Write results.jsonl (enriched with user/pair info + flattened scores)
     results_jsonl = out_dir / "results.jsonl"
     enriched: List[Dict[str, Any]] = []
-    with results_jsonl.open("w", encoding="utf-8") as f:
+    with results_jsonl.open("wb") as f:
         for rec in records:
             meta = idx_map.get(rec["custom_id"], {})
             flat = flatten_continuity(rec["parsed"])
             out = {**meta, **rec, **flat}
             enriched.append(out)
-            f.write(json.dumps(out, ensure_ascii=False) + "\n")
+            f.write(dumps_line(out))
     print(f"  Saved: {results_jsonl}")
 
     # Write results.xlsx (one row per user)
-    df = pd.DataFrame(
-        [
-            {
-                "user_id": r.get("user_id"),
-                "custom_id": r.get("custom_id"),
-                "chat_all_file": r.get("chat_all_file"),
-                "status_code": r.get("status_code"),
-                "parse_error": r.get("parse_error"),
-                "total_sessions": r.get("total_sessions"),
-                "total_turns_all_roles": r.get("total_turns_all_roles"),
-                "total_assistant_turns": r.get("total_assistant_turns"),
-                "count_RQ": r.get("count_RQ"),
-                "count_RB": r.get("count_RB"),
-                "count_CD": r.get("count_CD"),
-                "count_UC": r.get("count_UC"),
-                "r_RQ": r.get("r_RQ"),
-                "r_RB": r.get("r_RB"),
-                "r_CD": r.get("r_CD"),
-                "r_UC": r.get("r_UC"),
-                "contrib_RQ": r.get("contrib_RQ"),
-                "contrib_RB": r.get("contrib_RB"),
-                "contrib_CD": r.get("contrib_CD"),
-                "contrib_UC": r.get("contrib_UC"),
-                "weighted_penalty": r.get("weighted_penalty"),
-                "score": r.get("score"),
-                "model": r.get("model"),
-                "system_fingerprint": r.get("system_fingerprint"),
-            }
-            for r in enriched
-        ]
-    ).sort_values(by=["user_id"])
-
     xlsx_path = out_dir / "results.xlsx"
-    df.to_excel(xlsx_path, index=False)
+    write_results_xlsx(sorted(enriched, key=lambda r: r.get("user_id") or ""), xlsx_path)
     print(f"  Saved: {xlsx_path}")
 
     # Write readable JSON outputs
@@ -671,7 +1272,8 @@ def main() -> int:
     print(f"  Saved readable JSON -> {out_dir / 'readable'}")
 
     print("\nDone.")
-    print(f"Batch id: {batch_id}")
+    if batch_id:
+        print(f"Batch id: {batch_id}")
     return 0
 
 
@@ -12,14 +12,15 @@ Reads:
 Writes:
   ../out_proactivity_eval/
     batch_input.jsonl
-    batch_output.jsonl
+    batch_input.NNN.jsonl      (shards, if more than --max_requests_per_batch requests)
+    batch_output.jsonl         (concatenated over all batches)
     batch_error.jsonl (if any)
     request_index.json
     results.jsonl              (one row per session; includes parsed judge output)
-    results_turns.xlsx         (one row per assistant turn; for plotting)
-    results_sessions.xlsx      (one row per session; summary metrics)
+    results_turns.parquet      (one row per assistant turn; for plotting; .csv/.xlsx via --fast_export)
+    results_sessions.parquet   (one row per session; summary metrics; .csv/.xlsx via --fast_export)
     readable/
-      combined_readable.json
+      combined_readable.ndjson (one {"user_id", "session_id", "item"} line per session; --skip_combined_readable to omit)
       per_item/<custom_id>.json
 
 Notes:
@@ -29,16 +30,30 @@ Notes:
 """
 
 import argparse
+import hashlib
 import json
+import os
+import random
 import re
+import shutil
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import pandas as pd
 from openai import OpenAI
 
+try:
+    import orjson
+except ImportError:  # optional speedup, see dumps_line / loads
+    orjson = None
+try:
+    import xlsxwriter
+except ImportError:  # optional, see write_xlsx_constant_memory
+    xlsxwriter = None
+
 
 # -------------------------
 # Proactivity judge prompt
@@ -105,20 +120,45 @@ Notes:
 # -------------------------
 # Helpers
 # -------------------------
-CHAT_FILE_RE = re.compile(r"^chat(\d+)\.json$", re.IGNORECASE)
+CHAT_FILE_RE = re.compile(r"chat(\d+)\.json", re.IGNORECASE)  # used with fullmatch; chat_index.json never matches
 
 
 def safe_mkdir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
-def load_json(path: Path) -> Any:
-    raw = path.read_text(encoding="utf-8-sig")  # tolerate BOM
-    return json.loads(raw)
+# orjson (C, emits UTF-8 bytes) on the hot paths when installed; stdlib json otherwise.
+if orjson is not None:
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
 
 
 def json_canonical_dumps(data: Any) -> str:
-    return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
+    # Sorted keys keep the prompt reproducible; no indentation, which only cost CPU and prompt tokens.
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
 
 
 def read_text(path: Path) -> str:
@@ -130,19 +170,37 @@ def extract_output_text_from_responses_body(body: Dict[str, Any]) -> str:
     if isinstance(body, dict) and isinstance(body.get("output_text"), str):
         return body["output_text"]
 
+    # Fast path for the usual shape: one assistant message with one text part, optionally preceded
+    # by the reasoning item that reasoning models emit first.
+    try:
+        output = body["output"]
+        item = output[-1]
+        if (
+            (len(output) == 1 or (len(output) == 2 and output[0]["type"] == "reasoning"))
+            and item["type"] == "message"
+            and item["role"] == "assistant"
+        ):
+            content = item["content"]
+            c0 = content[0]
+            t = c0.get("text")
+            if len(content) == 1 and c0["type"] in ("output_text", "text") and isinstance(t, str) and t:
+                return t
+    except (KeyError, TypeError, IndexError, AttributeError):
+        pass
+
     out_parts: List[str] = []
     output = body.get("output")
-    if isinstance(output, list):
+    if type(output) is list:
         for item in output:
-            if not isinstance(item, dict):
+            if type(item) is not dict:
                 continue
             if item.get("type") == "message" and item.get("role") == "assistant":
                 content = item.get("content", [])
-                if isinstance(content, list):
+                if type(content) is list:
                     for c in content:
-                        if isinstance(c, dict) and c.get("type") in ("output_text", "text"):
+                        if type(c) is dict and c.get("type") in ("output_text", "text"):
                             t = c.get("text")
-                            if isinstance(t, str) and t:
+                            if type(t) is str and t:
                                 out_parts.append(t)
     if out_parts:
         return "\n".join(out_parts)
@@ -157,8 +215,10 @@ def try_parse_json(text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
         return None, f"{type(e).__name__}: {e}"
 
 
+# os.scandir: DirEntry.is_dir()/is_file() reuse the directory listing instead of a stat() per entry.
 def discover_users(user_data_dir: Path) -> List[Path]:
-    return [p for p in user_data_dir.iterdir() if p.is_dir()]
+    with os.scandir(user_data_dir) as it:
+        return [Path(e.path) for e in it if e.is_dir()]
 
 
 def discover_chats_for_user(user_dir: Path) -> List[Tuple[int, Path]]:
@@ -166,33 +226,74 @@ def discover_chats_for_user(user_dir: Path) -> List[Tuple[int, Path]]:
     if not chats_dir.exists():
         return []
     out: List[Tuple[int, Path]] = []
-    for p in chats_dir.iterdir():
-        if not p.is_file():
-            continue
-        if p.name.lower() == "chat_index.json":
-            continue
-        m = CHAT_FILE_RE.match(p.name)
-        if m:
-            out.append((int(m.group(1)), p))
+    with os.scandir(chats_dir) as it:
+        for e in it:
+            m = CHAT_FILE_RE.fullmatch(e.name)
+            if m and e.is_file():
+                out.append((int(m.group(1)), Path(e.path)))
     out.sort(key=lambda x: x[0])
     return out
 
 
-def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: int = 15) -> Any:
+def poll_batches_until_done(
+    client: OpenAI, batch_ids: List[str], poll_s: float = 15, max_poll_s: float = 300
+) -> List[Any]:
+    """
+    Poll all batches in one loop with capped exponential backoff (x1.5 per round, up to +10% jitter).
+    Once more than 90% of the in-flight requests are done the interval drops back to poll_s so
+    completion is noticed quickly. Returns the final batch objects in batch_ids order.
+    """
     terminal = {"completed", "failed", "expired", "cancelled"}
+    final: Dict[str, Any] = {}
+    delay = float(poll_s)
     while True:
-        b = client.batches.retrieve(batch_id)
-        print(f"[batch] {batch_id} status={b.status} request_counts={getattr(b, 'request_counts', None)}")
-        if b.status in terminal:
-            return b
-        time.sleep(poll_s)
+        done = total = 0
+        for batch_id in batch_ids:
+            if batch_id in final:
+                continue
+            b = client.batches.retrieve(batch_id)
+            rc = getattr(b, "request_counts", None)
+            print(f"[batch] {batch_id} status={b.status} request_counts={rc}")
+            if b.status in terminal:
+                final[batch_id] = b
+            elif b.status == "in_progress":
+                done += getattr(rc, "completed", 0) or 0
+                total += getattr(rc, "total", 0) or 0
+        if len(final) == len(batch_ids):
+            return [final[batch_id] for batch_id in batch_ids]
+        if total and done / total > 0.9:
+            delay = float(poll_s)
+        time.sleep(delay + random.uniform(0, delay * 0.1))
+        delay = min(delay * 1.5, max_poll_s)
+
+
+def submit_batch(client: OpenAI, batch_input_jsonl: Path, model: str) -> Tuple[str, str]:
+    """Upload one batch input file and create its batch; returns (input_file_id, batch_id)."""
+    # The Batch API takes plain .jsonl only (no gzip); the with-block closes the handle even if the upload fails.
+    with batch_input_jsonl.open("rb") as fh:
+        batch_input_file = client.files.create(file=fh, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_input_file.id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+        metadata={"job": "proactivity-eval", "model": model},
+    )
+    return batch_input_file.id, batch.id
+
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 
 def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
-    resp = client.files.content(file_id)
-    if hasattr(resp, "text") and resp.text is not None:
-        out_path.write_text(resp.text, encoding="utf-8")
+    if hasattr(client.files, "with_streaming_response"):
+        # Stream the body to disk in fixed-size chunks; no decoded str copy of a multi-GB output file.
+        with client.files.with_streaming_response.content(file_id) as resp, out_path.open("wb") as fh:
+            for chunk in resp.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                fh.write(chunk)
         return
+
+    # older SDKs: buffered download, written as raw bytes rather than through .text
+    resp = client.files.content(file_id)
     data = getattr(resp, "content", None)
     if data is None:
         data = str(resp).encode("utf-8")
@@ -202,6 +303,36 @@ def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
 # -------------------------
 # Batch input builder
 # -------------------------
+SESSION_PAYLOAD_PREFIX = "Score proactivity for each assistant turn in this single session.\n\n<SESSION_JSON>\n"
+SESSION_PAYLOAD_SUFFIX = "\n</SESSION_JSON>\n"
+
+
+def make_batch_line_encoder(
+    model: str, system_prompt: str, reasoning_effort: str, store: bool
+) -> Callable[[str, str], bytes]:
+    """
+    Returns encode_line(custom_id, user_payload) -> one compact JSONL line (with trailing newline).
+    Everything except the custom_id and the user payload (notably the multi-KB system prompt) is
+    JSON-encoded once here; the result is byte-identical to dumps_line() of the full request dict.
+    """
+    # IMPORTANT: do NOT include temperature.
+    head = b'{"custom_id":'
+    mid = (
+        b',"method":"POST","url":"/v1/responses","body":{"model":' + dumps_bytes(model)
+        + b',"input":[' + dumps_bytes({"role": "system", "content": system_prompt})
+        + b',{"role":"user","content":'
+    )
+    tail = (
+        b'}],"reasoning":' + dumps_bytes({"effort": reasoning_effort})
+        + b',"store":' + dumps_bytes(store) + b"}}\n"
+    )
+
+    def encode_line(custom_id: str, user_payload: str) -> bytes:
+        return b"".join((head, dumps_bytes(custom_id), mid, dumps_bytes(user_payload), tail))
+
+    return encode_line
+
+
 def build_batch_input_jsonl(
     user_data_dir: Path,
     out_jsonl: Path,
@@ -211,58 +342,64 @@ def build_batch_input_jsonl(
     reasoning_effort: str,
     store: bool = False,
     user_filter: Optional[str] = None,
+    dedupe: bool = True,
 ) -> List[Dict[str, Any]]:
+    """
+    Write one request line per session. Canonical transcripts are cached by file content, so a
+    session file shared by several users is parsed and serialized once. With dedupe=True a session
+    whose canonical transcript equals an earlier one is not submitted again: its request_index entry
+    gets "duplicate_of": <first custom_id> and expand_duplicates copies the judged record at parse time.
+    """
     users = discover_users(user_data_dir)
     if user_filter:
         users = [u for u in users if user_filter.lower() in u.name.lower()]
 
     request_index: List[Dict[str, Any]] = []
-    lines_written = 0
-
-    with out_jsonl.open("w", encoding="utf-8") as f:
-        for user_dir in users:
-            user_id = user_dir.name
-            chats = discover_chats_for_user(user_dir)
-            if not chats:
-                continue
-
-            for sess_idx, chat_path in chats:
-                custom_id = f"{user_id}__s{sess_idx}"
-                meta = {
-                    "custom_id": custom_id,
+    for user_dir in users:
+        user_id = user_dir.name
+        for sess_idx, chat_path in discover_chats_for_user(user_dir):
+            request_index.append(
+                {
+                    "custom_id": f"{user_id}__s{sess_idx}",
                     "user_id": user_id,
                     "session_id": sess_idx,
                     "file_path": str(chat_path),
                 }
-                request_index.append(meta)
-
-                session_json = load_json(chat_path)
-                user_payload = (
-                    "Score proactivity for each assistant turn in this single session.\n\n"
-                    "<SESSION_JSON>\n"
-                    f"{json_canonical_dumps(session_json)}\n"
-                    "</SESSION_JSON>\n"
-                )
-
-                # IMPORTANT: do NOT include temperature.
-                body = {
-                    "model": model,
-                    "input": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_payload},
-                    ],
-                    "reasoning": {"effort": reasoning_effort},
-                    "store": store,
-                }
-
-                line = {
-                    "custom_id": custom_id,
-                    "method": "POST",
-                    "url": "/v1/responses",
-                    "body": body,
-                }
-                f.write(json.dumps(line, ensure_ascii=False) + "\n")
-                lines_written += 1
+            )
+
+    encode_line = make_batch_line_encoder(model, system_prompt, reasoning_effort, store)
+
+    # blake2b(raw file bytes) -> (canonical transcript, blake2b(canonical transcript))
+    canon_cache: Dict[bytes, Tuple[str, bytes]] = {}
+
+    def canonical_session(path: Path) -> Tuple[str, bytes]:
+        raw = path.read_bytes()
+        raw_key = hashlib.blake2b(raw, digest_size=16).digest()
+        hit = canon_cache.get(raw_key)
+        if hit is None:
+            if raw.startswith(b"\xef\xbb\xbf"):  # tolerate BOM
+                raw = raw[3:]
+            canon = json_canonical_dumps(loads(raw))
+            hit = canon_cache[raw_key] = (canon, hashlib.blake2b(canon.encode("utf-8"), digest_size=16).digest())
+        return hit
+
+    def encode_request(meta: Dict[str, Any]) -> Tuple[bytes, bytes]:
+        canon, canon_key = canonical_session(Path(meta["file_path"]))
+        user_payload = SESSION_PAYLOAD_PREFIX + canon + SESSION_PAYLOAD_SUFFIX
+        return canon_key, encode_line(meta["custom_id"], user_payload)
+
+    # Reads, parses and encodes overlap on a thread pool; ex.map keeps the line order deterministic.
+    lines_written = 0
+    first_by_content: Dict[bytes, str] = {}
+    with out_jsonl.open("wb") as f, ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as ex:
+        for meta, (canon_key, line_bytes) in zip(request_index, ex.map(encode_request, request_index)):
+            if dedupe:
+                first_cid = first_by_content.setdefault(canon_key, meta["custom_id"])
+                if first_cid != meta["custom_id"]:
+                    meta["duplicate_of"] = first_cid
+                    continue
+            f.write(line_bytes)
+            lines_written += 1
 
     request_index_path.write_text(json.dumps(request_index, ensure_ascii=False, indent=2), encoding="utf-8")
 
@@ -272,59 +409,114 @@ def build_batch_input_jsonl(
     return request_index
 
 
+def expand_duplicates(
+    records: Iterable[Dict[str, Any]], request_index: List[Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    """Yield each judged record, followed by a copy for every custom_id marked "duplicate_of" it."""
+    children: Dict[str, List[str]] = {}
+    for meta in request_index:
+        first_cid = meta.get("duplicate_of")
+        if first_cid:
+            children.setdefault(first_cid, []).append(meta["custom_id"])
+    for rec in records:
+        yield rec
+        for cid in children.get(rec["custom_id"], ()):
+            yield {**rec, "custom_id": cid}
+
+
+def split_batch_input(batch_input_jsonl: Path, max_requests_per_batch: int) -> List[Path]:
+    """
+    Split batch_input.jsonl into batch_input.000.jsonl, batch_input.001.jsonl, ... of at most
+    max_requests_per_batch lines each. Returns [batch_input_jsonl] unchanged if it already fits.
+    """
+    with batch_input_jsonl.open("rb") as fh:
+        n_lines = sum(1 for _ in fh)
+    if max_requests_per_batch <= 0 or n_lines <= max_requests_per_batch:
+        return [batch_input_jsonl]
+
+    shards: List[Path] = []
+    out = None
+    with batch_input_jsonl.open("rb") as fh:
+        for i, line in enumerate(fh):
+            if i % max_requests_per_batch == 0:
+                if out is not None:
+                    out.close()
+                shard = batch_input_jsonl.with_name(f"batch_input.{len(shards):03d}.jsonl")
+                shards.append(shard)
+                out = shard.open("wb")
+            out.write(line)
+    if out is not None:
+        out.close()
+    return shards
+
+
+def concat_files(parts: List[Path], dest: Path) -> None:
+    with dest.open("wb") as out:
+        for part in parts:
+            with part.open("rb") as fh:
+                shutil.copyfileobj(fh, out)
+
+
 # -------------------------
 # Output parsing
 # -------------------------
-def parse_batch_output_jsonl(batch_output_path: Path) -> List[Dict[str, Any]]:
-    records: List[Dict[str, Any]] = []
-    for line in batch_output_path.read_text(encoding="utf-8").splitlines():
-        if not line.strip():
-            continue
-        obj = json.loads(line)
-
-        custom_id = obj.get("custom_id")
-        err = obj.get("error")
-        resp = obj.get("response") or {}
-        status_code = resp.get("status_code")
-        body = resp.get("body") if isinstance(resp, dict) else None
-        body = body if isinstance(body, dict) else {}
-
-        output_text = ""
-        parsed = None
-        parse_error = None
-
-        if err is None and status_code == 200:
-            output_text = extract_output_text_from_responses_body(body)
-            parsed, parse_error = try_parse_json(output_text)
-        else:
-            parse_error = f"request_error: {err or body.get('error', {})}"
-
-        records.append(
-            {
-                "custom_id": custom_id,
-                "status_code": status_code,
-                "error": err,
-                "output_text": output_text,
-                "parsed": parsed,
-                "parse_error": parse_error,
-                "model": body.get("model"),
-                "system_fingerprint": body.get("system_fingerprint"),
-            }
-        )
-    return records
-
-
-def write_readable_outputs(out_dir: Path, request_index: List[Dict[str, Any]], records: List[Dict[str, Any]]) -> None:
-    readable_dir = out_dir / "readable"
-    per_item_dir = readable_dir / "per_item"
-    safe_mkdir(per_item_dir)
+def parse_batch_output_jsonl(batch_output_path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield one parsed record per output line; nothing but the current line is held in memory."""
+    with batch_output_path.open("rb", buffering=1 << 20) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            yield parse_batch_output_line(loads(line))
+
+
+def parse_batch_output_line(obj: Dict[str, Any]) -> Dict[str, Any]:
+    custom_id = obj.get("custom_id")
+    err = obj.get("error")
+    # Decoded JSON only ever holds plain dict/list, so exact type checks are enough here.
+    resp = obj.get("response")
+    if type(resp) is not dict:
+        resp = {}
+    status_code = resp.get("status_code")
+    body = resp.get("body")
+    if type(body) is not dict:
+        body = {}
+
+    output_text = ""
+    parsed = None
+    parse_error = None
+
+    if err is None and status_code == 200:
+        output_text = extract_output_text_from_responses_body(body)
+        parsed, parse_error = try_parse_json(output_text)
+    else:
+        parse_error = f"request_error: {err or body.get('error', {})}"
+
+    return {
+        "custom_id": custom_id,
+        "status_code": status_code,
+        "error": err,
+        "output_text": output_text,
+        "parsed": parsed,
+        "parse_error": parse_error,
+        "model": body.get("model"),
+        "system_fingerprint": body.get("system_fingerprint"),
+    }
 
-    idx_map = {r["custom_id"]: r for r in request_index}
-    combined: Dict[str, Any] = {}
 
-    for rec in records:
+class ReadableOutputWriter:
+    """
+    Incremental writer for <out_dir>/readable, fed one record at a time from the parse pass.
+    The combined view is streamed as NDJSON, so no nested {user_id: {session_id: item}} dict is built.
+    """
+
+    def __init__(self, out_dir: Path, combined: bool = True) -> None:
+        self.readable_dir = out_dir / "readable"
+        self._per_item_dir = self.readable_dir / "per_item"
+        safe_mkdir(self._per_item_dir)
+        self._combined = (self.readable_dir / "combined_readable.ndjson").open("wb") if combined else None
+
+    def add(self, rec: Dict[str, Any], meta: Dict[str, Any]) -> None:
         cid = rec["custom_id"]
-        meta = idx_map.get(cid, {})
         item = {
             "meta": meta,
             "status_code": rec["status_code"],
@@ -335,100 +527,188 @@ def write_readable_outputs(out_dir: Path, request_index: List[Dict[str, Any]], r
             "system_fingerprint": rec["system_fingerprint"],
         }
 
-        (per_item_dir / f"{cid}.json").write_text(json.dumps(item, ensure_ascii=False, indent=2), encoding="utf-8")
+        (self._per_item_dir / f"{cid}.json").write_bytes(dumps_pretty(item))
 
-        user_id = meta.get("user_id", "UNKNOWN_USER")
-        session_id = str(meta.get("session_id", "UNKNOWN_SESSION"))
-        combined.setdefault(user_id, {})
-        combined[user_id][session_id] = item
+        if self._combined is not None:
+            self._combined.write(dumps_line({
+                "user_id": meta.get("user_id", "UNKNOWN_USER"),
+                "session_id": meta.get("session_id", "UNKNOWN_SESSION"),
+                "item": item,
+            }))
 
-    (readable_dir / "combined_readable.json").write_text(
-        json.dumps(combined, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    def close(self) -> None:
+        if self._combined is not None:
+            self._combined.close()
 
 
-def flatten_session_and_turns(
-    request_index: List[Dict[str, Any]],
-    records: List[Dict[str, Any]],
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
+def nullable_int_array(values: List[Any], dtype: str) -> Any:
+    """Small nullable ints for ordinal scores/flags/counts; kept as object if the judge returned something non-integer."""
+    try:
+        return pd.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return pd.array(values, dtype=object)
+
+
+# Column -> nullable int dtype; every other column is left to pandas inference.
+SESSION_COLUMNS: Dict[str, Optional[str]] = {
+    "user_id": None,
+    "session_id": "Int16",
+    "custom_id": None,
+    "file_path": None,
+    "status_code": "Int16",
+    "parse_error": None,
+    "num_assistant_turns": "Int16",
+    "num_score2": "Int16",
+    "num_score1_or_2": "Int16",
+    "rate_unprompted_agenda_advancing": None,
+    "notes": None,
+    "model": None,
+    "system_fingerprint": None,
+}
+TURN_COLUMNS: Dict[str, Optional[str]] = {
+    "user_id": None,
+    "session_id": "Int16",
+    "custom_id": None,
+    "assistant_turn_index": "Int16",
+    "score": "Int8",
+    "is_unprompted_agenda_advancing": "Int8",
+    "agenda_move_type": None,
+    "user_prompted": "Int8",
+    "turn_notes": None,
+}
+
+
+class ResultTables:
     """
-    Returns:
-      sessions_df: one row per session (user_id, session_id, summary metrics)
-      turns_df: one row per assistant turn
+    Column builders for the sessions/turns tables, fed one record at a time.
+    Columns are accumulated as plain lists and handed to pandas once, with nullable Int dtypes.
     """
-    idx_map = {r["custom_id"]: r for r in request_index}
 
-    session_rows: List[Dict[str, Any]] = []
-    turn_rows: List[Dict[str, Any]] = []
+    def __init__(self) -> None:
+        self.sessions: Dict[str, List[Any]] = {col: [] for col in SESSION_COLUMNS}
+        self.turns: Dict[str, List[Any]] = {col: [] for col in TURN_COLUMNS}
 
-    for rec in records:
+    def add(self, rec: Dict[str, Any], meta: Dict[str, Any]) -> None:
         cid = rec["custom_id"]
-        meta = idx_map.get(cid, {})
         user_id = meta.get("user_id")
         session_id = meta.get("session_id")
-        file_path = meta.get("file_path")
 
         parsed = rec.get("parsed")
-        if not isinstance(parsed, dict):
-            session_rows.append({
-                "user_id": user_id,
-                "session_id": session_id,
-                "custom_id": cid,
-                "file_path": file_path,
-                "status_code": rec.get("status_code"),
-                "parse_error": rec.get("parse_error"),
-                "num_assistant_turns": None,
-                "num_score2": None,
-                "num_score1_or_2": None,
-                "rate_unprompted_agenda_advancing": None,
-                "notes": None,
-                "model": rec.get("model"),
-                "system_fingerprint": rec.get("system_fingerprint"),
-            })
-            continue
-
-        st = parsed.get("session_summary", {}) if isinstance(parsed.get("session_summary"), dict) else {}
-        turns = parsed.get("assistant_turns", [])
-        if not isinstance(turns, list):
-            turns = []
+        if isinstance(parsed, dict):
+            st = parsed.get("session_summary", {}) if isinstance(parsed.get("session_summary"), dict) else {}
+            turns = parsed.get("assistant_turns", [])
+            if not isinstance(turns, list):
+                turns = []
+        else:
+            st, turns = {}, []
 
         # session summary row
-        session_rows.append({
-            "user_id": user_id,
-            "session_id": session_id,
-            "custom_id": cid,
-            "file_path": file_path,
-            "status_code": rec.get("status_code"),
-            "parse_error": rec.get("parse_error"),
-            "num_assistant_turns": st.get("num_assistant_turns", len(turns)),
-            "num_score2": st.get("num_score2"),
-            "num_score1_or_2": st.get("num_score1_or_2"),
-            "rate_unprompted_agenda_advancing": st.get("rate_unprompted_agenda_advancing"),
-            "notes": st.get("notes"),
-            "model": rec.get("model"),
-            "system_fingerprint": rec.get("system_fingerprint"),
-        })
+        s = self.sessions
+        s["user_id"].append(user_id)
+        s["session_id"].append(session_id)
+        s["custom_id"].append(cid)
+        s["file_path"].append(meta.get("file_path"))
+        s["status_code"].append(rec.get("status_code"))
+        s["parse_error"].append(rec.get("parse_error"))
+        s["num_assistant_turns"].append(st.get("num_assistant_turns", len(turns)) if isinstance(parsed, dict) else None)
+        s["num_score2"].append(st.get("num_score2"))
+        s["num_score1_or_2"].append(st.get("num_score1_or_2"))
+        s["rate_unprompted_agenda_advancing"].append(st.get("rate_unprompted_agenda_advancing"))
+        s["notes"].append(st.get("notes"))
+        s["model"].append(rec.get("model"))
+        s["system_fingerprint"].append(rec.get("system_fingerprint"))
 
         # turn rows
+        t_cols = self.turns
         for t in turns:
             if not isinstance(t, dict):
                 continue
-            turn_rows.append({
-                "user_id": user_id,
-                "session_id": session_id,
-                "custom_id": cid,
-                "assistant_turn_index": t.get("assistant_turn_index"),
-                "score": t.get("score"),
-                "is_unprompted_agenda_advancing": t.get("is_unprompted_agenda_advancing"),
-                "agenda_move_type": t.get("agenda_move_type"),
-                "user_prompted": (t.get("evidence", {}) or {}).get("user_prompted") if isinstance(t.get("evidence"), dict) else None,
-                "turn_notes": (t.get("evidence", {}) or {}).get("notes") if isinstance(t.get("evidence"), dict) else None,
+            evidence = t.get("evidence")
+            evidence = evidence if isinstance(evidence, dict) else None
+            t_cols["user_id"].append(user_id)
+            t_cols["session_id"].append(session_id)
+            t_cols["custom_id"].append(cid)
+            t_cols["assistant_turn_index"].append(t.get("assistant_turn_index"))
+            t_cols["score"].append(t.get("score"))
+            t_cols["is_unprompted_agenda_advancing"].append(t.get("is_unprompted_agenda_advancing"))
+            t_cols["agenda_move_type"].append(t.get("agenda_move_type"))
+            t_cols["user_prompted"].append(evidence.get("user_prompted") if evidence is not None else None)
+            t_cols["turn_notes"].append(evidence.get("notes") if evidence is not None else None)
+
+    def frames(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Returns:
+          sessions_df: one row per session (user_id, session_id, summary metrics)
+          turns_df: one row per assistant turn
+        """
+        def build(columns: Dict[str, List[Any]], dtypes: Dict[str, Optional[str]]) -> pd.DataFrame:
+            return pd.DataFrame({
+                col: nullable_int_array(values, dtypes[col]) if dtypes[col] else values
+                for col, values in columns.items()
             })
 
-    sessions_df = pd.DataFrame(session_rows).sort_values(by=["user_id", "session_id"])
-    turns_df = pd.DataFrame(turn_rows).sort_values(by=["user_id", "session_id", "assistant_turn_index"])
-    return sessions_df, turns_df
+        sessions_df = build(self.sessions, SESSION_COLUMNS).sort_values(by=["user_id", "session_id"])
+        turns_df = build(self.turns, TURN_COLUMNS).sort_values(by=["user_id", "session_id", "assistant_turn_index"])
+        return sessions_df, turns_df
+
+
+EXPORT_FORMATS = ("parquet", "csv", "xlsx")
+
+
+def _xlsx_cell(v: Any) -> Any:
+    if v is None or v is pd.NA or (isinstance(v, float) and v != v):
+        return None
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False)
+    return v
+
+
+def write_xlsx_constant_memory(df: pd.DataFrame, path: Path) -> None:
+    """
+    Row-by-row xlsxwriter workbook in constant_memory mode (each row is flushed to disk once written).
+    Rows are written directly: pandas' to_excel emits cells column by column, which constant_memory
+    mode silently drops.
+    """
+    wb = xlsxwriter.Workbook(str(path), {"constant_memory": True, "strings_to_numbers": False})
+    ws = wb.add_worksheet("Sheet1")
+    ws.write_row(0, 0, list(df.columns))
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, [_xlsx_cell(v) for v in row])
+    wb.close()
+
+
+# Columns built with nullable_int_array; they fall back to object when the judge returned non-integers
+INT_COLUMNS = {col for col, dtype in {**SESSION_COLUMNS, **TURN_COLUMNS}.items() if dtype}
+
+
+def coerce_for_parquet(df: pd.DataFrame) -> pd.DataFrame:
+    """Int columns that fell back to object/str -> numeric (non-numbers become NaN); pyarrow rejects mixed types."""
+    bad = [c for c in df.columns if c in INT_COLUMNS and not pd.api.types.is_numeric_dtype(df[c])]
+    if not bad:
+        return df
+    return df.assign(**{c: pd.to_numeric(df[c], errors="coerce") for c in bad})
+
+
+def export_table(df: pd.DataFrame, out_dir: Path, stem: str, fmt: str) -> Path:
+    """
+    Write one results table; parquet/csv are columnar/plain writes, xlsx is streamed row by row.
+    If parquet cannot be written (pyarrow missing, or a column pyarrow cannot type) the table goes
+    to csv instead, so a finished batch never ends without its tables.
+    """
+    path = out_dir / f"{stem}.{fmt}"
+    if fmt == "parquet":
+        try:
+            coerce_for_parquet(df).to_parquet(path, engine="pyarrow", compression="zstd", index=False)
+        except (ImportError, TypeError, ValueError) as e:
+            print(f"  [WARN] {path.name} not written ({type(e).__name__}: {e}); writing csv instead")
+            return export_table(df, out_dir, stem, "csv")
+    elif fmt == "csv":
+        df.to_csv(path, index=False)
+    elif xlsxwriter is not None:
+        write_xlsx_constant_memory(df, path)
+    else:
+        df.to_excel(path, index=False)
+    return path
 
 
 # -------------------------
@@ -442,8 +722,17 @@ def main() -> int:
     ap.add_argument("--prompt_file", default="", help="Optional: system prompt override file")
     ap.add_argument("--reasoning_effort", default="high", choices=["none", "low", "medium", "high", "xhigh"],
                     help="Reasoning effort (temperature is NOT used).")
-    ap.add_argument("--poll_s", type=int, default=15, help="Batch polling interval (seconds)")
+    ap.add_argument("--poll_s", type=float, default=15, help="Initial batch polling interval (seconds); backs off x1.5 per poll")
+    ap.add_argument("--max_requests_per_batch", type=int, default=10_000,
+                    help="Split the requests into several concurrently submitted batches of at most this many lines")
+    ap.add_argument("--max_poll_s", type=float, default=300, help="Cap for the backed-off polling interval (seconds)")
     ap.add_argument("--user_filter", default="", help="Optional: only evaluate users whose folder name contains this substring")
+    ap.add_argument("--skip_combined_readable", action="store_true",
+                    help="Do not write readable/combined_readable.ndjson (per-item files are still written)")
+    ap.add_argument("--no_dedup", dest="dedupe", action="store_false", default=True,
+                    help="Submit every session even if its transcript is identical to another session's")
+    ap.add_argument("--fast_export", default="parquet", choices=list(EXPORT_FORMATS),
+                    help="Format of results_sessions/results_turns (default: parquet; xlsx is much slower on large runs)")
     args = ap.parse_args()
 
     user_data_dir = Path(args.user_data_dir).expanduser().resolve()
@@ -467,84 +756,96 @@ def main() -> int:
         reasoning_effort=args.reasoning_effort,
         store=False,
         user_filter=(args.user_filter or None),
+        dedupe=args.dedupe,
     )
-    print(f"  Prepared {len(request_index)} requests. Saved index -> {request_index_path}")
+    n_dupes = sum(1 for r in request_index if r.get("duplicate_of"))
+    print(f"  Prepared {len(request_index)} requests ({n_dupes} identical sessions deduplicated). "
+          f"Saved index -> {request_index_path}")
+    # Built once; shared by results.jsonl, readable outputs and the flattened tables
+    idx_map = {r["custom_id"]: r for r in request_index}
 
+    shards = split_batch_input(batch_input_jsonl, args.max_requests_per_batch)
     client = OpenAI()
 
-    print("[2/6] Uploading batch input file (purpose='batch') ...")
-    batch_input_file = client.files.create(file=batch_input_jsonl.open("rb"), purpose="batch")
-    batch_input_file_id = batch_input_file.id
-    print(f"  Uploaded: file_id={batch_input_file_id}")
-
-    print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
-    batch = client.batches.create(
-        input_file_id=batch_input_file_id,
-        endpoint="/v1/responses",
-        completion_window="24h",
-        metadata={"job": "proactivity-eval", "model": args.model},
-    )
-    batch_id = batch.id
-    print(f"  Batch created: batch_id={batch_id}")
-
-    print("[4/6] Polling until batch completes ...")
-    batch_final = poll_batch_until_done(client, batch_id, poll_s=args.poll_s)
-    print(f"  Final status: {batch_final.status}")
-
-    output_file_id = batch_final.output_file_id
-    error_file_id = batch_final.error_file_id
-
-    if not output_file_id:
-        print("No output_file_id. Likely 0 successful requests.")
-        print("request_counts:", batch_final.request_counts)
-        print("error_file_id:", error_file_id)
-        if error_file_id:
-            err_path = out_dir / "batch_error.jsonl"
-            download_file_content(client, error_file_id, err_path)
-            print(f"Downloaded errors -> {err_path}")
-        return 2
-
+    # Uploads/creates are independent HTTP calls, so the shards are submitted concurrently.
+    print(f"[2/6] Uploading {len(shards)} batch input file(s) (purpose='batch') ...")
+    print("[3/6] Creating batch(es) (endpoint='/v1/responses', completion_window='24h') ...")
+    with ThreadPoolExecutor(max_workers=min(8, len(shards))) as ex:
+        submitted = list(ex.map(lambda path: submit_batch(client, path, args.model), shards))
+    for path, (file_id, batch_id) in zip(shards, submitted):
+        size_mb = path.stat().st_size / (1024 * 1024)
+        print(f"  {path.name} ({size_mb:.1f} MiB): file_id={file_id} batch_id={batch_id}")
+    batch_ids = [batch_id for _, batch_id in submitted]
+
+    print(f"[4/6] Polling until {len(batch_ids)} batch(es) complete ...")
+    finals = poll_batches_until_done(client, batch_ids, poll_s=args.poll_s, max_poll_s=args.max_poll_s)
+    for batch_final in finals:
+        print(f"  {batch_final.id} final status: {batch_final.status}")
+
+    multi = len(finals) > 1
+    output_parts: List[Path] = []
+    error_parts: List[Path] = []
+    failed_batch_ids: List[str] = []
     print("[5/6] Downloading output file(s) ...")
-    batch_output_path = out_dir / "batch_output.jsonl"
-    download_file_content(client, output_file_id, batch_output_path)
-    print(f"  Saved: {batch_output_path}")
+    for k, batch_final in enumerate(finals):
+        suffix = f".{k:03d}" if multi else ""
+        if batch_final.output_file_id:
+            part = out_dir / f"batch_output{suffix}.jsonl"
+            download_file_content(client, batch_final.output_file_id, part)
+            output_parts.append(part)
+        else:
+            failed_batch_ids.append(batch_final.id)
+            print(f"No output_file_id for {batch_final.id}. Likely 0 successful requests.")
+            print("request_counts:", batch_final.request_counts)
+            print("error_file_id:", batch_final.error_file_id)
+        if batch_final.error_file_id:
+            part = out_dir / f"batch_error{suffix}.jsonl"
+            download_file_content(client, batch_final.error_file_id, part)
+            error_parts.append(part)
 
-    if error_file_id:
-        batch_error_path = out_dir / "batch_error.jsonl"
-        download_file_content(client, error_file_id, batch_error_path)
+    batch_output_path = out_dir / "batch_output.jsonl"
+    batch_error_path = out_dir / "batch_error.jsonl"
+    if multi:
+        concat_files(output_parts, batch_output_path)
+        if error_parts:
+            concat_files(error_parts, batch_error_path)
+    if error_parts:
         print(f"  Saved: {batch_error_path}")
+    if not output_parts:
+        return 2
+    if failed_batch_ids:
+        # Keep what the other shards produced; only the failed batches' sessions are missing
+        print(f"  WARNING: {len(failed_batch_ids)} of {len(finals)} batches produced no output "
+              f"({', '.join(failed_batch_ids)}); their sessions are missing from the results.")
+    print(f"  Saved: {batch_output_path}")
 
     print("[6/6] Parsing outputs and writing results ...")
-    records = parse_batch_output_jsonl(batch_output_path)
-
-    # Write results.jsonl (enriched session-level objects)
-    idx_map = {r["custom_id"]: r for r in request_index}
+    # Single streaming pass: each record goes to results.jsonl, the readable files and the table columns.
     results_jsonl = out_dir / "results.jsonl"
-    with results_jsonl.open("w", encoding="utf-8") as f:
-        for rec in records:
+    readable = ReadableOutputWriter(out_dir, combined=not args.skip_combined_readable)
+    tables = ResultTables()
+    with results_jsonl.open("wb") as f:
+        for rec in expand_duplicates(parse_batch_output_jsonl(batch_output_path), request_index):
             meta = idx_map.get(rec["custom_id"], {})
-            out = {**meta, **rec}
-            f.write(json.dumps(out, ensure_ascii=False) + "\n")
+            f.write(dumps_line({**meta, **rec}))  # enriched session-level object
+            readable.add(rec, meta)
+            tables.add(rec, meta)
+    readable.close()
     print(f"  Saved: {results_jsonl}")
+    print(f"  Saved readable JSON -> {readable.readable_dir}")
 
-    # Write readable JSON
-    write_readable_outputs(out_dir, request_index, records)
-    print(f"  Saved readable JSON -> {out_dir / 'readable'}")
-
-    # Flatten to two Excel files: turns & sessions
-    sessions_df, turns_df = flatten_session_and_turns(request_index, records)
+    # Flatten to two tables: turns & sessions
+    sessions_df, turns_df = tables.frames()
 
-    sessions_xlsx = out_dir / "results_sessions.xlsx"
-    sessions_df.to_excel(sessions_xlsx, index=False)
-    print(f"  Saved: {sessions_xlsx}")
+    sessions_path = export_table(sessions_df, out_dir, "results_sessions", args.fast_export)
+    print(f"  Saved: {sessions_path}")
 
-    turns_xlsx = out_dir / "results_turns.xlsx"
-    turns_df.to_excel(turns_xlsx, index=False)
-    print(f"  Saved: {turns_xlsx}")
+    turns_path = export_table(turns_df, out_dir, "results_turns", args.fast_export)
+    print(f"  Saved: {turns_path}")
 
     print("\nDone.")
-    print(f"Batch id: {batch_id}")
-    return 0
+    print(f"Batch id: {', '.join(batch_ids)}")
+    return 2 if failed_batch_ids else 0
 
 
 if __name__ == "__main__":
@@ -16,9 +16,11 @@ Reads (per user):
 
 Writes (in out_dir):
   batch_input.jsonl
+  batch_input.NNN.jsonl         (shards, if more than --max_requests_per_batch requests)
   request_index.json
-  batch_output.jsonl
+  batch_output.jsonl            (--mode online writes the same line format from direct calls)
   batch_error.jsonl (if any)
+  processed_cache.jsonl         (successful judge results keyed by session content; --no_cache to bypass)
   results.jsonl                 (one row per session; includes parsed judge output)
   results_sessions.xlsx         (one row per session; key fields for analysis)
   results_users.xlsx            (per-user aggregates: mean score, event rates, trend slope)
@@ -27,20 +29,48 @@ Writes (in out_dir):
     per_item/<custom_id>.json
 
 Notes
-- Uses /v1/responses via Batch API.
+- Uses /v1/responses via Batch API (default) or direct rate-limited calls (--mode online).
 - Avoids unsupported parameters (e.g., temperature for gpt-5.2-pro with reasoning != none).
 """
 
 import argparse
+import asyncio
+import hashlib
+import itertools
 import json
+import os
+import random
+import shutil
 import sys
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 
-import numpy as np
-import pandas as pd
-from openai import OpenAI
+try:
+    import orjson
+except ImportError:  # optional speedup, see dumps_line / loads
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional, see iter_chat_all_sessions
+    ijson = None
+
+try:
+    import msgspec
+except ImportError:  # optional, see parse_batch_output_line
+    msgspec = None
+
+try:
+    import xlsxwriter
+except ImportError:  # optional, see write_xlsx_fast
+    xlsxwriter = None
+
+if TYPE_CHECKING:  # pandas/openai are imported where used, keeping --help and input builds cheap
+    import pandas as pd
+    from openai import OpenAI
 
 
 # -------------------------
@@ -110,12 +140,43 @@ def safe_mkdir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
+# orjson (C, emits UTF-8 bytes) on the hot paths when installed; stdlib json otherwise.
+if orjson is not None:
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
 def load_json(path: Path) -> Any:
-    raw = path.read_text(encoding="utf-8-sig")  # tolerate BOM
-    return json.loads(raw)
+    raw = path.read_bytes()
+    if raw.startswith(b"\xef\xbb\xbf"):  # tolerate BOM
+        raw = raw[3:]
+    return loads(raw)
 
 
 def json_canonical_dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2).decode("utf-8")
     return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
 
 
@@ -139,6 +200,19 @@ def extract_output_text_from_responses_body(body: Dict[str, Any]) -> str:
         return body["output_text"]
 
     out = body.get("output")
+
+    # Fast path for the usual shape: one message item with one text part, optionally preceded by a
+    # reasoning item without content (what reasoning models emit first)
+    try:
+        if len(out) == 1 or (len(out) == 2 and out[0]["type"] == "reasoning" and not out[0].get("content")):
+            content = out[-1]["content"]
+            if type(content) is list and len(content) == 1:
+                c = content[0]
+                if c["type"] in ("output_text", "text") and type(c["text"]) is str:
+                    return c["text"].strip()
+    except (KeyError, TypeError, IndexError, AttributeError):
+        pass
+
     if isinstance(out, list):
         texts: List[str] = []
         for item in out:
@@ -162,17 +236,64 @@ def extract_output_text_from_responses_body(body: Dict[str, Any]) -> str:
     return ""
 
 
+# os.scandir: DirEntry.is_dir() reuses the directory listing instead of a stat() per entry.
 def discover_users(user_data_dir: Path) -> List[Path]:
     if not user_data_dir.exists():
         return []
-    return sorted([p for p in user_data_dir.iterdir() if p.is_dir()])
-
-
-def load_chat_all_sessions(chat_all_path: Path) -> List[Dict[str, Any]]:
+    with os.scandir(user_data_dir) as it:
+        return sorted(Path(e.path) for e in it if e.is_dir())
+
+
+def normalize_session(s: Any, idx: int) -> Dict[str, Any]:
+    """Session dict with a numeric 'session_id' (falls back to 'id', then the 1-based position idx)."""
+    if isinstance(s, dict):
+        sid = s.get("session_id")
+        if sid is None:
+            sid = s.get("id")
+        if sid is None:
+            sid = idx
+        try:
+            sid_int = int(sid)
+        except Exception:
+            sid_int = idx
+        s2 = dict(s)
+        s2["session_id"] = sid_int
+        return s2
+    return {"session_id": idx, "payload": s}
+
+
+def _chat_all_items_prefix(path: Path) -> Optional[str]:
+    """ijson prefix of the session array: {"sessions": [...]} or a bare [...]; None for anything else."""
+    with path.open("rb") as f:
+        head = f.read(4096)
+    if head.startswith(b"\xef\xbb\xbf"):
+        head = head[3:]
+    head = head.lstrip()
+    if head.startswith(b"{"):
+        return "sessions.item"
+    if head.startswith(b"["):
+        return "item"
+    return None
+
+
+def iter_chat_all_sessions(chat_all_path: Path) -> Iterator[Dict[str, Any]]:
     """
-    Accepts multiple possible chat_all.json formats.
-    Returns a list of session dicts with at least a numeric 'session_id' field.
+    Yield normalized sessions from chat_all.json in file order.
+    With ijson installed, sessions are decoded one at a time instead of loading the whole file;
+    other shapes (and runs without ijson) go through load_json.
     """
+    prefix = _chat_all_items_prefix(chat_all_path) if ijson is not None else None
+    if prefix is not None:
+        n = 0
+        with chat_all_path.open("rb") as f:
+            if f.read(3) != b"\xef\xbb\xbf":
+                f.seek(0)
+            for n, s in enumerate(ijson.items(f, prefix, use_float=True), start=1):
+                yield normalize_session(s, n)
+        if n or prefix == "item":
+            return
+        # An object without a "sessions" list: let the generic path below handle it
+
     obj = load_json(chat_all_path)
 
     sessions: List[Any] = []
@@ -184,31 +305,45 @@ def load_chat_all_sessions(chat_all_path: Path) -> List[Dict[str, Any]]:
         # Unknown; best-effort wrap
         sessions = [obj]
 
-    norm: List[Dict[str, Any]] = []
     for idx, s in enumerate(sessions, start=1):
-        if isinstance(s, dict):
-            sid = s.get("session_id")
-            if sid is None:
-                sid = s.get("id")
-            if sid is None:
-                sid = idx
-            try:
-                sid_int = int(sid)
-            except Exception:
-                sid_int = idx
-            s2 = dict(s)
-            s2["session_id"] = sid_int
-            norm.append(s2)
-        else:
-            norm.append({"session_id": idx, "payload": s})
-    # sort by session_id
-    norm.sort(key=lambda x: x.get("session_id", 0))
-    return norm
+        yield normalize_session(s, idx)
 
 
 # -------------------------
 # Batch IO
 # -------------------------
+# Buffer for the large append-only JSONL outputs: many small line writes become one write() per MiB
+JSONL_WRITE_BUFFER = 1 << 20
+
+SESSION_PAYLOAD_PREFIX = "Evaluate session-level proactivity and event indicators for this session.\n\n<SESSION_JSON>\n"
+SESSION_PAYLOAD_SUFFIX = "\n</SESSION_JSON>\n"
+
+
+def make_batch_line_encoder(
+    model: str, system_prompt: str, reasoning_effort: str, store: bool
+) -> Callable[[str, str], bytes]:
+    """
+    Returns encode_line(custom_id, user_payload) -> one compact JSONL line (with trailing newline).
+    Everything except the custom_id and the user payload (notably the multi-KB system prompt) is
+    JSON-encoded once here; the result is byte-identical to dumps_line() of the full request dict.
+    """
+    head = b'{"custom_id":'
+    mid = (
+        b',"method":"POST","url":"/v1/responses","body":{"model":' + dumps_bytes(model)
+        + b',"input":[' + dumps_bytes({"role": "system", "content": system_prompt})
+        + b',{"role":"user","content":'
+    )
+    tail = (
+        b'}],"reasoning":' + dumps_bytes({"effort": reasoning_effort})
+        + b',"store":' + dumps_bytes(store) + b"}}\n"
+    )
+
+    def encode_line(custom_id: str, user_payload: str) -> bytes:
+        return b"".join((head, dumps_bytes(custom_id), mid, dumps_bytes(user_payload), tail))
+
+    return encode_line
+
+
 def build_batch_input_jsonl(
     user_data_dir: Path,
     out_jsonl: Path,
@@ -218,74 +353,209 @@ def build_batch_input_jsonl(
     reasoning_effort: str,
     store: bool = False,
     user_filter: Optional[str] = None,
+    cache: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+    dedupe: bool = True,
 ) -> List[Dict[str, Any]]:
+    """
+    Write one request line per session and return the request index.
+    With cache (see load_processed_cache), each request gets a "content_sha256"; sessions whose
+    (custom_id, content_sha256) already has a result are marked "cached": True and not written.
+    With dedupe=True a session whose canonical JSON equals an earlier one (any user) is not written
+    either: it gets "duplicate_of": <first custom_id> and expand_duplicates copies the judged record.
+    """
     users = discover_users(user_data_dir)
     if user_filter:
         users = [u for u in users if user_filter.lower() in u.name.lower()]
 
-    request_index: List[Dict[str, Any]] = []
-    with out_jsonl.open("w", encoding="utf-8") as f:
-        for user_dir in users:
-            user_id = user_dir.name
-            chat_all_path = user_dir / "chats" / "chat_all.json"
-            if not chat_all_path.exists():
-                continue
+    encode_line = make_batch_line_encoder(model, system_prompt, reasoning_effort, store)
+
+    def prepare_user(user_dir: Path) -> List[Tuple[Dict[str, Any], Optional[bytes], bytes]]:
+        """(meta, encoded line or None if cached, content digest) per session of one user, in session_id order."""
+        user_id = user_dir.name
+        chat_all_path = user_dir / "chats" / "chat_all.json"
+        if not chat_all_path.exists():
+            return []
+
+        # Sessions stream in one at a time; only this user's encoded lines are held so they can be
+        # returned in session_id order (stable, like sorting the loaded list)
+        prepared: List[Tuple[int, Dict[str, Any], Optional[bytes], bytes]] = []
+        for sess in iter_chat_all_sessions(chat_all_path):
+            sess_id = int(sess.get("session_id", 0) or 0)
+            custom_id = f"{user_id}__s{sess_id}"
+            meta = {
+                "custom_id": custom_id,
+                "user_id": user_id,
+                "session_id": sess_id,
+                "chat_all_path": str(chat_all_path),
+            }
 
-            sessions = load_chat_all_sessions(chat_all_path)
-            if not sessions:
-                continue
+            canon = json_canonical_dumps(sess)
+            if cache is not None:
+                meta["content_sha256"] = session_content_hash(system_prompt, canon, model, reasoning_effort)
+                if (custom_id, meta["content_sha256"]) in cache:
+                    meta["cached"] = True
+                    prepared.append((sess_id, meta, None, b""))
+                    continue
 
-            for sess in sessions:
-                sess_id = int(sess.get("session_id", 0) or 0)
-                custom_id = f"{user_id}__s{sess_id}"
-                meta = {
-                    "custom_id": custom_id,
-                    "user_id": user_id,
-                    "session_id": sess_id,
-                    "chat_all_path": str(chat_all_path),
-                }
-                request_index.append(meta)
+            # The session is serialized once (canonical form); only the outer line encoding remains
+            user_payload = SESSION_PAYLOAD_PREFIX + canon + SESSION_PAYLOAD_SUFFIX
+            digest = hashlib.blake2b(canon.encode("utf-8"), digest_size=16).digest() if dedupe else b""
+            prepared.append((sess_id, meta, encode_line(custom_id, user_payload), digest))
 
-                user_payload = (
-                    "Evaluate session-level proactivity and event indicators for this session.\n\n"
-                    "<SESSION_JSON>\n"
-                    f"{json_canonical_dumps(sess)}\n"
-                    "</SESSION_JSON>\n"
-                )
-
-                body = {
-                    "model": model,
-                    "input": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_payload},
-                    ],
-                    "reasoning": {"effort": reasoning_effort},
-                    "store": store,
-                }
+        prepared.sort(key=lambda x: x[0])
+        return [(meta, encoded, digest) for _, meta, encoded, digest in prepared]
 
-                line = {
-                    "custom_id": custom_id,
-                    "method": "POST",
-                    "url": "/v1/responses",
-                    "body": body,
-                }
-                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    # Users are read and encoded on a thread pool (file reads overlap with encoding); this thread is the
+    # only writer, and ex.map hands results back in user order, so the output is deterministic.
+    request_index: List[Dict[str, Any]] = []
+    first_by_digest: Dict[bytes, str] = {}
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with out_jsonl.open("wb", buffering=JSONL_WRITE_BUFFER) as f, ThreadPoolExecutor(max_workers=workers) as ex:
+        for prepared in ex.map(prepare_user, users):
+            for meta, encoded, digest in prepared:
+                request_index.append(meta)
+                if encoded is None:
+                    continue
+                if dedupe:
+                    first_cid = first_by_digest.setdefault(digest, meta["custom_id"])
+                    if first_cid != meta["custom_id"]:
+                        meta["duplicate_of"] = first_cid
+                        continue
+                f.write(encoded)
 
     request_index_path.write_text(json.dumps(request_index, ensure_ascii=False, indent=2), encoding="utf-8")
     return request_index
 
 
-def poll_batch_until_complete(client: OpenAI, batch_id: str, poll_interval: float = 5.0) -> Any:
-    while True:
-        b = client.batches.retrieve(batch_id)
-        status = getattr(b, "status", None)
-        print(f"[batch] {batch_id} status={status}")
-        if status in ("completed", "failed", "cancelled", "expired"):
-            return b
-        time.sleep(poll_interval)
+def expand_duplicates(records: List[Dict[str, Any]], request_index: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Each judged record, followed by a copy for every custom_id marked "duplicate_of" it."""
+    children: Dict[str, List[str]] = {}
+    for meta in request_index:
+        first_cid = meta.get("duplicate_of")
+        if first_cid:
+            children.setdefault(first_cid, []).append(meta["custom_id"])
+    if not children:
+        return records
+    out: List[Dict[str, Any]] = []
+    for rec in records:
+        out.append(rec)
+        for cid in children.get(rec["custom_id"], ()):
+            out.append({**rec, "custom_id": cid})
+    return out
+
+
+# -------------------------
+# Processed-session cache
+# -------------------------
+def session_content_hash(system_prompt: str, session_canon: str, model: str, reasoning_effort: str) -> str:
+    """Exact-match key: the same session judged with the same prompt, model and effort reuses the earlier result."""
+    h = hashlib.sha256()
+    for part in (system_prompt, session_canon, model, reasoning_effort):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def load_processed_cache(cache_path: Path) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """(custom_id, content_sha256) -> parsed record; later lines win, unreadable lines are skipped."""
+    cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    if not cache_path.exists():
+        return cache
+    with cache_path.open("rb") as f:
+        for line in f:
+            try:
+                entry = loads(line)
+                cache[(entry["custom_id"], entry["content_sha256"])] = entry["record"]
+            except Exception:
+                continue
+    return cache
+
+
+def append_processed_cache(
+    cache_path: Path, records: List[Dict[str, Any]], request_index: List[Dict[str, Any]]
+) -> int:
+    """Append every successfully parsed record of this run; returns the number of entries written."""
+    hashes = {r["custom_id"]: r["content_sha256"] for r in request_index if r.get("content_sha256")}
+    n = 0
+    with cache_path.open("ab", buffering=JSONL_WRITE_BUFFER) as f:
+        for rec in records:
+            h = hashes.get(rec["custom_id"])
+            if h and rec["status_code"] == 200 and rec["parse_error"] is None:
+                f.write(dumps_line({"custom_id": rec["custom_id"], "content_sha256": h, "record": rec}))
+                n += 1
+    return n
+
+
+def split_batch_input(batch_input_jsonl: Path, max_requests_per_batch: int) -> List[Path]:
+    """
+    Split batch_input.jsonl into batch_input.000.jsonl, batch_input.001.jsonl, ... of at most
+    max_requests_per_batch lines each. Returns [batch_input_jsonl] unchanged if it already fits.
+    """
+    with batch_input_jsonl.open("rb") as fh:
+        n_lines = sum(1 for _ in fh)
+    if max_requests_per_batch <= 0 or n_lines <= max_requests_per_batch:
+        return [batch_input_jsonl]
+
+    shards: List[Path] = []
+    out = None
+    with batch_input_jsonl.open("rb") as fh:
+        for i, line in enumerate(fh):
+            if i % max_requests_per_batch == 0:
+                if out is not None:
+                    out.close()
+                shard = batch_input_jsonl.with_name(f"batch_input.{len(shards):03d}.jsonl")
+                shards.append(shard)
+                out = shard.open("wb", buffering=JSONL_WRITE_BUFFER)
+            out.write(line)
+    if out is not None:
+        out.close()
+    return shards
+
+
+def concat_files(parts: List[Path], dest: Path) -> None:
+    with dest.open("wb") as out:
+        for part in parts:
+            with part.open("rb") as fh:
+                shutil.copyfileobj(fh, out)
+
+
+def submit_batch(client: "OpenAI", batch_input_jsonl: Path) -> Tuple[str, str]:
+    """Upload one batch input file and create its batch; returns (input_file_id, batch_id)."""
+    with batch_input_jsonl.open("rb") as fh:
+        up = client.files.create(file=fh, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=up.id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+    )
+    return up.id, batch.id
 
 
-def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
+def poll_batches_until_done(
+    client: "OpenAI", batch_ids: List[str], poll_s: float = 5.0, max_poll_s: float = 60.0
+) -> List[Any]:
+    """
+    Poll all batches each round (retrieves run concurrently), sleeping poll_s, then x2 per round up
+    to max_poll_s. Returns the final batch objects in batch_ids order.
+    """
+    terminal = {"completed", "failed", "cancelled", "expired"}
+    final: Dict[str, Any] = {}
+    delay = float(poll_s)
+    with ThreadPoolExecutor(max_workers=min(8, len(batch_ids)) or 1) as ex:
+        while True:
+            pending = [batch_id for batch_id in batch_ids if batch_id not in final]
+            for b in ex.map(client.batches.retrieve, pending):
+                status = getattr(b, "status", None)
+                print(f"[batch] {b.id} status={status}")
+                if status in terminal:
+                    final[b.id] = b
+            if len(final) == len(batch_ids):
+                return [final[batch_id] for batch_id in batch_ids]
+            time.sleep(delay)
+            delay = min(delay * 2, max_poll_s)
+
+
+def download_file_content(client: "OpenAI", file_id: str, out_path: Path) -> None:
     resp = client.files.content(file_id)
     # SDK may return a binary stream-like object
     if hasattr(resp, "write_to_file"):
@@ -300,72 +570,417 @@ def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
     out_path.write_bytes(data)
 
 
-def parse_batch_output_jsonl(batch_output_path: Path) -> List[Dict[str, Any]]:
-    records: List[Dict[str, Any]] = []
-    for line in batch_output_path.read_text(encoding="utf-8").splitlines():
-        if not line.strip():
-            continue
-        obj = json.loads(line)
-
-        custom_id = obj.get("custom_id")
-        err = obj.get("error")
-        resp = obj.get("response") or {}
-        status_code = resp.get("status_code")
-        body = resp.get("body") if isinstance(resp, dict) else None
-        body = body if isinstance(body, dict) else {}
-
-        output_text = ""
-        parsed = None
-        parse_error = None
-
-        if err is None and status_code == 200:
-            output_text = extract_output_text_from_responses_body(body)
-            parsed, parse_error = try_parse_json(output_text)
+# -------------------------
+# Online (non-batch) mode
+# -------------------------
+def load_batch_requests(batch_input_jsonl: Path) -> List[Dict[str, Any]]:
+    requests: List[Dict[str, Any]] = []
+    with batch_input_jsonl.open("rb") as f:
+        for line in f:
+            if line.strip():
+                requests.append(loads(line))
+    return requests
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_min/60 per second up to burst (default: one minute's worth).
+    acquire(n) waits until n units are available; waiters queue on a lock, so they are served in order.
+    """
+
+    def __init__(self, rate_per_min: float, burst: Optional[float] = None) -> None:
+        self.rate_per_s = rate_per_min / 60.0
+        self.capacity = burst or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, n: float = 1) -> None:
+        n = min(n, self.capacity)  # a single oversized request must not wait forever
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_s)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate_per_s)
+
+
+# Rough output + reasoning allowance added to the input estimate when charging the TPM bucket
+OUTPUT_TOKEN_ESTIMATE = 8_000
+
+
+def estimate_request_tokens(body: Dict[str, Any]) -> int:
+    """Conservative chars/3 estimate of the input messages plus OUTPUT_TOKEN_ESTIMATE."""
+    chars = 0
+    for msg in body.get("input", []):
+        content = msg.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+    return chars // 3 + 1 + OUTPUT_TOKEN_ESTIMATE
+
+
+def is_retryable_api_error(e: Exception) -> bool:
+    """429s, connection problems/timeouts and 5xx; other 4xx will not succeed on retry."""
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+
+    if isinstance(e, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+def response_as_dict(resp: Any) -> Dict[str, Any]:
+    if isinstance(resp, dict):
+        return resp
+    if hasattr(resp, "model_dump"):
+        return resp.model_dump()
+    return {}
+
+
+async def dispatch_online(
+    requests: List[Dict[str, Any]],
+    concurrency: int = 16,
+    rpm: int = 0,
+    tpm: int = 0,
+    max_attempts: int = 6,
+) -> List[Dict[str, Any]]:
+    """
+    Send each batch request line directly to /v1/responses, at most `concurrency` in flight.
+    With rpm/tpm > 0, requests are paced up front by token buckets instead of running into 429s;
+    remaining transient errors are retried with random exponential backoff (max_attempts total).
+    Returns one batch-output-shaped line per request (same order), so parse_batch_output_jsonl applies.
+    """
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI()
+    sem = asyncio.Semaphore(max(1, concurrency))
+    rpm_bucket = TokenBucket(rpm) if rpm > 0 else None
+    tpm_bucket = TokenBucket(tpm) if tpm > 0 else None
+
+    async def call(req: Dict[str, Any]) -> Any:
+        est_tokens = estimate_request_tokens(req["body"]) if tpm_bucket else 0
+        async with sem:
+            for attempt in range(max_attempts):
+                if rpm_bucket:
+                    await rpm_bucket.acquire(1)
+                if tpm_bucket:
+                    await tpm_bucket.acquire(est_tokens)
+                try:
+                    return await client.responses.create(**req["body"])
+                except Exception as e:
+                    if attempt == max_attempts - 1 or not is_retryable_api_error(e):
+                        raise
+                    delay = random.uniform(0, min(60.0, 2.0 ** (attempt + 1)))
+                    print(f"  [online] {req['custom_id']} {type(e).__name__}; retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    results = await asyncio.gather(*(call(r) for r in requests), return_exceptions=True)
+
+    lines: List[Dict[str, Any]] = []
+    for req, res in zip(requests, results):
+        if isinstance(res, BaseException):
+            print(f"  [online] {req['custom_id']} failed: {type(res).__name__}: {res}")
+            lines.append(
+                {
+                    "custom_id": req["custom_id"],
+                    "response": {"status_code": getattr(res, "status_code", None), "body": {}},
+                    "error": {"type": type(res).__name__, "message": str(res)},
+                }
+            )
         else:
-            parse_error = f"request_error: {err or body.get('error', {})}"
+            lines.append(
+                {
+                    "custom_id": req["custom_id"],
+                    "response": {"status_code": 200, "body": response_as_dict(res)},
+                    "error": None,
+                }
+            )
+    return lines
 
-        records.append(
-            {
-                "custom_id": custom_id,
-                "status_code": status_code,
-                "output_text": output_text,
-                "parsed": parsed,
-                "parse_error": parse_error,
-                "model": body.get("model"),
-                "system_fingerprint": body.get("system_fingerprint"),
-                "raw_body": body,
-            }
-        )
+
+# Below this many output lines the process pool's startup costs more than it saves
+PARALLEL_PARSE_MIN_LINES = 2_000
+PARSE_CHUNK_LINES = 512
+
+
+# Typed views of a batch output line: only the fields read below are decoded, everything else in the
+# response body is skipped by the decoder instead of being built into dicts
+if msgspec is not None:
+    class OutputContent(msgspec.Struct):
+        type: Any = None
+        text: Any = None
+
+    class OutputItem(msgspec.Struct):
+        content: Optional[List[OutputContent]] = None
+
+    class ResponseBody(msgspec.Struct):
+        model: Any = None
+        system_fingerprint: Any = None
+        output_text: Any = None
+        output: Optional[List[OutputItem]] = None
+        choices: Any = None
+        error: Any = msgspec.field(default_factory=dict)
+
+    class ResponseEnvelope(msgspec.Struct):
+        status_code: Any = None
+        body: Optional[ResponseBody] = None
+
+    class BatchOutputLine(msgspec.Struct):
+        custom_id: Any = None
+        response: Optional[ResponseEnvelope] = None
+        error: Any = None
+
+    _BATCH_LINE_DECODER = msgspec.json.Decoder(BatchOutputLine)
+
+
+def extract_output_text_from_body_view(body: "ResponseBody") -> str:
+    """extract_output_text_from_responses_body for a decoded ResponseBody view."""
+    if isinstance(body.output_text, str) and body.output_text.strip():
+        return body.output_text
+
+    if body.output is not None:
+        texts = [
+            c.text
+            for item in body.output
+            for c in item.content or ()
+            if c.type in ("output_text", "text") and isinstance(c.text, str)
+        ]
+        if texts:
+            return "\n".join(texts).strip()
+
+    if body.choices is not None:
+        try:
+            return body.choices[0]["message"]["content"]
+        except Exception:
+            pass
+
+    return ""
+
+
+def _parse_line_view(line: bytes) -> Optional[Dict[str, Any]]:
+    """Record via the msgspec views; None when the line does not fit them (the dict path handles it)."""
+    try:
+        view = _BATCH_LINE_DECODER.decode(line)
+    except msgspec.ValidationError:
+        return None
+
+    status_code = view.response.status_code if view.response is not None else None
+    body = view.response.body if view.response is not None else None
+    body = body if body is not None else ResponseBody()
+
+    output_text = ""
+    parsed = None
+    parse_error = None
+
+    if view.error is None and status_code == 200:
+        output_text = extract_output_text_from_body_view(body)
+        parsed, parse_error = try_parse_json(output_text)
+    else:
+        parse_error = f"request_error: {view.error or body.error}"
+
+    return {
+        "custom_id": view.custom_id,
+        "status_code": status_code,
+        "output_text": output_text,
+        "parsed": parsed,
+        "parse_error": parse_error,
+        "model": body.model,
+        "system_fingerprint": body.system_fingerprint,
+    }
+
+
+def parse_batch_output_line(line: bytes) -> Dict[str, Any]:
+    if msgspec is not None:
+        rec = _parse_line_view(line)
+        if rec is not None:
+            return rec
+
+    obj = loads(line)
+
+    custom_id = obj.get("custom_id")
+    err = obj.get("error")
+    resp = obj.get("response") or {}
+    status_code = resp.get("status_code")
+    body = resp.get("body") if isinstance(resp, dict) else None
+    body = body if isinstance(body, dict) else {}
+
+    output_text = ""
+    parsed = None
+    parse_error = None
+
+    if err is None and status_code == 200:
+        output_text = extract_output_text_from_responses_body(body)
+        parsed, parse_error = try_parse_json(output_text)
+    else:
+        parse_error = f"request_error: {err or body.get('error', {})}"
+
+    return {
+        "custom_id": custom_id,
+        "status_code": status_code,
+        "output_text": output_text,
+        "parsed": parsed,
+        "parse_error": parse_error,
+        "model": body.get("model"),
+        "system_fingerprint": body.get("system_fingerprint"),
+    }
+
+
+def _parse_chunk(lines: List[bytes]) -> List[Dict[str, Any]]:
+    return [parse_batch_output_line(line) for line in lines]
+
+
+def parse_batch_output_jsonl(batch_output_path: Path, workers: int = 0) -> List[Dict[str, Any]]:
+    """
+    Parse batch output lines into records (file order).
+    With workers > 1 and at least PARALLEL_PARSE_MIN_LINES lines, chunks are parsed in a process pool.
+    """
+    lines = [line for line in batch_output_path.read_bytes().splitlines() if line.strip()]
+    if workers <= 1 or len(lines) < PARALLEL_PARSE_MIN_LINES:
+        return _parse_chunk(lines)
+
+    it = iter(lines)
+    chunks = iter(lambda: list(itertools.islice(it, PARSE_CHUNK_LINES)), [])
+    records: List[Dict[str, Any]] = []
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for part in ex.map(_parse_chunk, chunks):
+            records.extend(part)
     return records
 
 
+READABLE_WRITE_THREADS = 16
+
+
 def write_readable_outputs(records: List[Dict[str, Any]], out_readable_dir: Path) -> None:
-    safe_mkdir(out_readable_dir / "per_item")
-    combined = []
-    for r in records:
-        cid = r.get("custom_id")
-        item = {
-            "custom_id": cid,
-            "status_code": r.get("status_code"),
-            "parse_error": r.get("parse_error"),
-            "output_text": r.get("output_text"),
-            "parsed": r.get("parsed"),
+    """
+    Stream combined_readable.json as a JSON array (same bytes as dumping the whole list) while the
+    per-item files are written by a thread pool; each item is encoded once and used for both.
+    At most a few hundred encoded items are pending at a time, so memory stays flat in len(records).
+    """
+    per_item_dir = out_readable_dir / "per_item"
+    safe_mkdir(per_item_dir)
+    pending: Deque[Any] = deque()
+    combined_path = out_readable_dir / "combined_readable.json"
+    with combined_path.open("wb", buffering=JSONL_WRITE_BUFFER) as f, ThreadPoolExecutor(
+        max_workers=READABLE_WRITE_THREADS
+    ) as ex:
+        f.write(b"[")
+        for i, r in enumerate(records):
+            cid = r.get("custom_id")
+            item = {
+                "custom_id": cid,
+                "status_code": r.get("status_code"),
+                "parse_error": r.get("parse_error"),
+                "output_text": r.get("output_text"),
+                "parsed": r.get("parsed"),
+            }
+            data = dumps_pretty(item)
+            pending.append(ex.submit((per_item_dir / f"{cid}.json").write_bytes, data))
+            # Array element: the item's pretty form indented one more level (strings never contain raw newlines)
+            f.write(b"\n  " if i == 0 else b",\n  ")
+            f.write(data.replace(b"\n", b"\n  "))
+            if len(pending) > 16 * READABLE_WRITE_THREADS:
+                pending.popleft().result()
+        f.write(b"\n]" if records else b"]")
+        for fut in pending:
+            fut.result()
+
+
+# Column -> nullable int dtype for results_sessions; None columns are left to pandas inference
+SESSION_COLUMNS: Dict[str, Optional[str]] = {
+    "user_id": None,
+    "session_id": "Int32",
+    "custom_id": None,
+    "chat_all_path": None,
+    "status_code": "Int16",
+    "parse_error": None,
+    "proactivity_score": "Int8",
+    "timely_closure": "Int8",
+    "focus_transition": "Int8",
+    "barrier_handling": "Int8",
+    "deepening_move": "Int8",
+    "assistant_turns": "Int16",
+    "notes": None,
+    "model": None,
+    "system_fingerprint": None,
+}
+USER_COLUMNS = [
+    "user_id",
+    "sessions_scored",
+    "mean_proactivity_score",
+    "score_slope_over_sessions",
+    "timely_closure_rate",
+    "focus_transition_rate",
+    "barrier_handling_rate",
+    "deepening_move_rate",
+    "total_assistant_turns",
+]
+EVENT_COLUMNS = ["timely_closure", "focus_transition", "barrier_handling", "deepening_move"]
+
+
+def nullable_int_array(values: List[Any], dtype: str) -> Any:
+    """Small nullable ints for ordinal scores/flags/counts; kept as object if the judge returned something non-integer."""
+    import pandas as pd
+
+    try:
+        return pd.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return pd.array(values, dtype=object)
+
+
+def build_user_aggregates(df_sessions: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Per-user aggregates from one groupby pass over numeric copies of the score columns.
+    The trend slope is the closed-form least-squares fit cov(x, y) / var(x) of proactivity_score
+    over session_id, using scored sessions only; it needs >= 2 of them and distinct session ids.
+    """
+    import pandas as pd
+
+    if df_sessions.empty:
+        return pd.DataFrame(columns=USER_COLUMNS)
+
+    # Typed columns are cast straight to float; only object fallbacks (see nullable_int_array) need coercion
+    num = pd.DataFrame(
+        {
+            c: (s if s.dtype != object else pd.to_numeric(s, errors="coerce")).astype("float64")
+            for c in ["session_id", "proactivity_score", "assistant_turns", *EVENT_COLUMNS]
+            for s in [df_sessions[c]]
         }
-        combined.append(item)
-        (out_readable_dir / "per_item" / f"{cid}.json").write_text(
-            json.dumps(item, ensure_ascii=False, indent=2),
-            encoding="utf-8",
-        )
-    (out_readable_dir / "combined_readable.json").write_text(
-        json.dumps(combined, ensure_ascii=False, indent=2),
-        encoding="utf-8",
     )
+    num.insert(0, "user_id", df_sessions["user_id"])
+
+    # No sort/category expansion in the groupbys; the (much smaller) result is sorted once at the end
+    g = num.groupby("user_id", dropna=False, sort=False, observed=True)
+    agg = g.agg(
+        sessions_scored=("proactivity_score", "count"),
+        mean_proactivity_score=("proactivity_score", "mean"),
+        **{f"{c}_rate": (c, "mean") for c in EVENT_COLUMNS},
+    )
+    agg["total_assistant_turns"] = g["assistant_turns"].sum(min_count=1)
+
+    # Slope over scored sessions; any missing session_id in a user's scored sessions leaves it undefined
+    scored = num[num["proactivity_score"].notna()]
+    sg = scored.groupby("user_id", dropna=False, sort=False, observed=True)
+    xc = scored["session_id"] - sg["session_id"].transform("mean")
+    yc = scored["proactivity_score"] - sg["proactivity_score"].transform("mean")
+    keys = [scored["user_id"]]
+    sxx = (xc * xc).groupby(keys, dropna=False, sort=False, observed=True).sum()
+    sxy = (xc * yc).groupby(keys, dropna=False, sort=False, observed=True).sum()
+    n_scored = sg.size()
+    slope = (sxy / sxx).where((n_scored >= 2) & (sg["session_id"].count() == n_scored) & (sxx > 0))
+    agg["score_slope_over_sessions"] = slope.reindex(agg.index)
+
+    return agg.reset_index()[USER_COLUMNS].sort_values("user_id", kind="stable", ignore_index=True)
 
 
 def build_results_tables(
     records: List[Dict[str, Any]],
     request_index: List[Dict[str, Any]],
-) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+) -> Tuple["pd.DataFrame", "pd.DataFrame", List[Dict[str, Any]]]:
+    """Returns (df_sessions, df_users, jsonl_rows); jsonl_rows are the session rows plus the parsed judge output."""
+    import pandas as pd
+
     idx_map = {r["custom_id"]: r for r in request_index}
     session_rows: List[Dict[str, Any]] = []
     jsonl_rows: List[Dict[str, Any]] = []
@@ -423,57 +1038,46 @@ def build_results_tables(
         session_rows.append(row)
         jsonl_rows.append({**row, "parsed": parsed})
 
-    df_sessions = pd.DataFrame(session_rows)
-    df_jsonl = pd.DataFrame(jsonl_rows)
+    df_sessions = pd.DataFrame(
+        {
+            col: nullable_int_array([r[col] for r in session_rows], dtype) if dtype else [r[col] for r in session_rows]
+            for col, dtype in SESSION_COLUMNS.items()
+        }
+    )
 
-    # Per-user aggregates
-    user_rows: List[Dict[str, Any]] = []
-    for user_id, g in df_sessions.groupby("user_id", dropna=False):
-        g_valid = g.dropna(subset=["proactivity_score"]).copy()
-        # If session_id missing, treat as sequential
-        if "session_id" in g_valid.columns:
-            xs = g_valid["session_id"].astype(float).to_numpy() if len(g_valid) else np.array([])
-        else:
-            xs = np.arange(1, len(g_valid) + 1, dtype=float)
+    df_users = build_user_aggregates(df_sessions)
+    return df_sessions, df_users, jsonl_rows
 
-        ys = g_valid["proactivity_score"].astype(float).to_numpy() if len(g_valid) else np.array([])
 
-        slope = None
-        if len(xs) >= 2 and np.all(np.isfinite(xs)) and np.all(np.isfinite(ys)):
-            try:
-                slope = float(np.polyfit(xs, ys, 1)[0])
-            except Exception:
-                slope = None
-
-        # event rates as mean over available sessions (ignore NaNs)
-        def mean01(col: str) -> Optional[float]:
-            if col not in g.columns:
-                return None
-            v = pd.to_numeric(g[col], errors="coerce")
-            if v.notna().any():
-                return float(v.mean())
-            return None
-
-        user_rows.append(
-            {
-                "user_id": user_id,
-                "sessions_scored": int(g_valid.shape[0]),
-                "mean_proactivity_score": float(pd.to_numeric(g["proactivity_score"], errors="coerce").mean())
-                if pd.to_numeric(g["proactivity_score"], errors="coerce").notna().any()
-                else None,
-                "score_slope_over_sessions": slope,
-                "timely_closure_rate": mean01("timely_closure"),
-                "focus_transition_rate": mean01("focus_transition"),
-                "barrier_handling_rate": mean01("barrier_handling"),
-                "deepening_move_rate": mean01("deepening_move"),
-                "total_assistant_turns": float(pd.to_numeric(g["assistant_turns"], errors="coerce").sum())
-                if pd.to_numeric(g["assistant_turns"], errors="coerce").notna().any()
-                else None,
-            }
-        )
+def _xlsx_cell(v: Any, na: Any = None) -> Any:
+    if v is None or v is na or (isinstance(v, float) and v != v):
+        return None
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False)
+    return v
+
+
+def write_xlsx_fast(df: "pd.DataFrame", path: Path) -> None:
+    """
+    Row-by-row xlsxwriter workbook in constant_memory mode (each row is flushed to disk once written).
+    Rows are written directly: pandas' to_excel emits cells column by column, which constant_memory
+    mode silently drops.
+    """
+    import pandas as pd
 
-    df_users = pd.DataFrame(user_rows)
-    return df_sessions, df_users, df_jsonl
+    wb = xlsxwriter.Workbook(str(path), {"constant_memory": True, "strings_to_urls": False})
+    ws = wb.add_worksheet("Sheet1")
+    ws.write_row(0, 0, list(df.columns))
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, [_xlsx_cell(v, pd.NA) for v in row])
+    wb.close()
+
+
+def write_xlsx(df: "pd.DataFrame", path: Path, engine: str = "xlsxwriter") -> None:
+    if engine == "xlsxwriter" and xlsxwriter is not None:
+        write_xlsx_fast(df, path)
+    else:
+        df.to_excel(path, index=False)
 
 
 def main() -> int:
@@ -485,6 +1089,26 @@ def main() -> int:
     ap.add_argument("--store", action="store_true")
     ap.add_argument("--user_filter", type=str, default=None)
     ap.add_argument("--prompt_path", type=str, default=None, help="Optional path to a system prompt text file.")
+    ap.add_argument("--mode", type=str, default="batch", choices=["batch", "online"],
+                    help="batch: Batch API (24h window); online: direct /v1/responses calls, rate limited")
+    ap.add_argument("--max_requests_per_batch", type=int, default=5_000,
+                    help="Split the batch input into shards of at most this many requests (0 = one batch)")
+    ap.add_argument("--poll_s", type=float, default=5.0,
+                    help="Initial batch polling interval (seconds); doubles per poll")
+    ap.add_argument("--max_poll_s", type=float, default=60.0, help="Cap for the backed-off polling interval (seconds)")
+    ap.add_argument("--concurrency", type=int, default=16, help="Max in-flight requests with --mode online")
+    ap.add_argument("--rpm", type=int, default=0, help="Requests-per-minute limit to pace --mode online (0 = unpaced)")
+    ap.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute limit to pace --mode online (0 = unpaced)")
+    ap.add_argument("--max_attempts", type=int, default=6, help="Attempts per request with --mode online")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Processes for parsing batch output (<= 1 parses serially; default: CPU count)")
+    ap.add_argument("--xlsx_engine", type=str, default="xlsxwriter", choices=["xlsxwriter", "pandas"],
+                    help="xlsxwriter: streamed row writes (falls back to pandas if not installed); pandas: to_excel")
+    ap.add_argument("--cache", dest="cache", action="store_true", default=True,
+                    help="Reuse results for sessions whose content, prompt, model and effort are unchanged (default)")
+    ap.add_argument("--no_cache", dest="cache", action="store_false", help="Always submit every session")
+    ap.add_argument("--no_dedup", dest="dedupe", action="store_false", default=True,
+                    help="Submit every session even if its transcript is identical to an earlier one")
     args = ap.parse_args()
 
     user_data_dir = Path(args.user_data_dir).resolve()
@@ -498,6 +1122,8 @@ def main() -> int:
 
     batch_input_path = out_dir / "batch_input.jsonl"
     request_index_path = out_dir / "request_index.json"
+    cache_path = out_dir / "processed_cache.jsonl"
+    cache = load_processed_cache(cache_path) if args.cache else None
 
     request_index = build_batch_input_jsonl(
         user_data_dir=user_data_dir,
@@ -508,83 +1134,133 @@ def main() -> int:
         reasoning_effort=args.reasoning_effort,
         store=args.store,
         user_filter=args.user_filter,
+        cache=cache,
+        dedupe=args.dedupe,
     )
 
     if not request_index:
         print("No requests prepared. Ensure chat_all.json exists under user_data/<user>/chats/.")
         return 1
 
-    client = OpenAI()
+    cached_ids = [r["custom_id"] for r in request_index if r.get("cached")]
+    n_dupes = sum(1 for r in request_index if r.get("duplicate_of"))
+    if cache is not None:
+        print(f"Prepared {len(request_index)} requests ({len(cached_ids)} served from {cache_path.name}).")
+    if n_dupes:
+        print(f"  {n_dupes} duplicate session(s) will reuse the result of an identical one.")
+    submitted = len(cached_ids) + n_dupes < len(request_index)
 
-    # Upload batch input
-    print("[1/6] Uploading batch input file (purpose='batch') ...")
-    up = client.files.create(file=batch_input_path.open("rb"), purpose="batch")
-    input_file_id = getattr(up, "id", None)
-    print(f"  Uploaded: file_id={input_file_id}")
-
-    # Create batch
-    print("[2/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
-    batch = client.batches.create(
-        input_file_id=input_file_id,
-        endpoint="/v1/responses",
-        completion_window="24h",
-    )
-    batch_id = getattr(batch, "id", None)
-    print(f"  Batch created: batch_id={batch_id}")
-
-    # Poll
-    print("[3/6] Polling until batch completes ...")
-    batch_final = poll_batch_until_complete(client, batch_id)
-
-    status = getattr(batch_final, "status", None)
-    print(f"  Final status: {status}")
-
-    output_file_id = getattr(batch_final, "output_file_id", None)
-    error_file_id = getattr(batch_final, "error_file_id", None)
-
-    if not output_file_id:
-        print("No output_file_id available. Batch may have failed validation. Check error file or dashboard.")
-        if error_file_id:
-            err_path = out_dir / "batch_error.jsonl"
-            download_file_content(client, error_file_id, err_path)
-            print(f"Downloaded error file to: {err_path}")
-        return 2
-
-    # Download outputs
-    print("[4/6] Downloading batch output ...")
     batch_output_path = out_dir / "batch_output.jsonl"
-    download_file_content(client, output_file_id, batch_output_path)
-    print(f"  Saved: {batch_output_path}")
+    failed_batch_ids: List[str] = []
+    if not submitted:
+        print("Every session has a cached result; nothing to submit.")
+    elif args.mode == "online":
+        print(f"[1/6] Calling /v1/responses directly (concurrency={args.concurrency}) ...")
+        output_lines = asyncio.run(
+            dispatch_online(
+                load_batch_requests(batch_input_path),
+                concurrency=args.concurrency,
+                rpm=args.rpm,
+                tpm=args.tpm,
+                max_attempts=args.max_attempts,
+            )
+        )
+        with batch_output_path.open("wb", buffering=JSONL_WRITE_BUFFER) as f:
+            for line in output_lines:
+                f.write(dumps_line(line))
+        print(f"  Saved: {batch_output_path}")
+    else:
+        from openai import OpenAI
+
+        client = OpenAI()
+        shards = split_batch_input(batch_input_path, args.max_requests_per_batch)
+
+        # Uploads/creates are independent HTTP calls, so the shards are submitted concurrently
+        print(f"[1/6] Uploading {len(shards)} batch input file(s) (purpose='batch') ...")
+        print("[2/6] Creating batch(es) (endpoint='/v1/responses', completion_window='24h') ...")
+        with ThreadPoolExecutor(max_workers=min(8, len(shards))) as ex:
+            batches = list(ex.map(lambda path: submit_batch(client, path), shards))
+        for path, (input_file_id, batch_id) in zip(shards, batches):
+            print(f"  {path.name}: file_id={input_file_id} batch_id={batch_id}")
+        batch_ids = [batch_id for _, batch_id in batches]
+
+        # Poll
+        print(f"[3/6] Polling until {len(batch_ids)} batch(es) complete ...")
+        finals = poll_batches_until_done(client, batch_ids, poll_s=args.poll_s, max_poll_s=args.max_poll_s)
+        for batch_final in finals:
+            print(f"  {batch_final.id} final status: {getattr(batch_final, 'status', None)}")
+
+        # Download outputs (one part per shard, concatenated in shard order)
+        multi = len(finals) > 1
+        output_parts: List[Path] = []
+        error_parts: List[Path] = []
+        print("[4/6] Downloading batch output ...")
+        for k, batch_final in enumerate(finals):
+            suffix = f".{k:03d}" if multi else ""
+            output_file_id = getattr(batch_final, "output_file_id", None)
+            error_file_id = getattr(batch_final, "error_file_id", None)
+            if output_file_id:
+                part = out_dir / f"batch_output{suffix}.jsonl"
+                download_file_content(client, output_file_id, part)
+                output_parts.append(part)
+            else:
+                failed_batch_ids.append(batch_final.id)
+                print(f"No output_file_id for {batch_final.id}. Batch may have failed validation. "
+                      "Check error file or dashboard.")
+            if error_file_id:
+                part = out_dir / f"batch_error{suffix}.jsonl"
+                download_file_content(client, error_file_id, part)
+                error_parts.append(part)
 
-    if error_file_id:
-        print("[5/6] Downloading batch error file ...")
         batch_error_path = out_dir / "batch_error.jsonl"
-        download_file_content(client, error_file_id, batch_error_path)
-        print(f"  Saved: {batch_error_path}")
+        if multi:
+            concat_files(output_parts, batch_output_path)
+            if error_parts:
+                concat_files(error_parts, batch_error_path)
+        if error_parts:
+            print(f"[5/6] Saved batch errors: {batch_error_path}")
+        if not output_parts:
+            return 2
+        if failed_batch_ids:
+            # Parse (and cache) what the other shards produced; only the failed batches' sessions are missing
+            print(f"  WARNING: {len(failed_batch_ids)} of {len(finals)} batches produced no output "
+                  f"({', '.join(failed_batch_ids)}); their sessions are missing from the results.")
+        print(f"  Saved: {batch_output_path}")
 
     # Parse and write results
     print("[6/6] Parsing outputs and writing XLSX ...")
-    records = parse_batch_output_jsonl(batch_output_path)
+    records = parse_batch_output_jsonl(batch_output_path, workers=args.workers) if submitted else []
+    records = expand_duplicates(records, request_index)
+    if cache is not None:
+        n_new = append_processed_cache(cache_path, records, request_index)
+        print(f"  Cached {n_new} new results -> {cache_path}")
+    if cached_ids or n_dupes:
+        for meta in request_index:
+            if meta.get("cached"):
+                records.append({**cache[(meta["custom_id"], meta["content_sha256"])], "custom_id": meta["custom_id"]})
+        # Keep the request order, as a run without cache hits or duplicates would
+        order = {r["custom_id"]: i for i, r in enumerate(request_index)}
+        records.sort(key=lambda r: order.get(r["custom_id"], len(order)))
     write_readable_outputs(records, out_dir / "readable")
 
-    df_sessions, df_users, df_jsonl = build_results_tables(records, request_index)
+    df_sessions, df_users, jsonl_rows = build_results_tables(records, request_index)
 
-    # Write JSONL
+    # Write JSONL (missing fields are omitted)
     results_jsonl_path = out_dir / "results.jsonl"
-    with results_jsonl_path.open("w", encoding="utf-8") as f:
-        for _, r in df_jsonl.iterrows():
-            f.write(json.dumps(r.dropna().to_dict(), ensure_ascii=False) + "\n")
+    with results_jsonl_path.open("wb", buffering=JSONL_WRITE_BUFFER) as f:
+        for row in jsonl_rows:
+            f.write(dumps_line({k: v for k, v in row.items() if v is not None}))
 
     # Write XLSX
     sessions_xlsx = out_dir / "results_sessions.xlsx"
     users_xlsx = out_dir / "results_users.xlsx"
-    df_sessions.to_excel(sessions_xlsx, index=False)
-    df_users.to_excel(users_xlsx, index=False)
+    write_xlsx(df_sessions, sessions_xlsx, engine=args.xlsx_engine)
+    write_xlsx(df_users, users_xlsx, engine=args.xlsx_engine)
 
     print(f"Wrote: {sessions_xlsx}")
     print(f"Wrote: {users_xlsx}")
     print(f"Wrote: {results_jsonl_path}")
-    return 0
+    return 2 if failed_batch_ids else 0
 
 
 if __name__ == "__main__":
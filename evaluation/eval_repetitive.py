@@ -22,11 +22,14 @@ New supported layout:
 Outputs (example):
   ../out_repetitive_eval/
     batch_input.jsonl
+    batch_input.NNN.jsonl  (shards, if more than --max_requests_per_batch requests)
     batch_output.jsonl
     batch_error.jsonl (if any)
     request_index.json
+    cache/<key>.json   (parsed judge results, reused by later runs; --no_cache to bypass)
     results.jsonl
-    results.xlsx
+    results.parquet
+    results.xlsx       (--no_xlsx to skip)
     readable/
       combined_readable.json
       per_item/
@@ -39,16 +42,31 @@ Notes:
 """
 
 import argparse
+import hashlib
 import json
-import re
+import os
+import random
+import shutil
 import sys
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import pandas as pd
 from openai import OpenAI
 
+try:
+    import orjson
+except ImportError:  # optional speedup, see dumps_line / loads
+    orjson = None
+
+try:
+    import xlsxwriter
+except ImportError:  # optional, see write_xlsx
+    xlsxwriter = None
+
 
 DEFAULT_JUDGE_SYSTEM_PROMPT = r"""
 You are an evaluation judge for a behavioral-health coaching dialogue system.
@@ -125,9 +143,6 @@ If uncertain, set uncertainty_flag=1 and explain briefly in redundancy_reason.
 # -------------------------
 # Helpers
 # -------------------------
-CHAT_FILE_RE = re.compile(r"^chat(\d+)\.json$", re.IGNORECASE)
-
-
 def safe_mkdir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
@@ -136,14 +151,49 @@ def read_text(path: Path) -> str:
     return path.read_text(encoding="utf-8")
 
 
+# orjson (C, emits UTF-8 bytes) on the hot paths when installed; stdlib json otherwise.
+if orjson is not None:
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+
+    def dumps_canonical(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+    def loads(data: Any) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def dumps_pretty(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    def dumps_canonical(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    def loads(data: Any) -> Any:
+        return json.loads(data)
+
+
 def load_json(path: Path) -> Any:
-    # tolerate BOM on Windows
-    raw = path.read_text(encoding="utf-8-sig")
-    return json.loads(raw)
+    raw = path.read_bytes()
+    if raw.startswith(b"\xef\xbb\xbf"):  # tolerate BOM on Windows
+        raw = raw[3:]
+    return loads(raw)
 
 
 def json_canonical_dumps(data: Any) -> str:
-    return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=2)
+    # Sorted keys, no whitespace: the judge does not need pretty-printing, and indentation only adds tokens.
+    return dumps_canonical(data).decode("utf-8")
 
 
 def read_json_as_canonical_text(path: Path) -> str:
@@ -151,6 +201,18 @@ def read_json_as_canonical_text(path: Path) -> str:
     return json_canonical_dumps(data)
 
 
+PARALLEL_CANON_MIN_CHATS = 64
+CANON_CHUNKSIZE = 16
+
+
+def read_canonical_texts(paths: List[Path], workers: int = 0) -> List[str]:
+    """read_json_as_canonical_text for each path, in order; uses a process pool for larger builds."""
+    if workers <= 1 or len(paths) < PARALLEL_CANON_MIN_CHATS:
+        return [read_json_as_canonical_text(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(read_json_as_canonical_text, paths, chunksize=CANON_CHUNKSIZE))
+
+
 def extract_output_text_from_responses_body(body: Dict[str, Any]) -> str:
     # Some SDKs provide output_text; batch raw body may not.
     if isinstance(body, dict) and "output_text" in body and isinstance(body["output_text"], str):
@@ -173,11 +235,18 @@ def extract_output_text_from_responses_body(body: Dict[str, Any]) -> str:
     if out_parts:
         return "\n".join(out_parts)
 
-    return json.dumps(body, ensure_ascii=False)
+    return dumps_bytes(body).decode("utf-8")
 
 
-def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: int = 15):
+def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: float = 2, max_poll_s: float = 60):
+    """
+    Poll with capped exponential backoff (x1.5 per round up to max_poll_s, plus up to 10% jitter).
+    The interval drops back to poll_s whenever request_counts.completed advanced, so the final drain
+    is noticed quickly.
+    """
     terminal = {"completed", "failed", "expired", "cancelled"}
+    delay = max(1.0, float(poll_s))
+    last_completed = 0
     while True:
         b = client.batches.retrieve(batch_id)
         status = b.status
@@ -185,7 +254,63 @@ def poll_batch_until_done(client: OpenAI, batch_id: str, poll_s: int = 15):
         print(f"[batch] {batch_id} status={status} request_counts={rc}")
         if status in terminal:
             return b
-        time.sleep(poll_s)
+        completed = getattr(rc, "completed", 0) or 0
+        if completed > last_completed:
+            last_completed = completed
+            delay = max(1.0, float(poll_s))
+        time.sleep(delay + random.uniform(0, delay * 0.1))
+        delay = min(delay * 1.5, max_poll_s)
+
+
+# Buffer for the JSONL outputs: the many small per-line writes become one write() per 8 MiB
+JSONL_WRITE_BUFFER = 1 << 23
+
+
+def split_batch_input(batch_input_jsonl: Path, max_requests_per_batch: int) -> List[Path]:
+    """
+    Split batch_input.jsonl into batch_input.000.jsonl, batch_input.001.jsonl, ... of at most
+    max_requests_per_batch lines each. Returns [batch_input_jsonl] unchanged if it already fits.
+    """
+    with batch_input_jsonl.open("rb") as fh:
+        n_lines = sum(1 for _ in fh)
+    if max_requests_per_batch <= 0 or n_lines <= max_requests_per_batch:
+        return [batch_input_jsonl]
+
+    shards: List[Path] = []
+    out = None
+    with batch_input_jsonl.open("rb") as fh:
+        for i, line in enumerate(fh):
+            if i % max_requests_per_batch == 0:
+                if out is not None:
+                    out.close()
+                shard = batch_input_jsonl.with_name(f"batch_input.{len(shards):03d}.jsonl")
+                shards.append(shard)
+                out = shard.open("wb", buffering=JSONL_WRITE_BUFFER)
+            out.write(line)
+    if out is not None:
+        out.close()
+    return shards
+
+
+def concat_files(parts: List[Path], dest: Path) -> None:
+    with dest.open("wb") as out:
+        for part in parts:
+            with part.open("rb") as fh:
+                shutil.copyfileobj(fh, out)
+
+
+def submit_batch(client: OpenAI, batch_input_jsonl: Path, model: str) -> Tuple[str, str]:
+    """Upload one batch input file and create its batch; returns (input_file_id, batch_id)."""
+    # The Batch API takes plain .jsonl only (no gzip); the with-block closes the handle even if the upload fails.
+    with batch_input_jsonl.open("rb") as fh:
+        batch_input_file = client.files.create(file=fh, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_input_file.id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+        metadata={"job": "in-session-redundancy-eval", "model": model},
+    )
+    return batch_input_file.id, batch.id
 
 
 def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
@@ -203,7 +328,8 @@ def download_file_content(client: OpenAI, file_id: str, out_path: Path) -> None:
 # Data discovery (user_data layout)
 # -------------------------
 def discover_users(user_data_dir: Path) -> List[Path]:
-    return [p for p in user_data_dir.iterdir() if p.is_dir()]
+    with os.scandir(user_data_dir) as it:
+        return [Path(e.path) for e in it if e.is_dir()]
 
 
 def discover_chats_for_user(user_dir: Path) -> List[Tuple[int, Path]]:
@@ -211,21 +337,54 @@ def discover_chats_for_user(user_dir: Path) -> List[Tuple[int, Path]]:
     if not chats_dir.exists():
         return []
     out: List[Tuple[int, Path]] = []
-    for p in chats_dir.iterdir():
-        if not p.is_file():
-            continue
-        if p.name.lower() == "chat_index.json":
-            continue
-        m = CHAT_FILE_RE.match(p.name)
-        if m:
-            out.append((int(m.group(1)), p))
+    # chat<N>.json, case-insensitive (chat_index.json is skipped by the digit test); plain string
+    # checks instead of a regex, and Path objects are only built for matched files
+    with os.scandir(chats_dir) as it:
+        for e in it:
+            low = e.name.lower()
+            if not (low.startswith("chat") and low.endswith(".json")):
+                continue
+            stem = low[4:-5]
+            if stem.isdecimal() and e.is_file():
+                out.append((int(stem), Path(e.path)))
     out.sort(key=lambda x: x[0])
     return out
 
 
+# -------------------------
+# Local judge-result cache
+# -------------------------
+def response_cache_key(system_prompt: str, session_text: str, model: str, reasoning_effort: str) -> str:
+    """Exact-match key: identical prompt, transcript, model and effort reuse the earlier judge result."""
+    h = hashlib.sha256()
+    for part in (system_prompt, session_text, model, reasoning_effort):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def load_cached_record(cache_dir: Path, key: str) -> Optional[Dict[str, Any]]:
+    """Cached parsed record for key, or None if missing/unreadable."""
+    try:
+        return load_json(cache_dir / f"{key}.json")
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_record(cache_dir: Path, key: str, rec: Dict[str, Any]) -> None:
+    path = cache_dir / f"{key}.json"
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_bytes(dumps_bytes(rec))
+    os.replace(tmp, path)
+
+
 # -------------------------
 # Batch builder
 # -------------------------
+SESSION_PAYLOAD_PREFIX = "Now evaluate the following single-session transcript JSON.\n\n<SESSION_JSON>\n"
+SESSION_PAYLOAD_SUFFIX = "\n</SESSION_JSON>"
+
+
 def build_batch_input_jsonl_from_user_data(
     user_data_dir: Path,
     out_jsonl: Path,
@@ -235,62 +394,82 @@ def build_batch_input_jsonl_from_user_data(
     reasoning_effort: str = "high",
     store: bool = False,
     user_filter: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+    workers: int = 0,
+    prompt_id: Optional[str] = None,
+    prompt_version: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
+    """
+    Write one request line per chat file and return the request index.
+    With cache_dir, each request gets a "cache_key" (see response_cache_key); chats whose key already
+    has a cached result are marked "cached": True and not written to the jsonl.
+    Chat files are canonicalized up front, in parallel when workers > 1 (see read_canonical_texts).
+    With prompt_id, requests reference that stored prompt (pinned to prompt_version if given) instead of
+    embedding system_prompt.
+    """
     users = discover_users(user_data_dir)
     if user_filter:
         users = [u for u in users if user_filter.lower() in u.name.lower()]
 
     request_index: List[Dict[str, Any]] = []
-    lines_written = 0
-
-    with out_jsonl.open("w", encoding="utf-8") as f:
-        for user_dir in users:
-            user_id = user_dir.name
-            chats = discover_chats_for_user(user_dir)
-            if not chats:
-                continue
-
-            for sess_idx, chat_path in chats:
-                custom_id = f"{user_id}__s{sess_idx}"
-                meta = {
-                    "custom_id": custom_id,
+    chat_paths: List[Path] = []
+    for user_dir in users:
+        user_id = user_dir.name
+        for sess_idx, chat_path in discover_chats_for_user(user_dir):
+            request_index.append(
+                {
+                    "custom_id": f"{user_id}__s{sess_idx}",
                     "user_id": user_id,
                     "session_id": sess_idx,
                     "file_path": str(chat_path),
                 }
-                request_index.append(meta)
-
-                session_text = read_json_as_canonical_text(chat_path)
-                user_payload = (
-                    "Now evaluate the following single-session transcript JSON.\n\n"
-                    "<SESSION_JSON>\n"
-                    f"{session_text}\n"
-                    "</SESSION_JSON>"
-                )
-
-                # IMPORTANT: no temperature here.
-                body = {
-                    "model": model,
-                    "input": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_payload},
-                    ],
-                    "store": store,
-                    "reasoning": {"effort": reasoning_effort},
-                }
-
-                line = {
-                    "custom_id": custom_id,
-                    "method": "POST",
-                    "url": "/v1/responses",
-                    "body": body,
-                }
-                f.write(json.dumps(line, ensure_ascii=False) + "\n")
-                lines_written += 1
+            )
+            chat_paths.append(chat_path)
+
+    session_texts = read_canonical_texts(chat_paths, workers=workers)
+
+    # Shared by every request body; only the user message differs per chat
+    system_msg = {"role": "system", "content": system_prompt}
+    prompt_ref: Optional[Dict[str, str]] = None
+    if prompt_id:
+        prompt_ref = {"id": prompt_id}
+        if prompt_version:
+            prompt_ref["version"] = prompt_version
+    reasoning = {"effort": reasoning_effort}
+    # A stored prompt is only identified by id+version; main disables the cache for an unpinned prompt_id
+    cache_prompt = f"prompt_id:{prompt_id}@{prompt_version or ''}" if prompt_id else system_prompt
+
+    with out_jsonl.open("wb", buffering=JSONL_WRITE_BUFFER) as f:
+        for meta, session_text in zip(request_index, session_texts):
+            custom_id = meta["custom_id"]
+            if cache_dir is not None:
+                key = response_cache_key(cache_prompt, session_text, model, reasoning_effort)
+                meta["cache_key"] = key
+                if (cache_dir / f"{key}.json").exists():
+                    meta["cached"] = True
+                    continue
+
+            user_msg = {"role": "user", "content": SESSION_PAYLOAD_PREFIX + session_text + SESSION_PAYLOAD_SUFFIX}
+
+            # IMPORTANT: no temperature here.
+            if prompt_ref is not None:
+                body = {"model": model, "prompt": prompt_ref, "input": [user_msg]}
+            else:
+                body = {"model": model, "input": [system_msg, user_msg]}
+            body["store"] = store
+            body["reasoning"] = reasoning
+
+            line = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/responses",
+                "body": body,
+            }
+            f.write(dumps_line(line))
 
-    request_index_path.write_text(json.dumps(request_index, ensure_ascii=False, indent=2), encoding="utf-8")
+    request_index_path.write_bytes(dumps_pretty(request_index))
 
-    if lines_written == 0:
+    if not request_index:
         raise RuntimeError(f"No requests built. Check user_data_dir={user_data_dir}")
 
     return request_index
@@ -301,84 +480,142 @@ def build_batch_input_jsonl_from_user_data(
 # -------------------------
 def parse_batch_output_jsonl(batch_output_path: Path) -> List[Dict[str, Any]]:
     records: List[Dict[str, Any]] = []
-    for line in batch_output_path.read_text(encoding="utf-8").splitlines():
-        if not line.strip():
-            continue
-        obj = json.loads(line)
-
-        custom_id = obj.get("custom_id")
-        err = obj.get("error")
-        resp = obj.get("response") or {}
-        status_code = resp.get("status_code")
-        body = resp.get("body") if isinstance(resp, dict) else None
-        body = body if isinstance(body, dict) else {}
-
-        output_text = ""
-        parsed = None
-        parse_error = None
-        summary = {}
-
-        if err is None and status_code == 200 and isinstance(body, dict):
-            output_text = extract_output_text_from_responses_body(body)
-            try:
-                parsed = json.loads(output_text)
-                summary = (parsed.get("summary") if isinstance(parsed, dict) else {}) or {}
-            except Exception as e:
-                parse_error = f"{type(e).__name__}: {e}"
-        else:
-            parse_error = f"request_error: {err or body.get('error', {})}"
-
-        records.append(
-            {
-                "custom_id": custom_id,
-                "status_code": status_code,
-                "error": err,
-                "output_text": output_text,
-                "parsed": parsed,
-                "parse_error": parse_error,
-                "total_suggestions": summary.get("total_suggestions"),
-                "redundant_suggestions": summary.get("redundant_suggestions"),
-                "redundancy_rate": summary.get("redundancy_rate"),
-                "notes": summary.get("notes"),
-                "model": body.get("model"),
-                "system_fingerprint": body.get("system_fingerprint"),
-            }
-        )
+    # Iterate the file instead of reading it whole: outputs for large batches run to hundreds of MB.
+    with batch_output_path.open("rb") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            obj = loads(line)
+
+            custom_id = obj.get("custom_id")
+            err = obj.get("error")
+            resp = obj.get("response") or {}
+            status_code = resp.get("status_code")
+            body = resp.get("body") if isinstance(resp, dict) else None
+            body = body if isinstance(body, dict) else {}
+
+            output_text = ""
+            parsed = None
+            parse_error = None
+            summary = {}
+
+            if err is None and status_code == 200 and isinstance(body, dict):
+                output_text = extract_output_text_from_responses_body(body)
+                try:
+                    parsed = loads(output_text)
+                    summary = (parsed.get("summary") if isinstance(parsed, dict) else {}) or {}
+                except Exception as e:
+                    parse_error = f"{type(e).__name__}: {e}"
+            else:
+                parse_error = f"request_error: {err or body.get('error', {})}"
+
+            records.append(
+                {
+                    "custom_id": custom_id,
+                    "status_code": status_code,
+                    "error": err,
+                    "output_text": output_text,
+                    "parsed": parsed,
+                    "parse_error": parse_error,
+                    "total_suggestions": summary.get("total_suggestions"),
+                    "redundant_suggestions": summary.get("redundant_suggestions"),
+                    "redundancy_rate": summary.get("redundancy_rate"),
+                    "notes": summary.get("notes"),
+                    "model": body.get("model"),
+                    "system_fingerprint": body.get("system_fingerprint"),
+                }
+            )
     return records
 
 
+# Threads for the per-item readable files (small writes; the GIL is released during file I/O)
+READABLE_WRITE_THREADS = 16
+
+
 def write_readable_outputs(out_dir: Path, request_index: List[Dict[str, Any]], records: List[Dict[str, Any]]) -> None:
+    """Per-item files are written by a thread pool (a bounded number pending); combined_readable.json once at the end."""
     readable_dir = out_dir / "readable"
     per_item_dir = readable_dir / "per_item"
     safe_mkdir(per_item_dir)
 
     idx_map = {r["custom_id"]: r for r in request_index}
     combined: Dict[str, Any] = {}
+    pending: Deque[Any] = deque()
 
-    for rec in records:
-        cid = rec["custom_id"]
-        meta = idx_map.get(cid, {})
-        item = {
-            "meta": meta,
-            "status_code": rec["status_code"],
-            "parse_error": rec["parse_error"],
-            "judge": rec["parsed"],
-            "output_text": rec["output_text"],
-            "model": rec["model"],
-            "system_fingerprint": rec["system_fingerprint"],
-        }
-
-        (per_item_dir / f"{cid}.json").write_text(json.dumps(item, ensure_ascii=False, indent=2), encoding="utf-8")
-
-        user_id = meta.get("user_id", "UNKNOWN_USER")
-        session_id = str(meta.get("session_id", "UNKNOWN_SESSION"))
-        combined.setdefault(user_id, {})
-        combined[user_id][session_id] = item
-
-    (readable_dir / "combined_readable.json").write_text(
-        json.dumps(combined, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    with ThreadPoolExecutor(max_workers=READABLE_WRITE_THREADS) as ex:
+        for rec in records:
+            cid = rec["custom_id"]
+            meta = idx_map.get(cid, {})
+            item = {
+                "meta": meta,
+                "status_code": rec["status_code"],
+                "parse_error": rec["parse_error"],
+                "judge": rec["parsed"],
+                "output_text": rec["output_text"],
+                "model": rec["model"],
+                "system_fingerprint": rec["system_fingerprint"],
+            }
+
+            pending.append(ex.submit((per_item_dir / f"{cid}.json").write_bytes, dumps_pretty(item)))
+            if len(pending) > 16 * READABLE_WRITE_THREADS:
+                pending.popleft().result()
+
+            user_id = meta.get("user_id", "UNKNOWN_USER")
+            session_id = str(meta.get("session_id", "UNKNOWN_SESSION"))
+            combined.setdefault(user_id, {})
+            combined[user_id][session_id] = item
+
+        for fut in pending:
+            fut.result()
+
+    (readable_dir / "combined_readable.json").write_bytes(dumps_pretty(combined))
+
+
+# -------------------------
+# results.xlsx
+# -------------------------
+# request_index fields copied into each results.jsonl row
+RESULT_META_KEYS = ("user_id", "session_id", "file_path")
+
+RESULT_COLUMNS = [
+    "user_id",
+    "session_id",
+    "custom_id",
+    "status_code",
+    "parse_error",
+    "total_suggestions",
+    "redundant_suggestions",
+    "redundancy_rate",
+    "notes",
+    "file_path",
+    "model",
+    "system_fingerprint",
+]
+
+
+def _xlsx_cell(v: Any) -> Any:
+    if v is None or v is pd.NA or (isinstance(v, float) and v != v):
+        return None
+    if isinstance(v, (dict, list)):
+        return dumps_bytes(v).decode("utf-8")
+    return v
+
+
+def write_xlsx(df: pd.DataFrame, path: Path) -> None:
+    """
+    Row-by-row xlsxwriter workbook in constant_memory mode (each row is flushed to disk once written);
+    falls back to df.to_excel without xlsxwriter. Rows are written directly: pandas' to_excel emits
+    cells column by column, which constant_memory mode silently drops.
+    """
+    if xlsxwriter is None:
+        df.to_excel(path, index=False)
+        return
+    wb = xlsxwriter.Workbook(str(path), {"constant_memory": True, "strings_to_urls": False})
+    ws = wb.add_worksheet("Sheet1")
+    ws.write_row(0, 0, list(df.columns))
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(i, 0, [_xlsx_cell(v) for v in row])
+    wb.close()
 
 
 # -------------------------
@@ -390,14 +627,31 @@ def main() -> int:
     ap.add_argument("--out_dir", default="../out_repetitive_eval", help="Directory to write outputs")
     ap.add_argument("--model", default="gpt-5.2-pro", help="Model id (default: gpt-5.2-pro)")
     ap.add_argument("--prompt_file", default="", help="Optional: path to a system prompt text file")
+    ap.add_argument("--prompt_id", default="",
+                    help="Optional: stored prompt id sent as body.prompt instead of the system prompt text")
+    ap.add_argument("--prompt_version", default="",
+                    help="Optional: pin the --prompt_id version (without it the judge-result cache is disabled)")
     ap.add_argument(
         "--reasoning_effort",
         default="high",
         choices=["none", "low", "medium", "high", "xhigh"],
         help="Reasoning effort for GPT-5.* reasoning models (temperature is NOT used).",
     )
-    ap.add_argument("--poll_s", type=int, default=15, help="Polling interval seconds")
+    ap.add_argument("--poll_s", type=float, default=2.0,
+                    help="Initial batch polling interval (seconds); grows x1.5 per poll, reset when requests complete")
+    ap.add_argument("--max_poll_s", type=float, default=60.0, help="Cap for the backed-off polling interval (seconds)")
+    ap.add_argument("--max_requests_per_batch", type=int, default=5_000,
+                    help="Split the batch input into shards of at most this many requests (0 = one batch)")
     ap.add_argument("--user_filter", default="", help="Optional: only evaluate users whose folder name contains this substring")
+    ap.add_argument("--cache", dest="cache", action="store_true", default=True,
+                    help="Reuse judge results for unchanged (prompt, chat, model, effort) inputs (default)")
+    ap.add_argument("--no_cache", dest="cache", action="store_false", help="Always submit every chat")
+    ap.add_argument("--cache_dir", default="", help="Judge-result cache directory (default: <out_dir>/cache)")
+    ap.add_argument("--xlsx", dest="xlsx", action="store_true", default=True,
+                    help="Also write results.xlsx next to results.parquet (default)")
+    ap.add_argument("--no_xlsx", dest="xlsx", action="store_false", help="Skip results.xlsx")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Processes for canonicalizing chat files (<= 1 runs serially; default: CPU count)")
     args = ap.parse_args()
 
     user_data_dir = Path(args.user_data_dir).expanduser().resolve()
@@ -411,6 +665,16 @@ def main() -> int:
     batch_input_jsonl = out_dir / "batch_input.jsonl"
     request_index_path = out_dir / "request_index.json"
 
+    if args.prompt_id and not args.prompt_version and args.cache:
+        # The stored prompt can change under the same id, so cached results could be stale
+        print("  [INFO] --prompt_id without --prompt_version: judge-result cache disabled")
+        args.cache = False
+
+    cache_dir = None
+    if args.cache:
+        cache_dir = Path(args.cache_dir).expanduser().resolve() if args.cache_dir else out_dir / "cache"
+        safe_mkdir(cache_dir)
+
     print(f"[1/6] Building batch input jsonl -> {batch_input_jsonl}")
     request_index = build_batch_input_jsonl_from_user_data(
         user_data_dir=user_data_dir,
@@ -421,103 +685,135 @@ def main() -> int:
         reasoning_effort=args.reasoning_effort,
         store=False,
         user_filter=(args.user_filter or None),
+        cache_dir=cache_dir,
+        workers=args.workers,
+        prompt_id=(args.prompt_id or None),
+        prompt_version=(args.prompt_version or None),
     )
-    print(f"  Prepared {len(request_index)} requests. Saved index -> {request_index_path}")
-
-    client = OpenAI()
-
-    print("[2/6] Uploading batch input file (purpose='batch') ...")
-    batch_input_file = client.files.create(file=batch_input_jsonl.open("rb"), purpose="batch")
-    batch_input_file_id = batch_input_file.id
-    print(f"  Uploaded: file_id={batch_input_file_id}")
+    cached = [r for r in request_index if r.get("cached")]
+    print(f"  Prepared {len(request_index)} requests ({len(cached)} served from cache). "
+          f"Saved index -> {request_index_path}")
 
-    print("[3/6] Creating batch (endpoint='/v1/responses', completion_window='24h') ...")
-    batch = client.batches.create(
-        input_file_id=batch_input_file_id,
-        endpoint="/v1/responses",
-        completion_window="24h",
-        metadata={"job": "in-session-redundancy-eval", "model": args.model},
-    )
-    batch_id = batch.id
-    print(f"  Batch created: batch_id={batch_id}")
-
-    print("[4/6] Polling until batch completes ...")
-    batch_final = poll_batch_until_done(client, batch_id, poll_s=args.poll_s)
-    status = batch_final.status
-    print(f"  Final status: {status}")
-
-    output_file_id = batch_final.output_file_id
-    error_file_id = batch_final.error_file_id
-
-    if not output_file_id:
-        print("No output_file_id available. Likely 0 successful requests.")
-        print("request_counts:", batch_final.request_counts)
-        print("error_file_id:", error_file_id)
-        if error_file_id:
-            err_path = out_dir / "batch_error.jsonl"
-            download_file_content(client, error_file_id, err_path)
-            print(f"Downloaded errors -> {err_path}")
-        return 2
-
-    print("[5/6] Downloading output file(s) ...")
-    batch_output_path = out_dir / "batch_output.jsonl"
-    download_file_content(client, output_file_id, batch_output_path)
-    print(f"  Saved: {batch_output_path}")
-
-    if error_file_id:
+    records: List[Dict[str, Any]] = []
+    batch_id = None
+    failed_batch_ids: List[str] = []
+    if len(cached) < len(request_index):
+        client = OpenAI()
+
+        shards = split_batch_input(batch_input_jsonl, args.max_requests_per_batch)
+
+        # Uploads/creates are independent HTTP calls, so the shards are submitted concurrently
+        print(f"[2/6] Uploading {len(shards)} batch input file(s) (purpose='batch') ...")
+        print("[3/6] Creating batch(es) (endpoint='/v1/responses', completion_window='24h') ...")
+        with ThreadPoolExecutor(max_workers=min(8, len(shards))) as ex:
+            batches = list(ex.map(lambda path: submit_batch(client, path, args.model), shards))
+        for path, (input_file_id, bid) in zip(shards, batches):
+            print(f"  {path.name}: file_id={input_file_id} batch_id={bid}")
+        batch_ids = [bid for _, bid in batches]
+        batch_id = ", ".join(batch_ids)
+
+        print(f"[4/6] Polling until {len(batch_ids)} batch(es) complete ...")
+        with ThreadPoolExecutor(max_workers=min(8, len(batch_ids))) as ex:
+            finals = list(ex.map(lambda bid: poll_batch_until_done(client, bid, args.poll_s, args.max_poll_s),
+                                batch_ids))
+        for batch_final in finals:
+            print(f"  {batch_final.id} final status: {batch_final.status}")
+
+        # One output/error part per shard, concatenated in shard order
+        multi = len(finals) > 1
+        output_parts: List[Path] = []
+        error_parts: List[Path] = []
+        print("[5/6] Downloading output file(s) ...")
+        for k, batch_final in enumerate(finals):
+            suffix = f".{k:03d}" if multi else ""
+            output_file_id = batch_final.output_file_id
+            error_file_id = batch_final.error_file_id
+            if output_file_id:
+                part = out_dir / f"batch_output{suffix}.jsonl"
+                download_file_content(client, output_file_id, part)
+                output_parts.append(part)
+            else:
+                failed_batch_ids.append(batch_final.id)
+                print(f"No output_file_id available for {batch_final.id}. Likely 0 successful requests.")
+                print("request_counts:", batch_final.request_counts)
+                print("error_file_id:", error_file_id)
+            if error_file_id:
+                part = out_dir / f"batch_error{suffix}.jsonl"
+                download_file_content(client, error_file_id, part)
+                error_parts.append(part)
+
+        batch_output_path = out_dir / "batch_output.jsonl"
         batch_error_path = out_dir / "batch_error.jsonl"
-        download_file_content(client, error_file_id, batch_error_path)
-        print(f"  Saved: {batch_error_path}")
+        if multi:
+            concat_files(output_parts, batch_output_path)
+            if error_parts:
+                concat_files(error_parts, batch_error_path)
+        if error_parts:
+            print(f"  Saved: {batch_error_path}")
+        if not output_parts:
+            return 2
+        if failed_batch_ids:
+            # Parse (and cache) what the other shards produced; only the failed batches' chats are missing
+            print(f"  WARNING: {len(failed_batch_ids)} of {len(finals)} batches produced no output "
+                  f"({', '.join(failed_batch_ids)}); their chats are missing from the results.")
+        print(f"  Saved: {batch_output_path}")
+
+        records = parse_batch_output_jsonl(batch_output_path)
+    else:
+        print("[2/6] All requests served from cache; skipping batch submission.")
 
     print("[6/6] Parsing outputs and writing results ...")
-    records = parse_batch_output_jsonl(batch_output_path)
+    if cache_dir is not None:
+        key_by_id = {r["custom_id"]: r["cache_key"] for r in request_index}
+        for rec in records:
+            if rec["status_code"] == 200 and rec["parse_error"] is None and rec["custom_id"] in key_by_id:
+                save_cached_record(cache_dir, key_by_id[rec["custom_id"]],
+                                   {k: v for k, v in rec.items() if k != "custom_id"})
+        for meta in cached:
+            hit = load_cached_record(cache_dir, meta["cache_key"])
+            if hit is None:
+                print(f"  [WARN] unreadable cache entry for {meta['custom_id']}: {meta['cache_key']}")
+                continue
+            records.append({**hit, "custom_id": meta["custom_id"]})
 
     # Map custom_id -> meta
     idx_map = {r["custom_id"]: r for r in request_index}
 
-    # Write results.jsonl (enriched with user/session info)
+    # Write results.jsonl (records enriched in place with user/session info; record fields win on conflict)
     results_jsonl = out_dir / "results.jsonl"
-    enriched: List[Dict[str, Any]] = []
-    with results_jsonl.open("w", encoding="utf-8") as f:
+    with results_jsonl.open("wb", buffering=JSONL_WRITE_BUFFER) as f:
         for rec in records:
             meta = idx_map.get(rec["custom_id"], {})
-            out = {**meta, **rec}
-            enriched.append(out)
-            f.write(json.dumps(out, ensure_ascii=False) + "\n")
+            for k in RESULT_META_KEYS:  # not cache_key / cached, which are request-index bookkeeping
+                if k in meta:
+                    rec.setdefault(k, meta[k])
+            f.write(dumps_line(rec))
     print(f"  Saved: {results_jsonl}")
 
     # Write results.xlsx
-    df = pd.DataFrame(
-        [
-            {
-                "user_id": r.get("user_id"),
-                "session_id": r.get("session_id"),
-                "custom_id": r.get("custom_id"),
-                "status_code": r.get("status_code"),
-                "parse_error": r.get("parse_error"),
-                "total_suggestions": r.get("total_suggestions"),
-                "redundant_suggestions": r.get("redundant_suggestions"),
-                "redundancy_rate": r.get("redundancy_rate"),
-                "notes": r.get("notes"),
-                "file_path": r.get("file_path"),
-                "model": r.get("model"),
-                "system_fingerprint": r.get("system_fingerprint"),
-            }
-            for r in enriched
-        ]
+    df = pd.DataFrame.from_records(
+        [tuple(r.get(c) for c in RESULT_COLUMNS) for r in records], columns=RESULT_COLUMNS
     ).sort_values(by=["user_id", "session_id"])
 
-    xlsx_path = out_dir / "results.xlsx"
-    df.to_excel(xlsx_path, index=False)
-    print(f"  Saved: {xlsx_path}")
+    parquet_path = out_dir / "results.parquet"
+    try:
+        df.to_parquet(parquet_path, engine="pyarrow", compression="zstd", index=False)
+        print(f"  Saved: {parquet_path}")
+    except (ImportError, TypeError, ValueError) as e:  # pyarrow missing, or mixed-type judge fields
+        print(f"  [WARN] results.parquet not written: {type(e).__name__}: {e}")
+
+    if args.xlsx:
+        xlsx_path = out_dir / "results.xlsx"
+        write_xlsx(df, xlsx_path)
+        print(f"  Saved: {xlsx_path}")
 
     # Readable JSON outputs
     write_readable_outputs(out_dir, request_index, records)
     print(f"  Saved readable JSON -> {out_dir / 'readable'}")
 
     print("\nDone.")
-    print(f"Batch id: {batch_id}")
-    return 0
+    print(f"Batch id(s): {batch_id}")
+    return 2 if failed_batch_ids else 0
 
 
 if __name__ == "__main__":